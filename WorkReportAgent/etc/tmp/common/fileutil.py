@@ -0,0 +1,54 @@
+import os
+import json
+import hashlib
+
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_COUNT = 3
+
+def file_fingerprint(filepath, sample_size=SAMPLE_SIZE, samples=SAMPLE_COUNT):
+    """Cheap content fingerprint: size, mtime and a hash of a few evenly spaced samples.
+
+    Reads at most samples * sample_size bytes, so it stays fast on multi-GB recordings.
+    """
+    stat = os.stat(filepath)
+    digest = hashlib.blake2b(digest_size=16)
+    with open(filepath, 'rb') as f:
+        if stat.st_size <= sample_size * samples:
+            digest.update(f.read())
+        else:
+            step = (stat.st_size - sample_size) // (samples - 1)
+            for i in range(samples):
+                f.seek(i * step)
+                digest.update(f.read(sample_size))
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "sample_hash": digest.hexdigest(),
+    }
+
+def atomic_write_json(path, data):
+    """Write JSON via a temp file + rename so readers never see a partial file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+HASH_CHUNK_SIZE = 8 * 1024 * 1024
+_content_hashes = {}
+
+def content_hash(filepath):
+    """Full SHA-256 of the file contents, streamed in chunks.
+
+    Memoized per (path, size, mtime) so repeated lookups in one process are free.
+    """
+    stat = os.stat(filepath)
+    memo_key = (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _content_hashes:
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        _content_hashes[memo_key] = digest.hexdigest()
+    return _content_hashes[memo_key]
@@ -0,0 +1,177 @@
+import os
+import json
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from common.fileutil import file_fingerprint, atomic_write_json
+from common.tracing import span
+
+INDEX_NAME = ".media_index.json"
+DEFAULT_PROBE_WORKERS = 8
+
+def probe_file(filepath, keyframes=False):
+    """Run ffprobe once and return the full format/stream info (plus keyframe times if requested)."""
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-show_format",
+        "-show_streams",
+        "-of", "json",
+        filepath
+    ]
+    with span("ffprobe", file=os.path.basename(filepath)):
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    info = json.loads(result.stdout)
+    if keyframes:
+        info["keyframes"] = probe_keyframes(filepath)
+    return info
+
+def probe_keyframes(filepath):
+    """Keyframe timestamps (seconds) of the first video stream, read from packet flags without decoding."""
+    cmd = [
+        "ffprobe",
+        "-v", "error",
+        "-select_streams", "v:0",
+        "-show_entries", "packet=pts_time,flags",
+        "-of", "csv=print_section=0",
+        filepath
+    ]
+    with span("ffprobe.keyframes", file=os.path.basename(filepath)):
+        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    times = []
+    for line in result.stdout.splitlines():
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            times.append(float(pts_time))
+    return sorted(times)
+
+class MediaIndex:
+    """ffprobe results for the media files of one directory, cached in <directory>/.media_index.json.
+
+    Entries are keyed by file name and invalidated when the file's fingerprint changes.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, INDEX_NAME)
+        self._lock = threading.Lock()
+        self._save_failed = False
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f).get("entries", {})
+            except Exception as e:
+                print(f"Error loading media index {self.path}, starting fresh: {e}")
+
+    def _cached(self, filepath, fingerprint, keyframes):
+        entry = self.entries.get(os.path.basename(filepath))
+        if not entry or entry.get("fingerprint") != fingerprint:
+            return None
+        if keyframes and "keyframes" not in entry["info"]:
+            return None
+        return entry["info"]
+
+    def _probe(self, filepath, keyframes):
+        """Probe filepath if the cached entry is missing or stale. Returns (info, changed)."""
+        fingerprint = file_fingerprint(filepath)
+        name = os.path.basename(filepath)
+        with self._lock:
+            info = self._cached(filepath, fingerprint, keyframes)
+            entry = self.entries.get(name)
+        if info is not None:
+            return info, False
+
+        if entry and entry.get("fingerprint") == fingerprint:
+            # Same file version indexed without keyframes: only the packet scan is missing
+            info = dict(entry["info"], keyframes=probe_keyframes(filepath))
+        else:
+            info = probe_file(filepath, keyframes=keyframes)
+        with self._lock:
+            self.entries[name] = {"fingerprint": fingerprint, "info": info}
+        return info, True
+
+    def get(self, filepath, keyframes=False):
+        """Full ffprobe info for filepath, probing only if the file changed since it was indexed."""
+        info, changed = self._probe(filepath, keyframes)
+        if changed:
+            self.save()
+        return info
+
+    def probe_many(self, filepaths, max_workers=DEFAULT_PROBE_WORKERS, keyframes=False):
+        """Index many files in one pass with concurrent ffprobe processes. Returns {path: info or None}."""
+        def probe(filepath):
+            try:
+                return self._probe(filepath, keyframes)
+            except Exception as e:
+                print(f"Error probing {filepath}: {e}")
+                return None, False
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = dict(zip(filepaths, executor.map(probe, filepaths)))
+
+        if any(changed for _, changed in results.values()):
+            self.save()
+        return {filepath: info for filepath, (info, _) in results.items()}
+
+    def save(self):
+        with self._lock:
+            try:
+                atomic_write_json(self.path, {"version": 1, "entries": self.entries})
+            except OSError as e:
+                # Read-only input directories still get the in-memory cache
+                if not self._save_failed:
+                    print(f"Could not write media index {self.path}: {e}")
+                    self._save_failed = True
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def index_for(filepath):
+    """Shared MediaIndex for the directory containing filepath."""
+    directory = os.path.dirname(os.path.abspath(filepath))
+    with _indexes_lock:
+        if directory not in _indexes:
+            _indexes[directory] = MediaIndex(directory)
+        return _indexes[directory]
+
+def probe_files(filepaths, max_workers=DEFAULT_PROBE_WORKERS, keyframes=False):
+    """Index files from any number of directories concurrently. Returns {path: info or None}."""
+    by_directory = {}
+    for filepath in filepaths:
+        by_directory.setdefault(os.path.dirname(os.path.abspath(filepath)), []).append(filepath)
+    results = {}
+    for paths in by_directory.values():
+        results.update(index_for(paths[0]).probe_many(paths, max_workers=max_workers, keyframes=keyframes))
+    return results
+
+def get_media_info(filepath, keyframes=False):
+    """Cached ffprobe info for a single file."""
+    return index_for(filepath).get(filepath, keyframes=keyframes)
+
+def video_summary(info):
+    """Commonly used fields of the first video stream: fps, bit_rate, duration, width, height, codec."""
+    streams = [s for s in info.get('streams', []) if s.get('codec_type') == 'video']
+    if not streams:
+        return None
+    stream = streams[0]
+    fmt = info.get('format', {})
+
+    fps = 0.0
+    r_frame_rate = stream.get('r_frame_rate')
+    if r_frame_rate:
+        num, den = map(int, r_frame_rate.split('/'))
+        fps = num / den if den else 0.0
+
+    bit_rate = stream.get('bit_rate') or fmt.get('bit_rate')
+    duration = stream.get('duration') or fmt.get('duration')
+    return {
+        "fps": fps,
+        "bit_rate": int(bit_rate) if bit_rate else 0,
+        "duration": float(duration) if duration else 0.0,
+        "width": stream.get('width'),
+        "height": stream.get('height'),
+        "codec": stream.get('codec_name'),
+        "creation_time": fmt.get('tags', {}).get('creation_time'),
+        "keyframes": info.get('keyframes'),
+    }
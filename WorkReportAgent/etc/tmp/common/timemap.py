@@ -0,0 +1,87 @@
+import json
+from datetime import datetime, timedelta
+
+TIMEMAP_SUFFIX = ".timemap.json"
+
+def timemap_path(video_path):
+    """Sidecar path holding the output -> source time map of a converted video."""
+    return f"{video_path}{TIMEMAP_SUFFIX}"
+
+def make_timemap(source_name, source_duration, segments, recording_start=None):
+    """Build a time map from kept segments.
+
+    Each segment is a dict with out_start, out_end, src_start and src_end (seconds).
+    Source time between two kept segments was dropped from the output.
+    """
+    return {
+        "version": 1,
+        "source": source_name,
+        "recording_start": recording_start,
+        "source_duration": source_duration,
+        "output_duration": segments[-1]["out_end"] if segments else 0.0,
+        "segments": segments,
+    }
+
+def uniform_timemap(source_name, source_duration, speed_factor, recording_start=None):
+    """Time map of a constant-speed timelapse."""
+    segment = {
+        "out_start": 0.0,
+        "out_end": source_duration / speed_factor,
+        "src_start": 0.0,
+        "src_end": source_duration,
+    }
+    return make_timemap(source_name, source_duration, [segment], recording_start)
+
+def load_timemap(video_path):
+    """Time map of a converted video, or None if it has no sidecar."""
+    try:
+        with open(timemap_path(video_path), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def output_to_source(timemap, seconds):
+    """Map a time in the converted video to seconds in the original recording."""
+    segments = timemap["segments"]
+    if not segments:
+        return seconds
+    for segment in segments:
+        if seconds < segment["out_end"]:
+            break
+    out_span = segment["out_end"] - segment["out_start"]
+    src_span = segment["src_end"] - segment["src_start"]
+    offset = min(max(seconds - segment["out_start"], 0.0), out_span)
+    if out_span <= 0:
+        return segment["src_start"]
+    return segment["src_start"] + offset * src_span / out_span
+
+def parse_timestamp(timestamp_str):
+    """'MM:SS' or 'HH:MM:SS' -> seconds."""
+    parts = list(map(int, timestamp_str.split(':')))
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+def format_timestamp(seconds):
+    """Seconds -> 'MM:SS', or 'HH:MM:SS' past one hour."""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, secs = divmod(rest, 60)
+    if hours:
+        return f"{hours:02d}:{minutes:02d}:{secs:02d}"
+    return f"{minutes:02d}:{secs:02d}"
+
+def source_clock(timemap, timestamp_str):
+    """Original time for an output timestamp: wall-clock 'HH:MM:SS' when the recording start is known,
+    otherwise the offset into the original recording.
+    """
+    seconds = output_to_source(timemap, parse_timestamp(timestamp_str))
+    start = timemap.get("recording_start")
+    if start:
+        try:
+            wall = datetime.fromisoformat(start.replace('Z', '+00:00')).astimezone() + timedelta(seconds=seconds)
+            return wall.strftime("%H:%M:%S")
+        except ValueError:
+            pass
+    return format_timestamp(seconds)
@@ -0,0 +1,226 @@
+import os
+import json
+import time
+import threading
+import functools
+from datetime import datetime
+
+# Counters summed per stage in the summary table (other attributes are only exported)
+SUMMED_COUNTERS = ("bytes", "prompt_tokens", "output_tokens", "total_tokens")
+
+class _NullSpan:
+    """Returned by span() while tracing is disabled: every method is a no-op."""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, **counters):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Span:
+    """One timed stage. Use as a context manager; set() records attributes, add() increments counters."""
+    __slots__ = ("tracer", "name", "attrs", "start_ns", "parent", "id")
+
+    def __init__(self, tracer, name, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.start_ns = 0
+        self.parent = None
+        self.id = None
+
+    def __enter__(self):
+        self.tracer._push(self)
+        self.start_ns = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end_ns = time.perf_counter_ns()
+        if exc_type is not None:
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"
+        self.tracer._pop(self, end_ns)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, **counters):
+        for key, value in counters.items():
+            self.attrs[key] = self.attrs.get(key, 0) + (value or 0)
+
+class Tracer:
+    """Collects finished spans in memory; written out once by finish()."""
+
+    def __init__(self, output_dir, run_name):
+        self.output_dir = output_dir
+        self.run_name = run_name
+        self.pid = os.getpid()
+        self.records = []
+        self.thread_names = {}
+        self.origin_ns = time.perf_counter_ns()
+        self.origin_epoch_us = time.time_ns() // 1000
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def span(self, name, attrs):
+        return Span(self, name, attrs)
+
+    def _push(self, span):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        span.parent = stack[-1].id if stack else None
+        with self._lock:
+            self._next_id += 1
+            span.id = self._next_id
+        stack.append(span)
+
+    def _pop(self, span, end_ns):
+        stack = self._local.stack
+        if stack and stack[-1] is span:
+            stack.pop()
+        thread = threading.current_thread()
+        record = {
+            "id": span.id,
+            "parent": span.parent,
+            "name": span.name,
+            "start_us": (span.start_ns - self.origin_ns) // 1000,
+            "duration_us": (end_ns - span.start_ns) // 1000,
+            "thread": thread.ident,
+            "attrs": span.attrs,
+        }
+        with self._lock:
+            self.records.append(record)
+            self.thread_names.setdefault(thread.ident, thread.name)
+
+    def write_jsonl(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            for record in sorted(self.records, key=lambda r: r["start_us"]):
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def write_chrome_trace(self, path):
+        """Chrome trace event format (open in chrome://tracing or https://ui.perfetto.dev)."""
+        events = [
+            {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+            for tid, name in self.thread_names.items()
+        ]
+        for record in self.records:
+            events.append({
+                "name": record["name"],
+                "cat": record["name"].split(".", 1)[0],
+                "ph": "X",
+                "ts": self.origin_epoch_us + record["start_us"],
+                "dur": record["duration_us"],
+                "pid": self.pid,
+                "tid": record["thread"],
+                "args": record["attrs"],
+            })
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False, default=str)
+
+    def summary_rows(self):
+        """Per span name: count, total/mean/max seconds and summed counters, slowest total first."""
+        stages = {}
+        for record in self.records:
+            row = stages.setdefault(record["name"], dict(
+                {"name": record["name"], "count": 0, "total_s": 0.0, "max_s": 0.0},
+                **{counter: 0 for counter in SUMMED_COUNTERS}))
+            seconds = record["duration_us"] / 1e6
+            row["count"] += 1
+            row["total_s"] += seconds
+            row["max_s"] = max(row["max_s"], seconds)
+            for counter in SUMMED_COUNTERS:
+                value = record["attrs"].get(counter)
+                if isinstance(value, (int, float)):
+                    row[counter] += value
+        rows = sorted(stages.values(), key=lambda row: row["total_s"], reverse=True)
+        for row in rows:
+            row["mean_s"] = row["total_s"] / row["count"]
+        return rows
+
+    def print_summary(self, wall_seconds):
+        print(f"\nTrace summary ({self.run_name}, wall {wall_seconds:.1f}s; nested and parallel spans overlap)")
+        print(f"{'stage':<28} {'count':>6} {'total s':>9} {'mean s':>8} {'max s':>8} {'% wall':>7} "
+              f"{'MB':>9} {'tokens':>10}")
+        for row in self.summary_rows():
+            share = row["total_s"] / wall_seconds * 100 if wall_seconds > 0 else 0.0
+            mb = f"{row['bytes'] / 1024 / 1024:.1f}" if row["bytes"] else "-"
+            tokens = str(row["total_tokens"]) if row["total_tokens"] else "-"
+            print(f"{row['name']:<28} {row['count']:>6} {row['total_s']:>9.2f} {row['mean_s']:>8.2f} "
+                  f"{row['max_s']:>8.2f} {share:>6.0f}% {mb:>9} {tokens:>10}")
+
+    def finish(self):
+        """Write <run>-<time>.trace.jsonl and .chrome.json, print the summary. Returns the two paths."""
+        wall_seconds = (time.perf_counter_ns() - self.origin_ns) / 1e9
+        os.makedirs(self.output_dir, exist_ok=True)
+        stem = os.path.join(self.output_dir, f"{self.run_name}-{datetime.now().strftime('%Y%m%d-%H%M%S')}")
+        jsonl_path, chrome_path = f"{stem}.trace.jsonl", f"{stem}.chrome.json"
+        self.write_jsonl(jsonl_path)
+        self.write_chrome_trace(chrome_path)
+        self.print_summary(wall_seconds)
+        print(f"Trace: {jsonl_path}, {chrome_path}")
+        return jsonl_path, chrome_path
+
+_tracer = None
+
+def span(name, **attrs):
+    """Context manager timing one stage. Costs one global lookup while tracing is disabled."""
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, attrs)
+
+def traced(name):
+    """Decorator form of span() for whole functions."""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return func(*args, **kwargs)
+            with _tracer.span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def record_usage(current_span, response):
+    """Add the token counts of a genai response's usage_metadata to the span."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    current_span.add(
+        prompt_tokens=getattr(usage, "prompt_token_count", None) or 0,
+        output_tokens=getattr(usage, "candidates_token_count", None) or 0,
+        total_tokens=getattr(usage, "total_token_count", None) or 0,
+    )
+
+def enable_tracing(output_dir, run_name):
+    global _tracer
+    _tracer = Tracer(output_dir, run_name)
+    return _tracer
+
+def tracing_from_config(config, base_dir, run_name):
+    """Enable tracing if the config's tracing section (or WORK_REPORT_TRACE=1) asks for it."""
+    trace_cfg = config.get('tracing') or {}
+    if not (trace_cfg.get('enabled', False) or os.environ.get("WORK_REPORT_TRACE") == "1"):
+        return None
+    output_dir = trace_cfg.get('dir', 'output/traces')
+    if not os.path.isabs(output_dir):
+        output_dir = os.path.join(base_dir, output_dir)
+    return enable_tracing(output_dir, run_name)
+
+def finish_tracing():
+    """Export and summarize the current trace, then disable tracing. No-op when disabled."""
+    global _tracer
+    if _tracer is None:
+        return None
+    tracer, _tracer = _tracer, None
+    return tracer.finish()
@@ -0,0 +1,54 @@
+"""
+Modal への動画転送
+動画は内容ハッシュ名で Volume に置き、同じ内容がすでにあれば送らない。
+ローカル側はファイルをチャンクごとに読みながらハッシュ計算・送信するので、
+動画の長さによらずメモリ使用量は一定（動画全体を bytes で持たない）
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.fileutil import content_hash
+
+# リモートのコンテナで Volume をマウントする場所
+VIDEO_ROOT = "/videos"
+
+def volume_video_path(video_hash):
+    """
+    Volume 内のパス（1ディレクトリにファイルが集中しないようハッシュの先頭2文字で分ける）
+    """
+    return f"/{video_hash[:2]}/{video_hash}.mp4"
+
+def remote_video_path(video_hash, root=VIDEO_ROOT):
+    """
+    リモートのコンテナから見たパス
+    """
+    return f"{root}{volume_video_path(video_hash)}"
+
+def find_uploaded(volume, video_hash, size):
+    """
+    同じ内容・同じサイズの動画がすでに Volume にあるか（途中で切れた転送は再送する）
+    """
+    target = volume_video_path(video_hash)
+    try:
+        entries = volume.listdir(os.path.dirname(target))
+    except Exception:
+        # ディレクトリがまだない
+        return False
+    return any(entry.path.strip("/") == target.strip("/") and entry.size == size for entry in entries)
+
+def ensure_uploaded(volume, path):
+    """
+    動画を内容ハッシュ名で Volume に置く。戻り値: 内容ハッシュ
+    put_file はファイルを少しずつ読みながら送り、batch_upload を抜けたときにまとめて確定する
+    """
+    video_hash = content_hash(path)
+    size = os.path.getsize(path)
+    if find_uploaded(volume, video_hash, size):
+        print(f"転送済みの動画を再利用: {video_hash[:12]}")
+        return video_hash
+
+    print(f"動画を転送中: {os.path.basename(path)} ({size / 1024 / 1024:.1f} MB)")
+    with volume.batch_upload(force=True) as batch:
+        batch.put_file(path, volume_video_path(video_hash))
+    return video_hash
@@ -0,0 +1,432 @@
+"""
+ローカルVLM（Qwen-VL）の常駐推論ワーカー
+モデルは起動時に1回だけロードし、(動画, プロンプト) のジョブをキューから取り出して
+生成設定が同じものをまとめて processor / generate に通す
+
+gemini_video_summary と同じ files / models.generate_content の形で使える LocalVLMClient も提供する
+
+    python3 vlm_worker.py --backend stub --jobs 32 --batch-size 4   # CPUで起動時間とスループットを測る
+"""
+import os
+import re
+import json
+import time
+import queue
+import argparse
+import threading
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+
+DEFAULT_MODEL = "unsloth/Qwen3-VL-32B-Thinking"
+
+class Job:
+    """
+    推論ジョブ1件（結果は future に入る）
+    """
+
+    def __init__(self, video_path, prompt, max_new_tokens=1024, fps=1.0, max_pixels=360 * 420):
+        self.video_path = video_path
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.fps = fps
+        self.max_pixels = max_pixels
+        self.future = Future()
+
+    @property
+    def batch_key(self):
+        """
+        同じバッチにまとめられるジョブは生成設定と動画の前処理設定が同じもの
+        """
+        return (self.max_new_tokens, self.fps, self.max_pixels)
+
+class QwenVLBackend:
+    """
+    transformers の Qwen-VL バックエンド
+    GPUでは4bit量子化＋flash-attention、CPUでは小さいモデルを量子化なしで動かせる
+    """
+
+    def __init__(self, model_name=DEFAULT_MODEL, device_map="auto", quantize_4bit=True,
+                 attn_implementation="flash_attention_2"):
+        self.model_name = model_name
+        self.device_map = device_map
+        self.quantize_4bit = quantize_4bit
+        self.attn_implementation = attn_implementation
+        self.model = None
+        self.processor = None
+
+    def load(self):
+        import torch
+        from transformers import AutoModelForVision2Seq, AutoProcessor, BitsAndBytesConfig
+
+        kwargs = {"device_map": self.device_map}
+        if self.quantize_4bit:
+            kwargs["quantization_config"] = BitsAndBytesConfig(
+                load_in_4bit=True,
+                bnb_4bit_quant_type="nf4",
+                bnb_4bit_compute_dtype=torch.bfloat16,
+            )
+        if self.attn_implementation:
+            kwargs["attn_implementation"] = self.attn_implementation
+
+        print(f"モデルをロード中: {self.model_name}")
+        try:
+            self.model = AutoModelForVision2Seq.from_pretrained(self.model_name, **kwargs)
+        except Exception as e:
+            print(f"モデルロードエラー: {e}")
+            print("Qwen2.5-VLクラスでのロードを試みます...")
+            from transformers import Qwen2_5_VLForConditionalGeneration
+            self.model = Qwen2_5_VLForConditionalGeneration.from_pretrained(self.model_name, **kwargs)
+        self.processor = AutoProcessor.from_pretrained(self.model_name)
+        # バッチ生成ではプロンプトの末尾を揃えるため左詰めでパディングする
+        self.processor.tokenizer.padding_side = "left"
+
+    def generate_batch(self, jobs):
+        from qwen_vl_utils import process_vision_info
+
+        conversations = [[{
+            "role": "user",
+            "content": [
+                {"type": "video", "video": job.video_path, "max_pixels": job.max_pixels, "fps": job.fps},
+                {"type": "text", "text": job.prompt},
+            ],
+        }] for job in jobs]
+        texts = [
+            self.processor.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            for messages in conversations
+        ]
+        image_inputs, video_inputs = process_vision_info(conversations)
+        inputs = self.processor(
+            text=texts,
+            images=image_inputs,
+            videos=video_inputs,
+            padding=True,
+            return_tensors="pt",
+        ).to(self.model.device)
+
+        # Thinkingモデルは思考プロセスを出力するためmax_new_tokensを多めに
+        generated_ids = self.model.generate(**inputs, max_new_tokens=jobs[0].max_new_tokens)
+        generated_ids_trimmed = [
+            out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+        ]
+        return self.processor.batch_decode(
+            generated_ids_trimmed, skip_special_tokens=True, clean_up_tokenization_spaces=False
+        )
+
+class StubBackend:
+    """
+    CPUで起動時間とバッチ処理のスループットを測るためのスタブ
+    load_seconds: モデルのロード時間
+    batch_seconds / item_seconds: 1バッチの固定コストと1件あたりのコスト（バッチ化の効果が出る）
+    """
+
+    def __init__(self, load_seconds=2.0, batch_seconds=0.5, item_seconds=0.1):
+        self.load_seconds = load_seconds
+        self.batch_seconds = batch_seconds
+        self.item_seconds = item_seconds
+
+    def load(self):
+        time.sleep(self.load_seconds)
+
+    def generate_batch(self, jobs):
+        time.sleep(self.batch_seconds + self.item_seconds * len(jobs))
+        results = []
+        for job in jobs:
+            if "JSON" in job.prompt:
+                results.append('```json\n{"title": "stub", "sections": []}\n```')
+            else:
+                results.append(f"### stub\n{os.path.basename(job.video_path)}: {job.prompt.strip()[:40]}")
+        return results
+
+class VLMWorker:
+    """
+    モデルを1回だけロードして常駐する推論ワーカー
+    submit したジョブは max_wait_seconds だけ後続を待ち、生成設定が同じものを最大 max_batch_size 件まとめて推論する
+    """
+
+    def __init__(self, backend, max_batch_size=4, max_wait_seconds=0.2):
+        self.backend = backend
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_seconds = max_wait_seconds
+        self.startup_seconds = None
+        self.jobs_done = 0
+        self.batches_done = 0
+        self.busy_seconds = 0.0
+        self._queue = queue.Queue()
+        # 設定が違ってバッチに入らなかったジョブ（届いた順）。キューより先に処理する。ワーカースレッドだけが触る
+        self._pending = deque()
+        self._started = threading.Event()
+        self._thread = None
+        self._load_error = None
+
+    def start(self):
+        """
+        ワーカースレッドを起動し、モデルのロード完了まで待つ
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        self._started.wait()
+        if self._load_error:
+            raise self._load_error
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, video_path, prompt, **options):
+        """
+        ジョブをキューに入れる。戻り値: 生成テキストが入る Future
+        """
+        job = Job(video_path, prompt, **options)
+        self._queue.put(job)
+        return job.future
+
+    def analyze(self, video_path, prompt, **options):
+        return self.submit(video_path, prompt, **options).result()
+
+    def _next_job(self):
+        """
+        次に処理するジョブ（後回しにしたジョブが先。なければキューから待つ）
+        """
+        if self._pending:
+            return self._pending.popleft()
+        return self._queue.get()
+
+    def _collect_batch(self, first):
+        """
+        first と同じ設定のジョブを締め切りまで集める（設定が違うジョブは届いた順のまま後回しにする）
+        first は常に一番古いジョブなので、ある設定のジョブが流れ続けても他の設定のジョブは待たされ続けない
+        """
+        batch = [first]
+        # 後回しにしていたジョブから、同じ設定のものを届いた順に取る
+        for job in list(self._pending):
+            if len(batch) >= self.max_batch_size or job is None:
+                break
+            if job.batch_key == first.batch_key:
+                self._pending.remove(job)
+                batch.append(job)
+        deadline = time.monotonic() + self.max_wait_seconds
+        while len(batch) < self.max_batch_size and None not in self._pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is not None and job.batch_key == first.batch_key:
+                batch.append(job)
+            else:
+                self._pending.append(job)
+        return batch
+
+    def _run(self):
+        start = time.monotonic()
+        try:
+            self.backend.load()
+        except Exception as e:
+            self._load_error = e
+            self._started.set()
+            return
+        self.startup_seconds = time.monotonic() - start
+        print(f"モデルのロード完了 ({self.startup_seconds:.1f}秒)")
+        self._started.set()
+
+        while True:
+            first = self._next_job()
+            if first is None:
+                break
+            batch = self._collect_batch(first)
+            began = time.monotonic()
+            try:
+                outputs = self.backend.generate_batch(batch)
+                for job, text in zip(batch, outputs):
+                    job.future.set_result(text)
+            except Exception as e:
+                for job in batch:
+                    if not job.future.done():
+                        job.future.set_exception(e)
+            self.busy_seconds += time.monotonic() - began
+            self.jobs_done += len(batch)
+            self.batches_done += 1
+
+    def stats(self):
+        return {
+            "startup_seconds": self.startup_seconds,
+            "jobs": self.jobs_done,
+            "batches": self.batches_done,
+            "mean_batch_size": self.jobs_done / self.batches_done if self.batches_done else 0.0,
+            "busy_seconds": self.busy_seconds,
+        }
+
+# --- gemini_video_summary から使うための genai.Client 互換インターフェース ---
+
+class LocalState:
+    def __init__(self, name):
+        self.name = name
+
+class LocalFile:
+    """
+    upload_registry が見る属性（name, state, expiration_time など）を持つローカルファイル
+    """
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.name = f"local:{self.path}"
+        self.uri = f"file://{self.path}"
+        self.size_bytes = os.path.getsize(path)
+        self.mime_type = "video/mp4"
+        self.state = LocalState("ACTIVE")
+        self.expiration_time = datetime.now(timezone.utc) + timedelta(days=365)
+
+class LocalFiles:
+    """
+    files API 互換。ローカル推論なのでアップロードはせず、パスを覚えておくだけ
+    """
+
+    def __init__(self):
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def upload(self, file, config=None):
+        local_file = LocalFile(file)
+        with self._lock:
+            self._files[local_file.name] = local_file
+        return local_file
+
+    def get(self, name):
+        path = name[len("local:"):] if name.startswith("local:") else None
+        if not path or not os.path.exists(path):
+            raise FileNotFoundError(name)
+        with self._lock:
+            return self._files.setdefault(name, LocalFile(path))
+
+    def delete(self, name):
+        with self._lock:
+            self._files.pop(name, None)
+
+class LocalResponse:
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+def clean_output(text, json_mode=False):
+    """
+    Thinkingモデルの思考部分を除き、JSONモードならコードブロックの中身だけを返す
+    """
+    text = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL).strip()
+    if json_mode:
+        match = re.search(r"```(?:json)?\s*(.*?)```", text, flags=re.DOTALL)
+        if match:
+            text = match.group(1).strip()
+        start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=0)
+        text = text[start:]
+    return text
+
+class LocalModels:
+    def __init__(self, worker, files, max_new_tokens=1024, fps=1.0, max_pixels=360 * 420):
+        self.worker = worker
+        self.files = files
+        self.options = {"max_new_tokens": max_new_tokens, "fps": fps, "max_pixels": max_pixels}
+
+    def generate_content(self, model, contents, config=None):
+        """
+        contents の動画ファイル1つとテキストで推論する（model はローカルでは無視する）
+        """
+        if not isinstance(contents, (list, tuple)):
+            contents = [contents]
+        video = next((part for part in contents if isinstance(part, LocalFile)), None)
+        if video is None:
+            raise ValueError("ローカルVLMには動画ファイルが1つ必要です")
+        prompt = "\n".join(part for part in contents if isinstance(part, str))
+
+        json_mode = getattr(config, "response_mime_type", None) == "application/json" or \
+            (isinstance(config, dict) and config.get("response_mime_type") == "application/json")
+        if json_mode:
+            prompt += "\nJSONだけを出力してください。"
+        options = dict(self.options)
+        max_tokens = getattr(config, "max_output_tokens", None)
+        if max_tokens:
+            options["max_new_tokens"] = max_tokens
+        text = self.worker.analyze(video.path, prompt, **options)
+        return LocalResponse(clean_output(text, json_mode))
+
+class LocalVLMClient:
+    """
+    gemini_video_summary の genai.Client の代わりに使えるローカルVLMクライアント
+    """
+
+    def __init__(self, worker, max_new_tokens=1024, fps=1.0, max_pixels=360 * 420):
+        self.worker = worker
+        self.files = LocalFiles()
+        self.models = LocalModels(worker, self.files, max_new_tokens, fps, max_pixels)
+
+def backend_from_config(vlm_cfg):
+    if vlm_cfg.get("backend", "qwen") == "stub":
+        return StubBackend(**(vlm_cfg.get("stub") or {}))
+    return QwenVLBackend(
+        model_name=vlm_cfg.get("model_name", DEFAULT_MODEL),
+        device_map=vlm_cfg.get("device_map", "auto"),
+        quantize_4bit=vlm_cfg.get("quantize_4bit", True),
+        attn_implementation=vlm_cfg.get("attn_implementation", "flash_attention_2"),
+    )
+
+def local_client_from_config(vlm_cfg):
+    """
+    config.yml の local_vlm セクションからワーカーを起動し、LocalVLMClient を返す
+    """
+    worker = VLMWorker(
+        backend_from_config(vlm_cfg),
+        max_batch_size=vlm_cfg.get("max_batch_size", 4),
+        max_wait_seconds=vlm_cfg.get("max_wait_seconds", 0.2),
+    ).start()
+    return LocalVLMClient(
+        worker,
+        max_new_tokens=vlm_cfg.get("max_new_tokens", 1024),
+        fps=vlm_cfg.get("fps", 1.0),
+        max_pixels=vlm_cfg.get("max_pixels", 360 * 420),
+    )
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="常駐VLMワーカーの起動時間とスループットを測る")
+    parser.add_argument("--backend", choices=["stub", "qwen"], default="stub")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="qwen バックエンドのモデル（CPUなら小さいもの）")
+    parser.add_argument("--device", default="auto", help="device_map（CPUなら cpu）")
+    parser.add_argument("--video", default="input/sample.mp4")
+    parser.add_argument("--jobs", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.backend == "stub":
+        backend = StubBackend()
+    else:
+        on_cpu = args.device == "cpu"
+        backend = QwenVLBackend(args.model, device_map=args.device, quantize_4bit=not on_cpu,
+                                attn_implementation=None if on_cpu else "flash_attention_2")
+
+    worker = VLMWorker(backend, max_batch_size=args.batch_size).start()
+    start = time.monotonic()
+    futures = [
+        worker.submit(args.video, f"この動画の内容を説明してください。({i})", max_new_tokens=args.max_new_tokens)
+        for i in range(args.jobs)
+    ]
+    for future in futures:
+        future.result()
+    elapsed = time.monotonic() - start
+    worker.stop()
+
+    stats = worker.stats()
+    print(json.dumps(dict(stats, total_seconds=elapsed, jobs_per_second=args.jobs / elapsed), indent=2))
+    if args.backend == "stub":
+        print("注: スタブの処理時間は StubBackend のコストモデル（1バッチの固定コスト + 1件あたりのコスト）で、"
+              "実モデルでのバッチ化の効果を計測した値ではありません")
+
+if __name__ == "__main__":
+    main()
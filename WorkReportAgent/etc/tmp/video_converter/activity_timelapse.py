@@ -0,0 +1,148 @@
+import os
+import math
+import subprocess
+
+DEFAULT_ACTIVITY = {
+    "threshold": 0.003,
+    "min_idle_seconds": 5,
+    "active_speed": 1.0,
+    "idle_speed": 30.0,
+    "analysis_width": 160,
+}
+
+def activity_settings(time_cfg):
+    """Activity settings from the timelapse section with defaults applied."""
+    settings = dict(DEFAULT_ACTIVITY)
+    settings.update(time_cfg.get('activity') or {})
+    return settings
+
+def measure_activity(input_path, analysis_width=160):
+    """Per-second visual activity of the video (max scene-change score of the frames in each second).
+
+    Frames are downscaled before differencing, so this pass is much cheaper than the encode.
+    """
+    cmd = [
+        "ffmpeg",
+        "-nostats",
+        "-loglevel", "error",
+        "-i", input_path,
+        "-an",
+        "-filter:v", f"scale={analysis_width}:-2,select='gte(scene,0)',"
+                     f"metadata=print:key=lavfi.scene_score:file=-",
+        "-f", "null",
+        "-"
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+
+    scores = []
+    second = 0
+    for line in result.stdout.splitlines():
+        if line.startswith("frame:"):
+            for field in line.split():
+                if field.startswith("pts_time:"):
+                    second = int(float(field.split(':', 1)[1]))
+        elif line.startswith("lavfi.scene_score="):
+            score = float(line.split('=', 1)[1])
+            if second >= len(scores):
+                scores.extend([0.0] * (second + 1 - len(scores)))
+            scores[second] = max(scores[second], score)
+    return scores
+
+def plan_segments(scores, threshold, min_idle_seconds, active_speed, idle_speed):
+    """Group seconds into segments of {start, end, speed}; speed 0 drops the segment.
+
+    Idle runs shorter than min_idle_seconds stay at active speed so short pauses don't stutter.
+    """
+    segments = []
+    i = 0
+    while i < len(scores):
+        active = scores[i] >= threshold
+        j = i
+        while j < len(scores) and (scores[j] >= threshold) == active:
+            j += 1
+        idle_long_enough = not active and (j - i) >= min_idle_seconds
+        speed = idle_speed if idle_long_enough else active_speed
+        if segments and segments[-1]["speed"] == speed:
+            segments[-1]["end"] = j
+        else:
+            segments.append({"start": i, "end": j, "speed": speed})
+        i = j
+    return segments
+
+def selection_expression(terms):
+    """Combine per-segment (first_frame, term) pairs into one select expression.
+
+    The terms are nested in a balanced if(lt(n,...)) tree on the segments' first frames. ffmpeg only
+    evaluates the branch that is taken, so each frame costs O(log segments) instead of one term per segment.
+    """
+    if not terms:
+        return ""
+    if len(terms) == 1:
+        return terms[0][1]
+    mid = len(terms) // 2
+    return (f"if(lt(n,{terms[mid][0]}),{selection_expression(terms[:mid])},"
+            f"{selection_expression(terms[mid:])})")
+
+def build_timelapse_plan(segments, fps, output_fps, source_duration):
+    """Turn speed segments into a frame-selection expression and output segments for the time map.
+
+    Each kept segment keeps every step-th source frame; output frames are re-timed back to back at output_fps.
+    """
+    terms = []
+    kept = []
+    out_time = 0.0
+    for segment in segments:
+        if segment["speed"] <= 0:
+            continue
+        first = int(round(segment["start"] * fps))
+        last = min(int(round(segment["end"] * fps)), int(math.ceil(source_duration * fps))) - 1
+        if last < first:
+            continue
+        step = max(1, int(round(segment["speed"] * fps / output_fps)))
+        if step == 1:
+            terms.append((first, f"between(n,{first},{last})"))
+        else:
+            terms.append((first, f"between(n,{first},{last})*not(mod(n-{first},{step}))"))
+
+        frames = (last - first) // step + 1
+        out_duration = frames / output_fps
+        kept.append({
+            "out_start": round(out_time, 3),
+            "out_end": round(out_time + out_duration, 3),
+            "src_start": round(first / fps, 3),
+            "src_end": round((last + 1) / fps, 3),
+            "speed": step * output_fps / fps,
+        })
+        out_time += out_duration
+    return selection_expression(terms), kept
+
+def plan_activity_timelapse(input_path, fps, output_fps, duration, activity):
+    """Measure activity and plan the variable-speed timelapse. Returns (filter_graph, output segments)."""
+    scores = measure_activity(input_path, activity["analysis_width"])
+    segments = plan_segments(
+        scores,
+        activity["threshold"],
+        activity["min_idle_seconds"],
+        activity["active_speed"],
+        activity["idle_speed"],
+    )
+    expression, kept = build_timelapse_plan(segments, fps, output_fps, duration)
+    if not kept:
+        # Nothing moved and idle stretches are dropped: keep the recording at idle pace of 1 frame/min
+        fallback = [{"start": 0, "end": len(scores) or int(math.ceil(duration)), "speed": 60.0}]
+        expression, kept = build_timelapse_plan(fallback, fps, output_fps, duration)
+
+    active_seconds = sum(s["end"] - s["start"] for s in segments if s["speed"] == activity["active_speed"])
+    print(f"Activity: {active_seconds}/{len(scores)}s active, {len(kept)} kept segments, "
+          f"output {kept[-1]['out_end']:.0f}s from {duration:.0f}s")
+
+    filter_graph = f"select='{expression}',setpts=N/({output_fps}*TB),fps={output_fps}"
+    return filter_graph, kept
+
+def write_filter_script(output_path, filter_graph):
+    """Write a long filter graph to a file for -filter_script:v (avoids command-line length limits)."""
+    directory, filename = os.path.split(output_path)
+    script_path = os.path.join(directory, f".{filename}.filter.txt")
+    with open(script_path, 'w', encoding='utf-8') as f:
+        f.write(filter_graph)
+    return script_path
@@ -0,0 +1,237 @@
+import os
+import re
+import json
+import math
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+DEFAULT_ADAPTIVE = {
+    "enabled": False,
+    "target": "bitrate",
+    "target_kbps": 150,
+    "target_mb": 50,
+    "min_ssim": 0.97,
+    "probe_count": 4,
+    "probe_seconds": 120,
+    "probe_preset": "veryfast",
+    "probe_crfs": [22, 28, 34, 40],
+    "crf_min": 18,
+    "crf_max": 45,
+    "fast_preset": "medium",
+    "min_preset_gain": 0.05,
+    "log": "adaptive_encode.jsonl",
+}
+
+def adaptive_settings(comp):
+    """Adaptive settings from the compression section with defaults applied."""
+    settings = dict(DEFAULT_ADAPTIVE)
+    settings.update(comp.get('adaptive') or {})
+    return settings
+
+def probe_ranges(duration, count, seconds):
+    """Up to count source windows of `seconds`, spread evenly over the recording."""
+    if duration <= seconds:
+        return [(0.0, duration)]
+    count = max(1, min(count, int(duration // seconds)))
+    if count == 1:
+        start = (duration - seconds) / 2
+        return [(start, start + seconds)]
+    step = (duration - seconds) / (count - 1)
+    return [(step * i, step * i + seconds) for i in range(count)]
+
+def encode_probe(input_path, probe_path, start, end, filter_graph, encode_args, threads=None):
+    """Encode one source window and return the output size in bytes."""
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error", "-nostats",
+        "-ss", f"{start:.3f}", "-i", input_path, "-t", f"{end - start:.3f}",
+        "-filter:v", filter_graph,
+    ] + encode_args
+    if threads:
+        cmd.extend(["-threads", str(threads)])
+    cmd.append(probe_path)
+    subprocess.run(cmd, check=True)
+    return os.path.getsize(probe_path)
+
+def probe_ssim(distorted_path, reference_path):
+    """SSIM (All) of a probe encode against the lossless encode of the same window."""
+    cmd = ["ffmpeg", "-hide_banner", "-nostats", "-i", distorted_path, "-i", reference_path,
+           "-lavfi", "[0:v][1:v]ssim", "-f", "null", "-"]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    match = re.search(r"SSIM .*All:([\d.]+)", result.stderr)
+    return float(match.group(1)) if match else None
+
+def codec_args(codec, crf, preset):
+    args = ["-c:v", codec, "-crf", str(crf), "-preset", preset, "-an"]
+    if codec == "libx265":
+        args.extend(["-tag:v", "hvc1"])
+    return args
+
+def fit_rate_curve(points):
+    """Least-squares fit of ln(kbps) = a + b * crf over (crf, kbps) points. Returns (a, b)."""
+    xs = [crf for crf, _ in points]
+    ys = [math.log(max(kbps, 1e-6)) for _, kbps in points]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x == 0:
+        return mean_y, 0.0
+    b = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+    return mean_y - b * mean_x, b
+
+def predict_kbps(curve, crf):
+    a, b = curve
+    return math.exp(a + b * crf)
+
+def crf_for_kbps(curve, target_kbps, crf_min, crf_max):
+    """Lowest (best quality) integer CRF whose predicted bitrate stays within target_kbps."""
+    for crf in range(crf_min, crf_max + 1):
+        if predict_kbps(curve, crf) <= target_kbps:
+            return crf
+    return crf_max
+
+def interpolate(points, crf):
+    """Piecewise-linear value at crf from sorted (crf, value) points, clamped at the ends."""
+    if crf <= points[0][0]:
+        return points[0][1]
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        if crf <= x1:
+            return y0 + (y1 - y0) * (crf - x0) / (x1 - x0)
+    return points[-1][1]
+
+def crf_for_ssim(ssim_points, min_ssim, crf_min, crf_max):
+    """Highest (smallest file) integer CRF whose interpolated SSIM stays at or above min_ssim.
+
+    Only CRFs up to the highest probed one are considered: past it the SSIM is unmeasured.
+    """
+    chosen = crf_min
+    for crf in range(crf_min, min(crf_max, ssim_points[-1][0]) + 1):
+        if interpolate(ssim_points, crf) >= min_ssim:
+            chosen = crf
+    return chosen
+
+def plan_adaptive_encode(input_path, output_path, codec, final_preset, filter_graph, speed_factor,
+                         duration, output_duration, adaptive, threads=None):
+    """Pick CRF and preset for this recording from short probe encodes.
+
+    Sampled windows are encoded at the fast probe preset over a few CRFs; bitrate is fitted as
+    log-linear in CRF and scaled by the size ratio of the final preset measured on one window.
+    Probes always use the uniform speed-up filter, so for activity timelapses the prediction is
+    per output second of a uniform timelapse (idle stretches are a little over-represented).
+    """
+    work_dir = f"{output_path}.probe"
+    os.makedirs(work_dir, exist_ok=True)
+    ranges = probe_ranges(duration, int(adaptive["probe_count"]), float(adaptive["probe_seconds"]))
+    probe_output_seconds = sum(end - start for start, end in ranges) / speed_factor
+    crfs = sorted(int(crf) for crf in adaptive["probe_crfs"])
+    if not crfs:
+        raise ValueError("compression.adaptive.probe_crfs is empty")
+    probe_preset = adaptive["probe_preset"]
+    want_ssim = adaptive["target"] == "ssim"
+    threads_per_probe = max(1, (threads or os.cpu_count() or 1) // len(ranges))
+
+    def probe(window, crf, preset, measure_ssim=want_ssim):
+        start, end = ranges[window]
+        path = os.path.join(work_dir, f"w{window}_crf{crf}_{preset}.mp4")
+        size = encode_probe(input_path, path, start, end, filter_graph, codec_args(codec, crf, preset),
+                            threads_per_probe)
+        ssim = probe_ssim(path, os.path.join(work_dir, f"w{window}_ref.mkv")) if measure_ssim else None
+        return size, ssim
+
+    def reference(window):
+        start, end = ranges[window]
+        encode_probe(input_path, os.path.join(work_dir, f"w{window}_ref.mkv"), start, end, filter_graph,
+                     ["-c:v", "libx264", "-qp", "0", "-preset", "ultrafast", "-an"], threads_per_probe)
+
+    def probe_grid(preset):
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            jobs = {(window, crf): executor.submit(probe, window, crf, preset)
+                    for crf in crfs for window in range(len(ranges))}
+            return {key: future.result() for key, future in jobs.items()}
+
+    def ssim_points_of(results):
+        points = []
+        for crf in crfs:
+            values = [results[(window, crf)][1] for window in range(len(ranges))]
+            if all(value is not None for value in values):
+                # The worst window decides: the floor must hold for busy stretches too
+                points.append((crf, min(values)))
+        return points
+
+    try:
+        if want_ssim:
+            with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+                list(executor.map(reference, range(len(ranges))))
+        results = probe_grid(probe_preset)
+
+        rate_points = []
+        for crf in crfs:
+            total_bytes = sum(results[(window, crf)][0] for window in range(len(ranges)))
+            rate_points.append((crf, total_bytes * 8 / 1000 / probe_output_seconds))
+        ssim_points = ssim_points_of(results) if want_ssim else []
+        curve = fit_rate_curve(rate_points)
+        crf_min, crf_max = int(adaptive["crf_min"]), int(adaptive["crf_max"])
+
+        if want_ssim and ssim_points:
+            target_kbps = None
+            crf = crf_for_ssim(ssim_points, float(adaptive["min_ssim"]), crf_min, crf_max)
+        else:
+            if adaptive["target"] == "size":
+                target_kbps = float(adaptive["target_mb"]) * 8 * 1024 * 1024 / 1000 / max(output_duration, 1e-6)
+            else:
+                target_kbps = float(adaptive["target_kbps"])
+            crf = crf_for_kbps(curve, target_kbps, crf_min, crf_max)
+
+        # Preset check on the busiest window: keep the slow preset only if it still saves enough
+        busiest = max(range(len(ranges)), key=lambda window: results[(window, crfs[-1])][0])
+        presets = list(dict.fromkeys((probe_preset, adaptive["fast_preset"], final_preset)))
+        with ThreadPoolExecutor(max_workers=len(presets)) as executor:
+            sizes = dict(zip(presets, executor.map(lambda preset: probe(busiest, crf, preset, False)[0], presets)))
+        gain = 1 - sizes[final_preset] / sizes[adaptive["fast_preset"]] if sizes[adaptive["fast_preset"]] else 0.0
+        preset = final_preset if gain >= float(adaptive["min_preset_gain"]) else adaptive["fast_preset"]
+        ratio = sizes[preset] / sizes[probe_preset] if sizes[probe_preset] else 1.0
+
+        if target_kbps is not None:
+            # The curve was fitted at the probe preset; re-solve for the chosen preset's sizes
+            crf = crf_for_kbps(curve, target_kbps / ratio, crf_min, crf_max)
+        elif preset != final_preset and preset != probe_preset:
+            # Switched to the faster preset: the SSIM floor only holds for CRFs solved on its own probes
+            fast_points = ssim_points_of(probe_grid(preset))
+            if fast_points:
+                ssim_points = fast_points
+                crf = crf_for_ssim(ssim_points, float(adaptive["min_ssim"]), crf_min, crf_max)
+            else:
+                # No SSIM at the faster preset: keep the configured one rather than risk the floor
+                preset = final_preset
+                ratio = sizes[preset] / sizes[probe_preset] if sizes[probe_preset] else 1.0
+        predicted_kbps = predict_kbps(curve, crf) * ratio
+        plan = {
+            "crf": crf,
+            "preset": preset,
+            "target": adaptive["target"],
+            "target_kbps": round(target_kbps, 1) if target_kbps is not None else None,
+            "predicted_kbps": round(predicted_kbps, 1),
+            "predicted_bytes": int(predicted_kbps * 1000 / 8 * output_duration),
+            "predicted_ssim": round(interpolate(ssim_points, crf), 4) if ssim_points else None,
+            "preset_gain": round(gain, 3),
+            "probe_points": [(crf_value, round(kbps, 1)) for crf_value, kbps in rate_points],
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print(f"Adaptive: CRF {plan['crf']}, preset {plan['preset']} ({final_preset} saves {gain:.1%} "
+          f"over {adaptive['fast_preset']}), predicted {plan['predicted_kbps']:.0f} kbps / "
+          f"{plan['predicted_bytes'] / 1024 / 1024:.1f} MB")
+    return plan
+
+def log_adaptive_result(log_path, input_path, plan, actual_bytes):
+    """Append the chosen settings with predicted vs. actual size to a JSON Lines log."""
+    error = (actual_bytes - plan["predicted_bytes"]) / plan["predicted_bytes"] if plan["predicted_bytes"] else None
+    entry = dict(plan, input=os.path.basename(input_path), actual_bytes=actual_bytes,
+                 size_error=round(error, 3) if error is not None else None,
+                 encoded_at=datetime.now(timezone.utc).isoformat(timespec="seconds"))
+    with open(log_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    print(f"Adaptive: actual {actual_bytes / 1024 / 1024:.1f} MB vs predicted "
+          f"{plan['predicted_bytes'] / 1024 / 1024:.1f} MB"
+          + (f" ({error:+.1%})" if error is not None else ""))
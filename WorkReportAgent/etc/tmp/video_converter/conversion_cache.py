@@ -0,0 +1,85 @@
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime, timezone
+from common.fileutil import atomic_write_json
+from common.timemap import timemap_path
+
+MANIFEST_NAME = ".manifest.json"
+
+def settings_key(settings):
+    """Stable hash of the effective conversion settings."""
+    payload = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+def partial_output_path(output_path):
+    """Temp path an encode writes to before it is renamed into place.
+
+    Keeps the extension so ffmpeg still picks the right muxer.
+    """
+    directory, filename = os.path.split(output_path)
+    return os.path.join(directory, f".{filename}.part{os.path.splitext(filename)[1]}")
+
+class ConversionManifest:
+    """Persistent map of input file -> converted output, stored in the output directory.
+
+    An entry is only written after its output has been renamed into place,
+    so an interrupted encode is never mistaken for a finished one.
+    """
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries = json.load(f).get("entries", {})
+            except Exception as e:
+                print(f"Error loading manifest {self.path}, starting fresh: {e}")
+
+    def is_fresh(self, input_path, output_path, fingerprint, settings_hash):
+        """True if output_path is a finished conversion of this exact input with these settings."""
+        entry = self.entries.get(os.path.basename(input_path))
+        if not entry:
+            return False
+        if entry.get("fingerprint") != fingerprint or entry.get("settings") != settings_hash:
+            return False
+        if entry.get("output") != os.path.basename(output_path) or not os.path.exists(output_path):
+            return False
+        return os.path.getsize(output_path) == entry.get("output_size")
+
+    def record(self, input_path, output_path, fingerprint, settings_hash):
+        """Record a finished conversion and persist the manifest."""
+        with self._lock:
+            self.entries[os.path.basename(input_path)] = {
+                "output": os.path.basename(output_path),
+                "output_size": os.path.getsize(output_path),
+                "fingerprint": fingerprint,
+                "settings": settings_hash,
+                "converted_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            }
+            self._save_locked()
+
+    def collect_garbage(self, input_dir, dry_run=False):
+        """Remove outputs whose input no longer exists in input_dir. Returns the removed output paths."""
+        removed = []
+        with self._lock:
+            for input_name, entry in list(self.entries.items()):
+                if os.path.exists(os.path.join(input_dir, input_name)):
+                    continue
+                output_path = os.path.join(self.output_dir, entry["output"])
+                if not dry_run:
+                    for path in (output_path, timemap_path(output_path)):
+                        if os.path.exists(path):
+                            os.remove(path)
+                    del self.entries[input_name]
+                removed.append(output_path)
+            if removed and not dry_run:
+                self._save_locked()
+        return removed
+
+    def _save_locked(self):
+        atomic_write_json(self.path, {"version": 1, "entries": self.entries})
@@ -2,9 +2,20 @@ import os
 import subprocess
 import sys
 import glob
-import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import yaml
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.fileutil import file_fingerprint, atomic_write_json
+from common.media_index import get_media_info, probe_files, video_summary
+from common.timemap import make_timemap, uniform_timemap, timemap_path
+from common.tracing import span, tracing_from_config, finish_tracing
+from conversion_cache import ConversionManifest, settings_key, partial_output_path
+from activity_timelapse import activity_settings, plan_activity_timelapse, write_filter_script
+from segment_encode import segment_count, split_ranges, encode_segmented, verify_segmented
+from adaptive_encode import adaptive_settings, plan_adaptive_encode, log_adaptive_result
+
 def load_config():
     """Load configuration from config.yml."""
     config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.yml")
@@ -21,64 +32,72 @@ def load_config():
                 "codec": "libx264"
             },
             "timelapse": {
+                "mode": "uniform",
                 "speed_divisor": 2.0,
                 "output_fps": "auto"
+            },
+            "batch": {
+                "jobs": 1,
+                "min_threads_per_job": 4
+            },
+            "cache": {
+                "enabled": True,
+                "gc_orphans": False
             }
         }
 
+def effective_settings(config):
+    """Compression/timelapse settings with defaults applied, as used by convert_video."""
+    comp = config.get('compression', {})
+    time_cfg = config.get('timelapse', {})
+    settings = {
+        "crf": comp.get('crf', 28),
+        "preset": comp.get('preset', 'veryslow'),
+        "codec": comp.get('codec', 'libx264'),
+        "mode": time_cfg.get('mode', 'uniform'),
+        "speed_divisor": time_cfg.get('speed_divisor', 2.0),
+        "output_fps": time_cfg.get('output_fps', 'auto'),
+    }
+    if settings['mode'] == 'activity':
+        settings['activity'] = activity_settings(time_cfg)
+    adaptive = adaptive_settings(comp)
+    if adaptive['enabled']:
+        # crf/preset above are then only the fallback; the per-recording choice depends on these
+        settings['adaptive'] = adaptive
+    return settings
+
 def get_video_info(filepath):
-    """Get frame rate and bitrate of the video using ffprobe."""
-    cmd = [
-        "ffprobe",
-        "-v", "error",
-        "-select_streams", "v:0",
-        "-show_entries", "stream=r_frame_rate,bit_rate:format=bit_rate",
-        "-of", "json",
-        filepath
-    ]
+    """Get frame rate, bitrate and duration (seconds) of the video from the media index."""
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        data = json.loads(result.stdout)
-        
-        if not data.get('streams'):
+        info = video_summary(get_media_info(filepath))
+        if info is None:
             print(f"No video stream found in {filepath}")
-            return None, None
-
-        # Get FPS
-        r_frame_rate = data['streams'][0].get('r_frame_rate')
-        fps = 0
-        if r_frame_rate:
-            num, den = map(int, r_frame_rate.split('/'))
-            fps = num / den
-        
-        # Get Bitrate (try stream first, then format)
-        bit_rate = data['streams'][0].get('bit_rate')
-        if not bit_rate and 'format' in data:
-            bit_rate = data['format'].get('bit_rate')
-        
-        bit_rate = int(bit_rate) if bit_rate else 0
-            
-        return fps, bit_rate
+            return None, None, None
+        return info['fps'], info['bit_rate'], info['duration']
     except Exception as e:
         print(f"Error getting info for {filepath}: {e}")
-        return None, None
+        return None, None, None
+
+def convert_video(input_path, output_path, config, threads=None, quiet=False):
+    """Convert video to timelapse using ffmpeg.
 
-def convert_video(input_path, output_path, config):
-    """Convert video to timelapse using ffmpeg."""
-    fps, original_bitrate = get_video_info(input_path)
+    threads limits the encoder threads of this ffmpeg process (None: ffmpeg default).
+    quiet suppresses ffmpeg's progress output so parallel jobs don't interleave.
+    """
+    fps, original_bitrate, duration = get_video_info(input_path)
     if fps is None:
         return False
+    recording_start = video_summary(get_media_info(input_path))['creation_time']
 
     # Get settings from config
-    comp = config.get('compression', {})
-    time_cfg = config.get('timelapse', {})
+    settings = effective_settings(config)
     
-    crf = comp.get('crf', 28)
-    preset = comp.get('preset', 'veryslow')
-    codec = comp.get('codec', 'libx264')
+    crf = settings['crf']
+    preset = settings['preset']
+    codec = settings['codec']
     
-    speed_divisor = time_cfg.get('speed_divisor', 2.0)
-    output_fps = time_cfg.get('output_fps', 'auto')
+    speed_divisor = settings['speed_divisor']
+    output_fps = settings['output_fps']
 
     speed_factor = fps / float(speed_divisor)
     
@@ -90,33 +109,203 @@ def convert_video(input_path, output_path, config):
 
     print(f"Processing {os.path.basename(input_path)}")
     print(f"Original FPS: {fps:.2f}, Bitrate: {original_bitrate/1000:.0f}k, Speed Factor: {speed_factor:.2f}x")
-    print(f"Settings: Codec={codec}, CRF={crf}, Preset={preset}, Output FPS={filter_fps:.2f}")
+    print(f"Settings: Codec={codec}, CRF={crf}, Preset={preset}, Output FPS={filter_fps:.2f}, Mode={settings['mode']}")
 
-    cmd = [
-        "ffmpeg",
-        "-y",
-        "-i", input_path,
-        "-filter:v", f"setpts=PTS/{speed_factor},fps={filter_fps}",
+    filter_script = None
+    if settings['mode'] == 'activity':
+        # Variable speed: idle stretches are sped up or dropped, busy ones stay near real time
+        try:
+            with span("ffmpeg.activity_scan", file=os.path.basename(input_path)):
+                filter_graph, segments = plan_activity_timelapse(
+                    input_path, fps, filter_fps, duration, settings['activity'])
+        except subprocess.CalledProcessError as e:
+            print(f"Error measuring activity of {input_path}: {e}")
+            return False
+        filter_script = write_filter_script(output_path, filter_graph)
+        filter_args = ["-filter_script:v", filter_script]
+        timemap = make_timemap(os.path.basename(input_path), duration, segments, recording_start)
+    else:
+        filter_args = ["-filter:v", f"setpts=PTS/{speed_factor},fps={filter_fps}"]
+        timemap = uniform_timemap(os.path.basename(input_path), duration, speed_factor, recording_start)
+
+    adaptive_plan = None
+    if 'adaptive' in settings:
+        # Per-recording CRF/preset from short probe encodes, aimed at the configured budget
+        try:
+            with span("ffmpeg.adaptive_probe", file=os.path.basename(input_path)):
+                adaptive_plan = plan_adaptive_encode(
+                    input_path, output_path, codec, preset, f"setpts=PTS/{speed_factor},fps={filter_fps}",
+                    speed_factor, duration, timemap['output_duration'], settings['adaptive'], threads)
+            crf, preset = adaptive_plan['crf'], adaptive_plan['preset']
+        except (subprocess.CalledProcessError, ValueError) as e:
+            print(f"Adaptive probe failed for {input_path}, using CRF {crf} / {preset}: {e}")
+
+    encode_args = [
         "-c:v", codec,
         "-crf", str(crf),
         "-preset", preset,
         "-an",
-        output_path
     ]
     
     # Add tag for H.265 compatibility if needed (Mac/QuickTime friendly)
     if codec == "libx265":
-        cmd.extend(["-tag:v", "hvc1"])
-    
-    print(f"Running command: {' '.join(cmd)}")
-    
+        encode_args.extend(["-tag:v", "hvc1"])
+
+    # Encode to a temp file and rename on success, so an interrupted encode never looks finished
+    part_path = partial_output_path(output_path)
+
+    segments = segment_count(config, duration, settings['mode'])
+    encode_span = span("ffmpeg.encode", file=os.path.basename(input_path), crf=crf, preset=preset,
+                       segments=segments, input_bytes=os.path.getsize(input_path))
     try:
-        subprocess.run(cmd, check=True)
+        with encode_span:
+            single_pass = segments <= 1
+            if not single_pass:
+                # One long recording: encode keyframe-aligned parts concurrently and join them losslessly
+                keyframes = video_summary(get_media_info(input_path, keyframes=True))['keyframes'] or []
+                ranges = split_ranges(keyframes, duration, segments)
+                filter_graph = filter_args[1]
+                encode_segmented(input_path, part_path, ranges, filter_graph, encode_args, threads)
+                verify = config.get('segments', {}).get('verify', 'expected')
+                if not verify_segmented(input_path, part_path, filter_graph, ranges, verify,
+                                        timemap['output_duration'], filter_fps):
+                    # Never publish (or record in the manifest) a join that does not match
+                    print(f"Segmented output of {input_path} differs from a single-pass encode; "
+                          f"re-encoding in a single pass")
+                    os.remove(part_path)
+                    encode_span.set(segments=1, segment_mismatch=True)
+                    single_pass = True
+            if single_pass:
+                cmd = ["ffmpeg", "-y"]
+                if quiet:
+                    cmd.extend(["-loglevel", "error", "-nostats"])
+                cmd.extend(["-i", input_path] + filter_args + encode_args)
+                if threads:
+                    cmd.extend(["-threads", str(threads)])
+                cmd.append(part_path)
+
+                print(f"Running command: {' '.join(cmd)}")
+                subprocess.run(cmd, check=True)
+
+        os.replace(part_path, output_path)
+        encode_span.set(bytes=os.path.getsize(output_path))
+        if adaptive_plan:
+            log_path = os.path.join(os.path.dirname(output_path), settings['adaptive']['log'])
+            log_adaptive_result(log_path, input_path, adaptive_plan, os.path.getsize(output_path))
+        # Output time -> original recording time, so reports can cite real times
+        atomic_write_json(timemap_path(output_path), timemap)
         print(f"Successfully converted: {input_path} -> {output_path}")
         return True
     except subprocess.CalledProcessError as e:
         print(f"Error converting {input_path}: {e}")
+        if os.path.exists(part_path):
+            os.remove(part_path)
         return False
+    finally:
+        if filter_script and os.path.exists(filter_script):
+            os.remove(filter_script)
+
+def plan_batch(config, cpu_count=None):
+    """Decide how many files to encode at once and how many ffmpeg threads each gets.
+
+    The threads are split evenly so concurrent jobs saturate the CPUs without oversubscribing them.
+    """
+    batch_cfg = config.get('batch', {})
+    jobs = batch_cfg.get('jobs', 1)
+    min_threads = max(1, int(batch_cfg.get('min_threads_per_job', 4)))
+    cpu_count = cpu_count or os.cpu_count() or 1
+
+    if jobs == "auto":
+        jobs = max(1, cpu_count // min_threads)
+    jobs = max(1, int(jobs))
+
+    # Sequential mode keeps ffmpeg's own thread choice (previous behaviour)
+    if jobs == 1:
+        return 1, None
+    return jobs, max(1, cpu_count // jobs)
+
+def format_throughput(done, total, elapsed, input_seconds):
+    """Format aggregate progress: files/hour and input seconds encoded per wall second."""
+    files_per_hour = done / elapsed * 3600 if elapsed > 0 else 0.0
+    realtime = input_seconds / elapsed if elapsed > 0 else 0.0
+    return (f"[{done}/{total}] elapsed {elapsed:.0f}s, "
+            f"{files_per_hour:.1f} files/hour, {realtime:.1f} input-s/wall-s")
+
+def filter_fresh_tasks(tasks, settings_hash, manifest):
+    """Split tasks into (to_convert, skipped) using the manifest.
+
+    Returns to_convert as (input_path, output_path, fingerprint) triples.
+    """
+    to_convert = []
+    skipped = []
+    for input_path, output_path in tasks:
+        fingerprint = file_fingerprint(input_path)
+        if manifest.is_fresh(input_path, output_path, fingerprint, settings_hash):
+            skipped.append(input_path)
+        else:
+            to_convert.append((input_path, output_path, fingerprint))
+    return to_convert, skipped
+
+def run_batch(tasks, config, manifest=None):
+    """Convert (input_path, output_path) pairs with a bounded worker pool, longest inputs first.
+
+    With a manifest, inputs already converted with the same settings are skipped
+    and each finished conversion is recorded.
+    """
+    jobs, threads = plan_batch(config)
+    settings_hash = settings_key(effective_settings(config))
+
+    if manifest is not None:
+        to_convert, skipped = filter_fresh_tasks(tasks, settings_hash, manifest)
+        for input_path in skipped:
+            print(f"Up to date, skipping: {os.path.basename(input_path)}")
+        fingerprints = {input_path: fingerprint for input_path, _, fingerprint in to_convert}
+        tasks = [(input_path, output_path) for input_path, output_path, _ in to_convert]
+        if not tasks:
+            print("All outputs are up to date.")
+            return True
+
+    # Probe all inputs in one concurrent pass; the per-file lookups below hit the index
+    probe_files([input_path for input_path, _ in tasks])
+
+    # Longest-first keeps one long recording from starting last and dominating the wall time
+    durations = {}
+    for input_path, _ in tasks:
+        _, _, duration = get_video_info(input_path)
+        durations[input_path] = duration or 0.0
+    tasks = sorted(tasks, key=lambda task: durations[task[0]], reverse=True)
+
+    print(f"Batch: {len(tasks)} files, {jobs} concurrent jobs, "
+          f"{threads or 'default'} ffmpeg threads per job")
+
+    outputs = dict(tasks)
+    start = time.monotonic()
+    done = 0
+    failed = 0
+    input_seconds = 0.0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(convert_video, input_path, output_path, config, threads, jobs > 1): input_path
+            for input_path, output_path in tasks
+        }
+        for future in as_completed(futures):
+            input_path = futures[future]
+            done += 1
+            try:
+                ok = future.result()
+            except Exception as e:
+                print(f"Error converting {input_path}: {e}")
+                ok = False
+            if ok:
+                input_seconds += durations[input_path]
+                if manifest is not None:
+                    manifest.record(input_path, outputs[input_path], fingerprints[input_path], settings_hash)
+            else:
+                failed += 1
+            print(format_throughput(done, len(tasks), time.monotonic() - start, input_seconds))
+
+    print(f"Batch finished: {done - failed} converted, {failed} failed")
+    return failed == 0
 
 def main():
     base_dir = os.path.dirname(os.path.abspath(__file__))
@@ -137,10 +326,25 @@ def main():
         print(f"No input files found in {input_dir}")
         return
 
+    tasks = []
     for input_path in input_files:
         filename = os.path.basename(input_path)
         output_path = os.path.join(output_dir, filename)
-        convert_video(input_path, output_path, config)
+        tasks.append((input_path, output_path))
+
+    manifest = None
+    cache_cfg = config.get('cache', {})
+    if cache_cfg.get('enabled', True):
+        manifest = ConversionManifest(output_dir)
+        if cache_cfg.get('gc_orphans', False):
+            for removed in manifest.collect_garbage(input_dir):
+                print(f"Removed orphaned output: {removed}")
+
+    tracing_from_config(config, base_dir, "convert")
+    try:
+        run_batch(tasks, config, manifest)
+    finally:
+        finish_tracing()
 
 if __name__ == "__main__":
     main()
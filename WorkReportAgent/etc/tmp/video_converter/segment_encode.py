@@ -0,0 +1,128 @@
+import os
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+def segment_count(config, duration, mode, cpu_count=None):
+    """Number of segments to split one input into (1 = encode in a single pass)."""
+    seg_cfg = config.get('segments', {})
+    if not seg_cfg.get('enabled', False) or mode != 'uniform':
+        # Activity mode selects frames by absolute index, so it always encodes in one pass
+        return 1
+    if duration < seg_cfg.get('min_duration_seconds', 1800):
+        return 1
+    count = seg_cfg.get('count', 'auto')
+    if count == 'auto':
+        min_threads = max(1, int(config.get('batch', {}).get('min_threads_per_job', 4)))
+        count = (cpu_count or os.cpu_count() or 1) // min_threads
+    return max(1, int(count))
+
+def split_ranges(keyframes, duration, count):
+    """Split [0, duration) into up to count ranges whose boundaries are keyframes."""
+    boundaries = [0.0]
+    for i in range(1, count):
+        target = duration * i / count
+        nearest = min(keyframes, key=lambda t: abs(t - target)) if keyframes else target
+        if boundaries[-1] < nearest < duration:
+            boundaries.append(nearest)
+    boundaries.append(duration)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def encode_segment(input_path, segment_path, start, end, filter_graph, encode_args, threads):
+    """Encode one range. Input seeking starts decoding at the keyframe, and timestamps restart at 0."""
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error", "-nostats",
+        "-ss", f"{start:.6f}", "-i", input_path, "-t", f"{end - start:.6f}",
+        "-filter:v", filter_graph,
+    ] + encode_args
+    if threads:
+        cmd.extend(["-threads", str(threads)])
+    cmd.append(segment_path)
+    subprocess.run(cmd, check=True)
+
+def concat_segments(segment_paths, output_path):
+    """Join encoded segments without re-encoding; the concat demuxer keeps timestamps continuous."""
+    list_path = f"{output_path}.concat.txt"
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    try:
+        cmd = [
+            "ffmpeg", "-y", "-loglevel", "error", "-nostats",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-c", "copy", output_path
+        ]
+        subprocess.run(cmd, check=True)
+    finally:
+        os.remove(list_path)
+
+def encode_segmented(input_path, output_path, ranges, filter_graph, encode_args, threads=None):
+    """Encode ranges concurrently with the same filter and concatenate them into output_path."""
+    work_dir = f"{output_path}.segments"
+    os.makedirs(work_dir, exist_ok=True)
+    ext = os.path.splitext(output_path)[1]
+    segment_paths = [os.path.join(work_dir, f"seg_{i:03d}{ext}") for i in range(len(ranges))]
+    threads_per_segment = max(1, (threads or os.cpu_count() or 1) // len(ranges))
+
+    print(f"Segment-parallel encode: {len(ranges)} segments, {threads_per_segment} threads each")
+    try:
+        with ThreadPoolExecutor(max_workers=len(ranges)) as executor:
+            futures = [
+                executor.submit(encode_segment, input_path, path, start, end,
+                                filter_graph, encode_args, threads_per_segment)
+                for path, (start, end) in zip(segment_paths, ranges)
+            ]
+            for future in futures:
+                future.result()
+        concat_segments(segment_paths, output_path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def count_frames(path):
+    """(frame count, duration seconds) of the first video stream, counted from packets without decoding."""
+    cmd = [
+        "ffprobe", "-v", "error", "-select_streams", "v:0", "-count_packets",
+        "-show_entries", "stream=nb_read_packets:format=duration",
+        "-of", "default=noprint_wrappers=1",
+        path
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+    values = dict(line.split('=', 1) for line in result.stdout.splitlines() if '=' in line)
+    return int(values.get('nb_read_packets', 0)), float(values.get('duration', 0))
+
+def single_pass_reference(input_path, output_path, filter_graph):
+    """Frame count and duration of a single-pass encode with the same filter (ultrafast: counts don't depend on preset)."""
+    reference_path = f"{output_path}.reference.mkv"
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error", "-nostats", "-i", input_path,
+        "-filter:v", filter_graph, "-c:v", "libx264", "-preset", "ultrafast", "-an",
+        reference_path
+    ]
+    try:
+        subprocess.run(cmd, check=True)
+        return count_frames(reference_path)
+    finally:
+        if os.path.exists(reference_path):
+            os.remove(reference_path)
+
+def verify_segmented(input_path, output_path, filter_graph, segments, verify, expected_duration, output_fps):
+    """Compare the concatenated output with a single-pass encode (or the predicted length).
+
+    Each segment boundary may shift the fps filter's rounding by one frame.
+    """
+    if verify == "off":
+        return True
+    frames, duration = count_frames(output_path)
+    if verify == "single_pass":
+        ref_frames, ref_duration = single_pass_reference(input_path, output_path, filter_graph)
+    else:
+        ref_duration = expected_duration
+        ref_frames = int(round(expected_duration * output_fps))
+
+    tolerance = len(segments)
+    ok = abs(frames - ref_frames) <= tolerance and abs(duration - ref_duration) <= tolerance / output_fps
+    status = "OK" if ok else "MISMATCH"
+    print(f"Segment verify ({verify}) {status}: {frames} frames / {duration:.2f}s "
+          f"vs reference {ref_frames} frames / {ref_duration:.2f}s")
+    return ok
@@ -1,74 +1,231 @@
 import os
-import subprocess
+import re
+import sys
+import csv
 import json
+import time
+import itertools
+import resource
+import subprocess
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common.media_index import get_media_info, video_summary
+
+# Synthetic screen-like sources (lavfi graphs). Screen recordings are mostly static
+# with small local changes; "busy" stands in for 3D viewport work like the Rhino sample.
+SYNTHETIC_SOURCES = {
+    # White document with a small cursor moving across it
+    "static_document": "color=c=white:s={size}:r={fps},"
+                       "drawbox=x='mod(t*37,iw-20)':y='ih/2':w=12:h=18:color=black:t=fill",
+    # Static background with an animated window shown 1/3 of the time
+    "mixed_windows": "color=c=0xdddddd:s={size}:r={fps}[bg];"
+                     "testsrc2=s=640x360:r={fps}[fg];"
+                     "[bg][fg]overlay=x=(W-w)/2:y=(H-h)/2:enable='lt(mod(t,60),20)'",
+    # Full-frame motion every frame
+    "busy_viewport": "testsrc2=s={size}:r={fps}",
+}
 
 def get_video_info(filepath):
-    cmd = [
-        "ffprobe", "-v", "error", "-select_streams", "v:0",
-        "-show_entries", "stream=r_frame_rate", "-of", "json", filepath
-    ]
     try:
-        result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-        data = json.loads(result.stdout)
-        r_frame_rate = data['streams'][0].get('r_frame_rate')
-        if r_frame_rate:
-            num, den = map(int, r_frame_rate.split('/'))
-            return num / den
-    except:
+        info = video_summary(get_media_info(filepath))
+        if info and info['fps']:
+            return info['fps']
+    except (subprocess.CalledProcessError, ValueError, KeyError):
         pass
     return None
 
-def convert_experiment(input_path, output_dir, codec, crf, preset="medium"):
+def load_benchmark_config():
+    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_config.yml")
+    with open(config_path, 'r') as f:
+        return yaml.safe_load(f)
+
+def generate_synthetic_clip(kind, duration, output_path, size="1280x720", fps=2):
+    """Render a synthetic screen-like clip losslessly so it can serve as the quality reference."""
+    if os.path.exists(output_path):
+        return output_path
+    graph = SYNTHETIC_SOURCES[kind].format(size=size, fps=fps)
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", graph,
+        "-t", str(duration),
+        "-c:v", "libx264", "-qp", "0", "-preset", "ultrafast", "-pix_fmt", "yuv420p",
+        output_path
+    ]
+    subprocess.run(cmd, check=True)
+    return output_path
+
+def timelapse_filter(fps, speed_divisor):
+    speed_factor = fps / float(speed_divisor)
+    return f"setpts=PTS/{speed_factor},fps={fps}"
+
+def make_reference(input_path, output_dir, speed_divisor):
+    """Lossless timelapse of the source: what every encode is compared against."""
+    name = os.path.splitext(os.path.basename(input_path))[0]
+    output_path = os.path.join(output_dir, f"{name}_reference_div{speed_divisor}.mkv")
+    if os.path.exists(output_path):
+        return output_path
+    fps = get_video_info(input_path)
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error", "-i", input_path,
+        "-filter:v", timelapse_filter(fps, speed_divisor),
+        "-c:v", "libx264", "-qp", "0", "-preset", "ultrafast", "-an",
+        output_path
+    ]
+    subprocess.run(cmd, check=True)
+    return output_path
+
+def children_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+def convert_experiment(input_path, output_dir, codec, crf, preset="medium", speed_divisor=2.0):
+    """Encode one grid point. Returns size, wall time and CPU time of the encode."""
     filename = os.path.basename(input_path)
     name, ext = os.path.splitext(filename)
-    output_path = os.path.join(output_dir, f"{name}_{codec}_crf{crf}{ext}")
-    
+    output_path = os.path.join(output_dir, f"{name}_{codec}_crf{crf}_{preset}_div{speed_divisor}.mp4")
+
     fps = get_video_info(input_path)
     if not fps: return
 
-    speed_factor = fps / 2.0 # 12x speed roughly (based on previous context, but wait... previous code used fps/2.0 which is strange logic for 12x. 
-    # The previous code: speed_factor = fps / 2.0. 
-    # If fps is 24, speed_factor is 12. Correct.
-    
     cmd = [
         "ffmpeg", "-y", "-i", input_path,
-        "-filter:v", f"setpts=PTS/{speed_factor},fps={fps}",
+        "-filter:v", timelapse_filter(fps, speed_divisor),
         "-c:v", codec,
         "-crf", str(crf),
         "-preset", preset,
         "-an",
-        output_path
     ]
-    
+
     if codec == "libx265":
         cmd.extend(["-tag:v", "hvc1"])
+    cmd.append(output_path)
 
-    print(f"Testing {codec} CRF {crf}...")
+    print(f"Testing {codec} CRF {crf} {preset} div {speed_divisor}...")
+    cpu_before = children_cpu_seconds()
+    start = time.monotonic()
     subprocess.run(cmd, check=True, capture_output=True) # capture output to keep terminal clean
-    
+    wall = time.monotonic() - start
+    cpu = children_cpu_seconds() - cpu_before
+
     size = os.path.getsize(output_path)
-    print(f"-> Size: {size/1024/1024:.2f} MB")
-    return size
+    print(f"-> Size: {size/1024/1024:.2f} MB, Encode: {wall:.1f}s wall / {cpu:.1f}s CPU")
+    return {"output_path": output_path, "size_bytes": size, "encode_wall_s": wall, "encode_cpu_s": cpu}
+
+def has_vmaf():
+    result = subprocess.run(["ffmpeg", "-hide_banner", "-filters"], capture_output=True, text=True)
+    return "libvmaf" in result.stdout
+
+def measure_quality(distorted_path, reference_path, vmaf=False):
+    """SSIM (All) and PSNR (average) of distorted vs reference, plus VMAF if requested."""
+    graph = "[0:v]split[a0][a1];[1:v]split[b0][b1];[a0][b0]ssim;[a1][b1]psnr"
+    if vmaf:
+        graph = "[0:v]split=3[a0][a1][a2];[1:v]split=3[b0][b1][b2];" \
+                "[a0][b0]ssim;[a1][b1]psnr;[a2][b2]libvmaf"
+    cmd = ["ffmpeg", "-hide_banner", "-nostats", "-i", distorted_path, "-i", reference_path,
+           "-lavfi", graph, "-f", "null", "-"]
+    result = subprocess.run(cmd, capture_output=True, text=True, check=True)
+
+    metrics = {"ssim": None, "psnr": None, "vmaf": None}
+    match = re.search(r"SSIM .*All:([\d.]+)", result.stderr)
+    if match:
+        metrics["ssim"] = float(match.group(1))
+    match = re.search(r"PSNR .*average:([\d.]+|inf)", result.stderr)
+    if match:
+        metrics["psnr"] = float(match.group(1))
+    match = re.search(r"VMAF score: ([\d.]+)", result.stderr)
+    if match:
+        metrics["vmaf"] = float(match.group(1))
+    return metrics
+
+def dominates(a, b):
+    """a is at least as small, fast and good as b, and strictly better in one of them."""
+    no_worse = (a["size_bytes"] <= b["size_bytes"] and a["encode_wall_s"] <= b["encode_wall_s"]
+                and a["ssim"] >= b["ssim"])
+    better = (a["size_bytes"] < b["size_bytes"] or a["encode_wall_s"] < b["encode_wall_s"]
+              or a["ssim"] > b["ssim"])
+    return no_worse and better
+
+def pareto_frontier(results):
+    """Results not dominated on (size, encode time, SSIM), per clip and speed divisor.
+
+    Each speed divisor has its own reference and duration, so only rows sharing both are compared.
+    """
+    frontier = []
+    for clip, speed_divisor in sorted({(r["clip"], r["speed_divisor"]) for r in results}):
+        rows = [r for r in results if r["clip"] == clip and r["speed_divisor"] == speed_divisor
+                and r["ssim"] is not None]
+        frontier.extend(r for r in rows if not any(dominates(other, r) for other in rows))
+    return frontier
+
+def write_results(results, frontier, output_dir):
+    fields = ["clip", "codec", "crf", "preset", "speed_divisor", "size_bytes",
+              "encode_wall_s", "encode_cpu_s", "ssim", "psnr", "vmaf", "pareto"]
+    frontier_ids = {id(r) for r in frontier}
+    rows = [dict({k: r.get(k) for k in fields}, pareto=id(r) in frontier_ids) for r in results]
+
+    csv_path = os.path.join(output_dir, "benchmark_results.csv")
+    with open(csv_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    json_path = os.path.join(output_dir, "benchmark_results.json")
+    with open(json_path, 'w') as f:
+        json.dump(rows, f, indent=2)
+    print(f"Results: {csv_path}, {json_path}")
+
+def print_frontier(frontier):
+    print("\nPareto frontier (size vs. encode time vs. SSIM):")
+    print(f"{'clip':<18} {'codec':<8} {'crf':>4} {'preset':<10} {'div':>4} {'size MB':>8} {'wall s':>7} {'SSIM':>7} {'PSNR':>6}")
+    for r in sorted(frontier, key=lambda r: (r["clip"], r["speed_divisor"], r["size_bytes"])):
+        print(f"{r['clip']:<18} {r['codec']:<8} {r['crf']:>4} {r['preset']:<10} {r['speed_divisor']:>4} "
+              f"{r['size_bytes']/1024/1024:>8.2f} {r['encode_wall_s']:>7.1f} {r['ssim']:>7.4f} {r['psnr'] or 0:>6.1f}")
 
 def main():
     base_dir = os.path.dirname(os.path.abspath(__file__))
-    input_path = os.path.join(base_dir, "input/Rhino 3D For Architecture in 2025 - Full Advanced Course.mp4")
     output_dir = os.path.join(base_dir, "output_experiment")
-    
+
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    # Baseline (Current Best)
-    # H.264 CRF 28 Veryslow
-    # We will test:
-    # 1. H.264 CRF 32 (Lower quality)
-    # 2. H.265 CRF 28 (Better codec)
-    # 3. H.265 CRF 32 (Better codec + Lower quality)
-    
-    convert_experiment(input_path, output_dir, "libx264", 32, "veryslow")
-    convert_experiment(input_path, output_dir, "libx265", 28, "medium") # x265 is slow, so use medium
-    convert_experiment(input_path, output_dir, "libx265", 32, "medium")
+    config = load_benchmark_config()
+    source_cfg = config.get("synthetic", {})
+
+    # Synthetic clips are generated locally; real recordings can be added under inputs
+    inputs = {}
+    for clip in source_cfg.get("clips", []):
+        path = os.path.join(output_dir, f"src_{clip['name']}.mkv")
+        inputs[clip["name"]] = generate_synthetic_clip(
+            clip["kind"], clip.get("duration", 120), path,
+            size=source_cfg.get("size", "1280x720"), fps=source_cfg.get("fps", 2))
+    for path in config.get("inputs", []) or []:
+        if not os.path.isabs(path):
+            path = os.path.join(base_dir, path)
+        if os.path.exists(path):
+            inputs[os.path.splitext(os.path.basename(path))[0]] = path
+
+    grid = config.get("grid", {})
+    use_vmaf = config.get("quality", {}).get("vmaf", "auto")
+    use_vmaf = has_vmaf() if use_vmaf == "auto" else bool(use_vmaf)
+
+    results = []
+    for clip_name, input_path in inputs.items():
+        for speed_divisor in grid.get("speed_divisor", [2.0]):
+            reference = make_reference(input_path, output_dir, speed_divisor)
+            for codec, crf, preset in itertools.product(
+                    grid.get("codec", ["libx264"]), grid.get("crf", [28]), grid.get("preset", ["medium"])):
+                encoded = convert_experiment(input_path, output_dir, codec, crf, preset, speed_divisor)
+                if not encoded:
+                    continue
+                quality = measure_quality(encoded["output_path"], reference, vmaf=use_vmaf)
+                results.append(dict(encoded, clip=clip_name, codec=codec, crf=crf, preset=preset,
+                                    speed_divisor=speed_divisor, **quality))
+                if not config.get("keep_outputs", False):
+                    os.remove(encoded["output_path"])
+
+    frontier = pareto_frontier(results)
+    write_results(results, frontier, output_dir)
+    print_frontier(frontier)
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,194 @@
+"""
+構造解析の前に動画をローカルで走査し、作業の区切り候補とスクショ候補を出す
+ffmpeg で縮小・グレースケール化したフレームをまとめて読み、NumPy で一括計算する
+* 画素差分: 直前のフレームとの平均絶対差（カーソル移動や入力などの細かい動き）
+* dHash の変化: 9x8 に縮めた明暗パターンのハミング距離（画面遷移やアプリ切り替えなどの大きな変化）
+* 情報量: 輝度勾配の平均（文字やUIが多く写っているほど大きい）
+"""
+import os
+import subprocess
+import numpy as np
+
+from common.media_index import get_media_info, video_summary
+from common.timemap import format_timestamp
+
+DEFAULT_TIMELINE = {
+    "enabled": False,
+    "mode": "hint",            # hint: 構造解析のプロンプトに候補を渡す / skip: 構造解析を呼ばず候補をそのまま使う
+    "sample_fps": 2.0,
+    "analysis_width": 160,
+    "batch_frames": 512,
+    "hash_threshold": 0.15,    # dHash の変化率（64ビット中の割合）がこれ以上なら区切り候補
+    "min_section_seconds": 60,
+}
+
+def timeline_settings(config):
+    settings = dict(DEFAULT_TIMELINE)
+    settings.update(config.get("activity_timeline") or {})
+    return settings
+
+def analysis_size(video_path, width):
+    info = video_summary(get_media_info(video_path)) or {}
+    if info.get("width") and info.get("height"):
+        height = max(8, int(round(width * info["height"] / info["width"] / 2)) * 2)
+    else:
+        height = max(8, width * 9 // 16)
+    return width, height
+
+def read_frame_batches(video_path, sample_fps, width, height, batch_frames):
+    """
+    縮小・グレースケール化したフレームを [枚数, 高さ, 幅] の uint8 配列で batch_frames 枚ずつ返す
+    デコードと縮小は ffmpeg がまとめて行い、Python 側はパイプからバッファを読むだけ
+    """
+    cmd = [
+        "ffmpeg", "-nostats", "-loglevel", "error",
+        "-i", video_path, "-an", "-sn",
+        "-vf", f"fps={sample_fps},scale={width}:{height}:flags=area,format=gray",
+        "-f", "rawvideo", "-",
+    ]
+    frame_bytes = width * height
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+    try:
+        while True:
+            data = process.stdout.read(frame_bytes * batch_frames)
+            count = len(data) // frame_bytes
+            if count == 0:
+                break
+            yield np.frombuffer(data[:count * frame_bytes], dtype=np.uint8).reshape(count, height, width)
+    finally:
+        process.stdout.close()
+        process.wait()
+
+def dhash_bits(frames):
+    """
+    フレームごとの dHash（[枚数, 8, 8] の bool）。9x8 への面積平均縮小も配列演算で行う
+    """
+    _, height, width = frames.shape
+    col_edges = np.linspace(0, width, 10).astype(int)[:-1]
+    row_edges = np.linspace(0, height, 9).astype(int)[:-1]
+    values = frames.astype(np.float32)
+    values = np.add.reduceat(values, col_edges, axis=2) / np.diff(np.append(col_edges, width))
+    values = np.add.reduceat(values, row_edges, axis=1) / np.diff(np.append(row_edges, height))[:, None]
+    return values[:, :, 1:] > values[:, :, :-1]
+
+def detail_scores(frames):
+    """
+    フレームごとの情報量（縦横の輝度勾配の平均）
+    """
+    values = frames.astype(np.int16)
+    dx = np.abs(np.diff(values, axis=2)).mean(axis=(1, 2))
+    dy = np.abs(np.diff(values, axis=1)).mean(axis=(1, 2))
+    return dx + dy
+
+def measure_timeline(video_path, settings):
+    """
+    1秒ごとの 画素差分・dHash 変化率・情報量 を計算する
+    戻り値: {"pixel": 配列, "hash": 配列, "detail": 配列}（いずれも秒数分の長さ）
+    """
+    width, height = analysis_size(video_path, settings["analysis_width"])
+    sample_fps = float(settings["sample_fps"])
+    pixel, hash_change, detail = [], [], []
+    previous_frame, previous_bits = None, None
+    for frames in read_frame_batches(video_path, sample_fps, width, height, settings["batch_frames"]):
+        bits = dhash_bits(frames)
+        # バッチの境界をまたいで差分を取るため、前のバッチの最後のフレームを先頭に付ける
+        if previous_frame is None:
+            stacked, stacked_bits = np.concatenate([frames[:1], frames]), np.concatenate([bits[:1], bits])
+        else:
+            stacked, stacked_bits = np.concatenate([previous_frame, frames]), np.concatenate([previous_bits, bits])
+        pixel.append(np.abs(np.diff(stacked.astype(np.int16), axis=0)).mean(axis=(1, 2)) / 255.0)
+        hash_change.append((stacked_bits[1:] != stacked_bits[:-1]).mean(axis=(1, 2)))
+        detail.append(detail_scores(frames))
+        previous_frame, previous_bits = frames[-1:], bits[-1:]
+
+    if not pixel:
+        return {"pixel": np.zeros(0), "hash": np.zeros(0), "detail": np.zeros(0)}
+
+    # フレーム単位 → 1秒単位（その秒の最大値）
+    pixel, hash_change, detail = np.concatenate(pixel), np.concatenate(hash_change), np.concatenate(detail)
+    seconds = (np.arange(len(pixel)) / sample_fps).astype(int)
+    length = seconds[-1] + 1
+    per_second = {}
+    for name, values in (("pixel", pixel), ("hash", hash_change), ("detail", detail)):
+        result = np.zeros(length)
+        np.maximum.at(result, seconds, values)
+        per_second[name] = result
+    return per_second
+
+def propose_boundaries(hash_scores, threshold, min_section_seconds):
+    """
+    dHash の変化が大きい秒を強い順に選び、互いに min_section_seconds 以上離れたものだけを区切りにする
+    """
+    duration = len(hash_scores)
+    candidates = np.flatnonzero(hash_scores >= threshold)
+    candidates = candidates[np.argsort(-hash_scores[candidates], kind="stable")]
+    chosen = []
+    for second in candidates:
+        if second < min_section_seconds or duration - second < min_section_seconds:
+            continue
+        if all(abs(second - other) >= min_section_seconds for other in chosen):
+            chosen.append(int(second))
+    return sorted(chosen)
+
+def build_hints(scores, boundaries):
+    """
+    区切りごとのセクション候補。スクショ候補は、動きが落ち着いている秒のうち情報量が最大の秒
+    """
+    duration = len(scores["hash"])
+    if duration == 0:
+        # デコードできなかった動画など
+        return []
+    edges = [0] + boundaries + [duration]
+    hints = []
+    for index, (start, end) in enumerate(zip(edges[:-1], edges[1:]), start=1):
+        pixel = scores["pixel"][start:end]
+        detail = scores["detail"][start:end]
+        calm = pixel <= np.median(pixel)
+        best = start + int(np.argmax(np.where(calm, detail, -1.0)))
+        hints.append({
+            "id": index,
+            "start_time": format_timestamp(start),
+            "end_time": format_timestamp(end),
+            "screenshot_timestamp": format_timestamp(best),
+            "change_score": round(float(scores["hash"][start]), 3) if start else None,
+            "activity": round(float(pixel.mean()), 4),
+        })
+    return hints
+
+def activity_hints(video_path, settings):
+    scores = measure_timeline(video_path, settings)
+    boundaries = propose_boundaries(scores["hash"], settings["hash_threshold"], settings["min_section_seconds"])
+    return build_hints(scores, boundaries)
+
+def hints_prompt(hints):
+    """
+    構造解析のプロンプトに追加する指示
+    """
+    lines = [
+        f"      - {hint['start_time']} - {hint['end_time']}（スクショ候補 {hint['screenshot_timestamp']}）"
+        for hint in hints
+    ]
+    return """
+    * 参考: 画面の変化から機械的に検出した区切り候補とスクショ候補です。内容に合わせて結合・分割して構いませんが、
+      区切りやスクショ時刻はなるべくこの候補から選んでください。
+""" + "\n".join(lines) + "\n"
+
+def structure_from_hints(hints, video_path):
+    """
+    構造解析を呼ばずに、区切り候補をそのままセクションにした構造
+    """
+    name = os.path.splitext(os.path.basename(video_path))[0]
+    sections = []
+    for hint in hints:
+        sections.append({
+            "id": hint["id"],
+            "title": f"作業 {hint['id']}（{hint['start_time']} - {hint['end_time']}）",
+            "start_time": hint["start_time"],
+            "end_time": hint["end_time"],
+            "screenshot_timestamp": hint["screenshot_timestamp"],
+            "screenshot_reason": "画面の情報量が最も多い瞬間",
+            "app": "",
+            "tags": [],
+            "steps": [],
+        })
+    return {"title": f"{name} の作業レポート", "sections": sections}
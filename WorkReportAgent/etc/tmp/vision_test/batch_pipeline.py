@@ -0,0 +1,267 @@
+"""
+複数の録画を 変換 → アップロード → 解析 の3段のパイプラインで処理するバッチモード
+段どうしは上限付きのキューでつながり、段ごとに同時実行数を持つ。
+動画Cを変換している間に動画Bをアップロードし、動画Aのセクションを執筆するので、
+全体の所要時間は各段の合計ではなく最も遅い段に近づく
+
+    python3 batch_pipeline.py [入力ディレクトリ]   （省略時は video_converter/input）
+"""
+import os
+import sys
+import glob
+import time
+import queue
+import hashlib
+import argparse
+import threading
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONVERTER_DIR = os.path.join(BASE_DIR, "..", "video_converter")
+sys.path.insert(0, os.path.join(BASE_DIR, ".."))
+sys.path.insert(0, CONVERTER_DIR)
+
+import gemini_video_summary as summary
+import convert_timelapse
+from common.fileutil import file_fingerprint
+from common.tracing import span, tracing_from_config, finish_tracing
+from conversion_cache import ConversionManifest, settings_key
+from upload_registry import registry_from_config, upload_video
+from usage_tracker import UsageTracker
+
+VIDEO_PATTERNS = ("*.mp4", "*.mov", "*.avi", "*.mkv")
+
+# キューの終わりを示す目印（段の同時実行数だけ入れる）
+_DONE = object()
+
+class Stage:
+    """
+    inbox から1件ずつ取り出して func を実行し、結果を outbox に渡す段
+    outbox が一杯なら put で待つので、後ろの段が詰まれば前の段も止まる（中間ファイルやアップロードが溜まらない）
+    func が例外を出した動画はそこで脱落し、次の段には渡さない
+    """
+
+    def __init__(self, name, func, workers, inbox, outbox=None):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.inbox = inbox
+        self.outbox = outbox
+        self.done = 0
+        self.failed = 0
+        self.busy_seconds = 0.0
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            item = self.inbox.get()
+            if item is _DONE:
+                return
+            start = time.monotonic()
+            try:
+                with span("pipeline.stage", stage=self.name, file=os.path.basename(item["source"])):
+                    result = self.func(item)
+            except Exception as e:
+                print(f"[{self.name}] 失敗: {os.path.basename(item['source'])} ({e})")
+                result = None
+            with self._lock:
+                self.busy_seconds += time.monotonic() - start
+                if result is None:
+                    self.failed += 1
+                else:
+                    self.done += 1
+            if result is not None and self.outbox is not None:
+                self.outbox.put(result)
+
+    def close(self):
+        """
+        前の段がすべて終わった後に呼ぶ。残りを処理し終えるまで待つ
+        """
+        for _ in self._threads:
+            self.inbox.put(_DONE)
+        for thread in self._threads:
+            thread.join()
+
+class BatchPipeline:
+    """
+    変換・アップロード・解析の各処理（1本分）と、それらをつなぐ段
+    """
+
+    def __init__(self, client, response_cache, config, output_dir):
+        self.client = client
+        self.response_cache = response_cache
+        self.config = config
+        self.pipeline_cfg = config.get("pipeline", {})
+        self.output_dir = output_dir
+        self.upload_registry = registry_from_config(config, BASE_DIR)
+        self.workers = {
+            "convert": max(1, self.pipeline_cfg.get("convert_workers", 1)),
+            "upload": max(1, self.pipeline_cfg.get("upload_workers", 2)),
+            "analyze": max(1, self.pipeline_cfg.get("analyze_workers", 2)),
+        }
+        # 同時に動く ffmpeg でCPUを分け合う（convert_timelapse のバッチ変換と同じ考え方）
+        self.convert_threads = max(1, (os.cpu_count() or 1) // self.workers["convert"])
+
+        self.converter_config = convert_timelapse.load_config()
+        self.converted_dir = os.path.join(CONVERTER_DIR, "output")
+        os.makedirs(self.converted_dir, exist_ok=True)
+        self.manifest = None
+        if self.converter_config.get("cache", {}).get("enabled", True):
+            self.manifest = ConversionManifest(self.converted_dir)
+        self.settings_hash = settings_key(convert_timelapse.effective_settings(self.converter_config))
+
+    def convert(self, item):
+        """
+        タイムラプス変換（同じ設定で変換済みならスキップ、失敗したら元の動画をそのまま使う）
+        """
+        source = item["source"]
+        if not self.pipeline_cfg.get("convert", True):
+            return dict(item, video=source)
+        output_path = os.path.join(self.converted_dir, item["name"] + os.path.splitext(source)[1])
+        fingerprint = file_fingerprint(source)
+        if self.manifest is not None and self.manifest.is_fresh(source, output_path, fingerprint, self.settings_hash):
+            print(f"[変換] 変換済み: {os.path.basename(source)}")
+            return dict(item, video=output_path)
+        if convert_timelapse.convert_video(source, output_path, self.converter_config,
+                                           threads=self.convert_threads, quiet=True):
+            if self.manifest is not None:
+                self.manifest.record(source, output_path, fingerprint, self.settings_hash)
+            return dict(item, video=output_path)
+        print(f"[変換] 変換失敗、元の動画で解析します: {source}")
+        return dict(item, video=source)
+
+    def upload(self, item):
+        video_file, video_hash = upload_video(self.client, item["video"], self.upload_registry,
+                                              self.config.get("upload", {}))
+        if self.response_cache:
+            self.client.register_file(video_file, video_hash)
+        return dict(item, file=video_file, hash=video_hash)
+
+    def analyze(self, item):
+        try:
+            report_path = summary.generate_report(
+                self.client, item["file"], item["hash"], item["video"], self.config,
+                os.path.join(self.output_dir, item["name"]), self.upload_registry, self.response_cache)
+        finally:
+            # 並行して解析中の他の動画のキャッシュは残す
+            release_context_caches = getattr(self.client, "release_context_caches", None)
+            if release_context_caches:
+                release_context_caches(item["file"])
+        print(f"[解析] レポート完成: {report_path}")
+        return dict(item, report=report_path)
+
+    def run(self, video_paths):
+        """
+        全動画を流し、段ごとの集計を返す
+        """
+        workers = self.workers
+        queue_size = max(1, self.pipeline_cfg.get("queue_size", 2))
+
+        inputs, converted, uploaded = queue.Queue(queue_size), queue.Queue(queue_size), queue.Queue(queue_size)
+        reports = queue.Queue()
+        stages = [
+            Stage("変換", self.convert, workers["convert"], inputs, converted),
+            Stage("アップロード", self.upload, workers["upload"], converted, uploaded),
+            Stage("解析", self.analyze, workers["analyze"], uploaded, reports),
+        ]
+        print(f"パイプライン: {len(video_paths)} 本, 同時実行数 変換 {workers['convert']} / "
+              f"アップロード {workers['upload']} / 解析 {workers['analyze']}, キュー {queue_size}")
+
+        start = time.monotonic()
+        for stage in stages:
+            stage.start()
+        # 入力もキューの上限で止まるので、変換が追いつかない分は読み込まない
+        for path, name in zip(video_paths, unique_names(video_paths)):
+            inputs.put({"source": path, "name": name})
+        for stage in stages:
+            stage.close()
+        wall_seconds = time.monotonic() - start
+
+        results = []
+        while not reports.empty():
+            results.append(reports.get())
+        return results, stages, wall_seconds
+
+def unique_names(video_paths):
+    """
+    変換後の動画とレポートのディレクトリに使う名前（拡張子なしのファイル名）
+    a.mp4 と a.mov、別ディレクトリの同名ファイルのように重なるものは、パスのハッシュを付けて区別する
+    """
+    stems = [os.path.splitext(os.path.basename(path))[0] for path in video_paths]
+    names = []
+    for path, stem in zip(video_paths, stems):
+        if stems.count(stem) > 1:
+            stem = f"{stem}-{hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:8]}"
+        names.append(stem)
+    return names
+
+def print_stage_summary(stages, wall_seconds):
+    """
+    段ごとの処理時間と、全体の所要時間を段を順に実行した場合と比べて表示する
+    """
+    print(f"\n{'段':<10}{'完了':>6}{'失敗':>6}{'処理時間':>10}{'同時実行':>8}{'占有':>10}")
+    for stage in stages:
+        occupied = stage.busy_seconds / stage.workers
+        print(f"{stage.name:<10}{stage.done:>6}{stage.failed:>6}{stage.busy_seconds:>9.1f}s"
+              f"{stage.workers:>8}{occupied:>9.1f}s")
+    sequential = sum(stage.busy_seconds for stage in stages)
+    slowest = max((stage.busy_seconds / stage.workers for stage in stages), default=0.0)
+    print(f"所要時間 {wall_seconds:.1f}秒（順に実行した場合 {sequential:.1f}秒, 最も遅い段 {slowest:.1f}秒）")
+
+def find_videos(input_dir):
+    paths = []
+    for pattern in VIDEO_PATTERNS:
+        paths.extend(glob.glob(os.path.join(input_dir, pattern)))
+    return sorted(paths)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="複数の録画を 変換→アップロード→解析 のパイプラインで処理する")
+    parser.add_argument("input_dir", nargs="?", default=os.path.join(CONVERTER_DIR, "input"),
+                        help="録画のディレクトリ（省略時は video_converter/input）")
+    parser.add_argument("--output-dir", help="出力先（省略時は output/batch/<日時>）")
+    parser.add_argument("--no-cache", action="store_true", help="モデル応答キャッシュを読まずに再問い合わせする")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    config = summary.load_config()
+    tracing_from_config(config, BASE_DIR, "batch")
+
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if not api_key and not summary.uses_local_vlm(config):
+        print("エラー: 環境変数 GOOGLE_API_KEY が設定されていません。")
+        sys.exit(1)
+
+    video_paths = find_videos(args.input_dir)
+    if not video_paths:
+        print(f"動画が見つかりません: {args.input_dir}")
+        return
+
+    client, response_cache = summary.create_client(config, api_key, no_cache=args.no_cache)
+    client = UsageTracker(client)
+    output_dir = args.output_dir or os.path.join(BASE_DIR, "output", "batch", datetime.now().strftime("%Y-%m-%d_%H%M%S"))
+    os.makedirs(output_dir, exist_ok=True)
+
+    try:
+        results, stages, wall_seconds = BatchPipeline(client, response_cache, config, output_dir).run(video_paths)
+    finally:
+        release_context_caches = getattr(client, "release_context_caches", None)
+        if release_context_caches:
+            release_context_caches()
+        finish_tracing()
+
+    print_stage_summary(stages, wall_seconds)
+    print(f"レポート {len(results)}/{len(video_paths)} 本: {output_dir}, {client.summary()}")
+    print_stats = getattr(client, "print_stats", None)
+    if print_stats:
+        print_stats()
+
+if __name__ == "__main__":
+    main()
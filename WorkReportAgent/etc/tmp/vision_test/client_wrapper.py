@@ -0,0 +1,25 @@
+class ClientWrapper:
+    """
+    genai.Client 互換のラッパーの基底クラス
+    models.generate_content だけを差し替え、files など他のAPIは元のクライアントにそのまま委譲する
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.models = _ModelsProxy(self)
+
+    def generate_content(self, **kwargs):
+        return self._client.models.generate_content(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+class _ModelsProxy:
+    def __init__(self, wrapper):
+        self._wrapper = wrapper
+
+    def generate_content(self, **kwargs):
+        return self._wrapper.generate_content(**kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._wrapper._client.models, name)
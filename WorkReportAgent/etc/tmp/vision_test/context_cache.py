@@ -0,0 +1,192 @@
+"""
+明示的なコンテキストキャッシュ（caches API）
+1本の動画に対して構造解析・セクション執筆と何度も呼び出すので、動画と共通の指示を一度だけキャッシュし、
+以降の呼び出しはキャッシュ名で参照する（動画の入力トークンを毎回送らない・課金も割引になる）
+"""
+import time
+import threading
+from google.genai import types
+from client_wrapper import ClientWrapper
+from rate_limit import is_retryable
+
+DEFAULT_SYSTEM_INSTRUCTION = "あなたは業務改善コンサルタントです。画面録画の作業動画を分析し、日本語で作業レポートを作成します。"
+TTFT_PROBE_PROMPT = "この動画の最初の画面に表示されているアプリ名を一言で答えてください。"
+
+def with_cached_content(config, cache_name):
+    """
+    生成設定に cached_content を足したコピー
+    """
+    if config is None:
+        return types.GenerateContentConfig(cached_content=cache_name)
+    if isinstance(config, dict):
+        return dict(config, cached_content=cache_name)
+    return config.model_copy(update={"cached_content": cache_name})
+
+class ContextCachingClient(ClientWrapper):
+    """
+    アップロードした動画と共通の指示をコンテキストキャッシュにし、その動画を含む呼び出しをキャッシュ参照に置き換える
+    * attach_context で作成（モデルごと）。作れなければ（最小トークン数未満・未対応モデルなど）通常の呼び出しのまま
+    * 期限が extend_margin_seconds を切ったら ttl_seconds 延長するので、TTLは実行時間に合わせて伸びる
+    * キャッシュ参照の呼び出しが 429/5xx 以外で失敗したら（期限切れなど）、
+      そのキャッシュを削除して動画を添付した通常の呼び出しでやり直す
+    * キャッシュはモデルごとなので、キャッシュ参照の呼び出しはルーターが別モデルに切り替えない（model_router）
+    * release_context_caches で削除し、キャッシュあり/なしの応答時間と最初のトークンまでの時間を表示する
+    """
+
+    def __init__(self, client, system_instruction=DEFAULT_SYSTEM_INSTRUCTION, ttl_seconds=600,
+                 extend_margin_seconds=120, probe_ttft=False, log=print):
+        super().__init__(client)
+        self.system_instruction = system_instruction
+        self.ttl_seconds = ttl_seconds
+        self.extend_margin_seconds = extend_margin_seconds
+        self.probe_ttft = probe_ttft
+        self.log = log
+        self.latencies = {"cached": [], "uncached": []}
+        self.ttft = {}
+        self.fallbacks = 0
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def attach_context(self, video_file, model):
+        """
+        動画のコンテキストキャッシュを作る。戻り値: キャッシュ名（使えなければ None）
+        """
+        key = (video_file.name, model)
+        with self._lock:
+            if key in self._caches:
+                return self._caches[key]["name"]
+        try:
+            cache = self._client.caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    contents=[video_file],
+                    system_instruction=self.system_instruction or None,
+                    display_name=f"work-report {video_file.name}",
+                    ttl=f"{int(self.ttl_seconds)}s",
+                ),
+            )
+        except Exception as e:
+            self.log(f"コンテキストキャッシュを使えません（動画を毎回添付します）: {e}")
+            return None
+        with self._lock:
+            self._caches[key] = {"name": cache.name, "expires": time.monotonic() + self.ttl_seconds}
+        self.log(f"コンテキストキャッシュを作成: {cache.name} (TTL {self.ttl_seconds}秒, 使用中は自動延長)")
+        if self.probe_ttft:
+            self.measure_ttft(video_file, model, cache.name)
+        return cache.name
+
+    def _extend_if_needed(self, entry):
+        with self._lock:
+            if entry["expires"] - time.monotonic() > self.extend_margin_seconds:
+                return
+            entry["expires"] = time.monotonic() + self.ttl_seconds
+        try:
+            self._client.caches.update(
+                name=entry["name"],
+                config=types.UpdateCachedContentConfig(ttl=f"{int(self.ttl_seconds)}s"),
+            )
+        except Exception as e:
+            self.log(f"  - コンテキストキャッシュの延長に失敗: {e}")
+
+    def _timed(self, label, kwargs):
+        start = time.monotonic()
+        response = self._client.models.generate_content(**kwargs)
+        with self._lock:
+            self.latencies[label].append(time.monotonic() - start)
+        return response
+
+    def generate_content(self, **kwargs):
+        model = kwargs.get("model")
+        contents = kwargs.get("contents")
+        if not isinstance(contents, (list, tuple)):
+            contents = [contents]
+        with self._lock:
+            match = next(((part, self._caches[(part.name, model)]) for part in contents
+                          if not isinstance(part, str) and (getattr(part, "name", None), model) in self._caches),
+                         None)
+        if match is None:
+            return self._timed("uncached", kwargs)
+
+        video_part, entry = match
+        self._extend_if_needed(entry)
+        cached_kwargs = dict(kwargs,
+                             contents=[part for part in contents if part is not video_part],
+                             config=with_cached_content(kwargs.get("config"), entry["name"]))
+        try:
+            return self._timed("cached", cached_kwargs)
+        except Exception as e:
+            if is_retryable(e):
+                raise
+            self.log(f"  - コンテキストキャッシュ参照に失敗、動画を添付して再実行: {e}")
+            with self._lock:
+                self.fallbacks += 1
+                dropped = self._caches.pop((video_part.name, model), None)
+            if dropped is not None:
+                # 一覧から外すと release_context_caches で消せないので、ここで消す（残すとTTLまで課金される）
+                try:
+                    self._client.caches.delete(name=dropped["name"])
+                except Exception as delete_error:
+                    self.log(f"  - コンテキストキャッシュの削除に失敗: {dropped['name']} ({delete_error})")
+            return self._timed("uncached", kwargs)
+
+    def _first_token_seconds(self, kwargs):
+        start = time.monotonic()
+        for _ in self._client.models.generate_content_stream(**kwargs):
+            return time.monotonic() - start
+        return None
+
+    def measure_ttft(self, video_file, model, cache_name):
+        """
+        同じ短い質問をキャッシュなし・ありでストリーミングし、最初のトークンまでの時間を記録する
+        """
+        probes = (
+            ("uncached", {"model": model, "contents": [video_file, TTFT_PROBE_PROMPT]}),
+            ("cached", {"model": model, "contents": [TTFT_PROBE_PROMPT],
+                        "config": with_cached_content(None, cache_name)}),
+        )
+        for label, kwargs in probes:
+            try:
+                self.ttft[label] = self._first_token_seconds(kwargs)
+            except Exception as e:
+                self.log(f"  - TTFT計測に失敗 ({label}): {e}")
+
+    def release_context_caches(self, video_file=None):
+        """
+        作成したキャッシュを削除し、計測結果を表示する
+        video_file を指定したらその動画のキャッシュだけを削除する（複数の動画を並行して扱うとき用。計測結果は表示しない）
+        """
+        with self._lock:
+            keys = [key for key in self._caches if video_file is None or key[0] == video_file.name]
+            entries = [self._caches.pop(key) for key in keys]
+        for entry in entries:
+            try:
+                self._client.caches.delete(name=entry["name"])
+            except Exception as e:
+                self.log(f"  - コンテキストキャッシュの削除に失敗: {entry['name']} ({e})")
+        if video_file is not None:
+            return
+
+        for label, name in (("cached", "キャッシュあり"), ("uncached", "キャッシュなし")):
+            values = self.latencies[label]
+            if values:
+                self.log(f"{name}: {len(values)} 回, 平均応答 {sum(values) / len(values):.1f}秒")
+        if self.ttft:
+            detail = ", ".join(f"{label} {seconds:.2f}秒" for label, seconds in self.ttft.items() if seconds is not None)
+            self.log(f"最初のトークンまで: {detail}")
+        if self.fallbacks:
+            self.log(f"キャッシュ参照の失敗による再実行: {self.fallbacks} 回")
+
+def context_caching_client(client, config):
+    """
+    config.yml の context_cache セクションから ContextCachingClient を組み立てる（無効なら元のクライアント）
+    """
+    cache_cfg = config.get("context_cache", {})
+    if not cache_cfg.get("enabled", False):
+        return client
+    return ContextCachingClient(
+        client,
+        system_instruction=cache_cfg.get("system_instruction", DEFAULT_SYSTEM_INSTRUCTION),
+        ttl_seconds=cache_cfg.get("ttl_seconds", 600),
+        extend_margin_seconds=cache_cfg.get("extend_margin_seconds", 120),
+        probe_ttft=cache_cfg.get("probe_ttft", False),
+    )
@@ -0,0 +1,303 @@
+"""
+ローカル検証用の genai.Client 互換フェイク（APIキー・ネットワーク不要）
+アップロード速度や処理待ち時間、応答遅延、エラーを注入して挙動や性能を確認するために使う
+"""
+import os
+import time
+import uuid
+import random
+import threading
+from collections import deque
+from datetime import datetime, timedelta, timezone
+
+class FakeAPIError(Exception):
+    """
+    google.genai.errors.APIError と同じく .code にHTTPステータスを持つ
+    """
+
+    def __init__(self, code, message=""):
+        super().__init__(f"{code} {message}".strip())
+        self.code = code
+
+class FakeState:
+    def __init__(self, name):
+        self.name = name
+
+class FakeFile:
+    def __init__(self, name, size_bytes, ready_at, expiration_time, mime_type="video/mp4", source_path=None):
+        self.name = name
+        self.source_path = source_path  # フェイクの応答を動画に合わせるため（本物にはない）
+        self.uri = f"https://fake.local/{name}"
+        self.size_bytes = size_bytes
+        self.mime_type = mime_type
+        self.expiration_time = expiration_time
+        self._ready_at = ready_at
+
+    @property
+    def state(self):
+        return FakeState("ACTIVE" if time.monotonic() >= self._ready_at else "PROCESSING")
+
+class FakeFiles:
+    """
+    files API のフェイク
+    upload_mb_per_second: アップロード速度（None なら即時）
+    processing_seconds: アップロード後に PROCESSING が続く時間
+    """
+
+    def __init__(self, upload_mb_per_second=None, processing_seconds=0.0, ttl_hours=48):
+        self.upload_mb_per_second = upload_mb_per_second
+        self.processing_seconds = processing_seconds
+        self.ttl = timedelta(hours=ttl_hours)
+        self.upload_count = 0
+        self.get_count = 0
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def upload(self, file, config=None):
+        size = os.path.getsize(file)
+        if self.upload_mb_per_second:
+            time.sleep(size / (self.upload_mb_per_second * 1024 * 1024))
+        remote = FakeFile(
+            name=f"files/{uuid.uuid4().hex[:12]}",
+            size_bytes=size,
+            ready_at=time.monotonic() + self.processing_seconds,
+            expiration_time=datetime.now(timezone.utc) + self.ttl,
+            source_path=os.path.abspath(file),
+        )
+        with self._lock:
+            self._files[remote.name] = remote
+            self.upload_count += 1
+        return remote
+
+    def get(self, name):
+        with self._lock:
+            self.get_count += 1
+            remote = self._files.get(name)
+        if remote is None or remote.expiration_time <= datetime.now(timezone.utc):
+            raise FakeAPIError(404, f"File {name} not found")
+        return remote
+
+    def delete(self, name):
+        with self._lock:
+            self._files.pop(name, None)
+
+class FakeUsage:
+    def __init__(self, prompt_token_count, candidates_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.total_token_count = prompt_token_count + candidates_token_count
+
+class FakeResponse:
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+class FakeCachedContent:
+    def __init__(self, name, model, expire_time, contents=None):
+        self.name = name
+        self.model = model
+        self.expire_time = expire_time
+        self.contents = list(contents or [])
+
+def config_value(config, key):
+    """
+    生成設定（dict でも types の設定オブジェクトでもよい）の値
+    """
+    if isinstance(config, dict):
+        return config.get(key)
+    return getattr(config, key, None)
+
+def parse_ttl(ttl):
+    return float(str(ttl).rstrip("s")) if ttl else 3600.0
+
+class FakeCaches:
+    """
+    caches API（コンテキストキャッシュ）のフェイク
+    available=False なら create が 400 で失敗する（最小トークン数未満・未対応モデルの再現）
+    """
+
+    def __init__(self, available=True):
+        self.available = available
+        self.create_count = 0
+        self.delete_count = 0
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def create(self, model, config=None):
+        if not self.available:
+            raise FakeAPIError(400, "Cached content is too small or not supported")
+        cache = FakeCachedContent(
+            name=f"cachedContents/{uuid.uuid4().hex[:12]}",
+            model=model,
+            expire_time=datetime.now(timezone.utc) + timedelta(seconds=parse_ttl(config_value(config, "ttl"))),
+            contents=config_value(config, "contents"),
+        )
+        with self._lock:
+            self._caches[cache.name] = cache
+            self.create_count += 1
+        return cache
+
+    def get(self, name):
+        with self._lock:
+            cache = self._caches.get(name)
+        if cache is None or cache.expire_time <= datetime.now(timezone.utc):
+            raise FakeAPIError(404, f"CachedContent {name} not found")
+        return cache
+
+    def update(self, name, config=None):
+        cache = self.get(name)
+        cache.expire_time = datetime.now(timezone.utc) + timedelta(seconds=parse_ttl(config_value(config, "ttl")))
+        return cache
+
+    def delete(self, name):
+        with self._lock:
+            if self._caches.pop(name, None) is not None:
+                self.delete_count += 1
+
+    def check(self, name, model):
+        """
+        generate_content からの参照を検証する（キャッシュはモデルごと）。戻り値: キャッシュした contents
+        """
+        cache = self.get(name)
+        if cache.model != model:
+            raise FakeAPIError(400, f"Model {model} does not match cached content model {cache.model}")
+        return cache.contents
+
+class FakeModels:
+    """
+    models API のフェイク
+    latency_seconds: 1呼び出しの応答時間（{モデル名: 秒} でモデルごとにも指定できる）
+    latency_jitter: 応答時間に掛ける揺らぎの幅（0.5 なら ±50%）
+    latency_sigma: 0より大きければ、揺らぎを一様分布ではなく対数正規分布（中央値 latency_seconds）にする
+    error_rate: 失敗させる割合（{モデル名: 割合} でモデルごとにも指定できる）
+    error_code: 失敗時の FakeAPIError のステータス
+    requests_per_minute: 直近60秒の呼び出しがこれを超えたら 429 を返す（None なら無制限）
+    file_tokens_per_mb: usage_metadata の入力トークン数を見積もるときの、動画1MBあたりのトークン数
+    cached_latency_factor: コンテキストキャッシュを参照する呼び出しの応答時間の倍率
+    first_token_fraction: ストリーミングで最初のチャンクが返るまでの時間（応答時間に対する割合）
+    responder: (model, contents, config) -> 応答テキスト を返す関数
+    """
+
+    def __init__(self, latency_seconds=0.0, responder=None, latency_jitter=0.0, error_rate=0.0,
+                 error_code=503, seed=None, cached_latency_factor=0.5, first_token_fraction=0.3,
+                 latency_sigma=0.0, requests_per_minute=None, file_tokens_per_mb=3000):
+        self.latency_seconds = latency_seconds
+        self.latency_jitter = latency_jitter
+        self.latency_sigma = latency_sigma
+        self.requests_per_minute = requests_per_minute
+        self.file_tokens_per_mb = file_tokens_per_mb
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.cached_latency_factor = cached_latency_factor
+        self.first_token_fraction = first_token_fraction
+        self.responder = responder or (lambda model, contents, config: "fake response")
+        self.caches = None  # FakeClient が FakeCaches を渡す
+        self.call_count = 0
+        self.cached_call_count = 0
+        self.calls_by_model = {}
+        self.rate_limited_count = 0
+        self._recent_calls = deque()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _for_model(value, model):
+        return value.get(model, 0.0) if isinstance(value, dict) else value
+
+    def _check_rate_limit(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._recent_calls and now - self._recent_calls[0] >= 60:
+                self._recent_calls.popleft()
+            if len(self._recent_calls) >= self.requests_per_minute:
+                self.rate_limited_count += 1
+                raise FakeAPIError(429, "Resource has been exhausted (e.g. check quota).")
+            self._recent_calls.append(now)
+
+    def _begin(self, model, contents, config):
+        """
+        呼び出しを記録し、(応答時間, 失敗させるか, モデルから見える contents) を決める
+        """
+        if self.requests_per_minute:
+            self._check_rate_limit()
+        contents = list(contents) if isinstance(contents, (list, tuple)) else [contents]
+        cached_content = config_value(config, "cached_content")
+        if cached_content:
+            if self.caches is None:
+                raise FakeAPIError(400, "cached_content is not supported")
+            contents = self.caches.check(cached_content, model) + contents
+        with self._lock:
+            self.call_count += 1
+            self.cached_call_count += 1 if cached_content else 0
+            self.calls_by_model[model] = self.calls_by_model.get(model, 0) + 1
+            if self.latency_sigma > 0:
+                factor = self._random.lognormvariate(0.0, self.latency_sigma)
+            else:
+                factor = 1 + self._random.uniform(-self.latency_jitter, self.latency_jitter)
+            failed = self._random.random() < self._for_model(self.error_rate, model)
+        latency = max(0.0, self._for_model(self.latency_seconds, model) * factor)
+        if cached_content:
+            latency *= self.cached_latency_factor
+        return latency, failed, contents
+
+    def _usage(self, contents, text):
+        """
+        入力は文字数と動画サイズ、出力は文字数からの大まかなトークン数
+        """
+        prompt_tokens = 0
+        for part in contents:
+            if isinstance(part, str):
+                prompt_tokens += len(part) // 2
+            else:
+                prompt_tokens += int(getattr(part, "size_bytes", 0) / 1024 / 1024 * self.file_tokens_per_mb)
+        return FakeUsage(prompt_tokens, len(text) // 2)
+
+    def generate_content(self, model, contents, config=None):
+        latency, failed, contents = self._begin(model, contents, config)
+        time.sleep(latency)
+        if failed:
+            raise FakeAPIError(self.error_code, f"{model} unavailable")
+        text = self.responder(model, contents, config)
+        return FakeResponse(text, self._usage(contents, text))
+
+    def generate_content_stream(self, model, contents, config=None):
+        latency, failed, contents = self._begin(model, contents, config)
+        time.sleep(latency * self.first_token_fraction)
+        if failed:
+            raise FakeAPIError(self.error_code, f"{model} unavailable")
+        text = self.responder(model, contents, config)
+        half = len(text) // 2
+        yield FakeResponse(text[:half])
+        time.sleep(latency * (1 - self.first_token_fraction))
+        yield FakeResponse(text[half:])
+
+class FakeClient:
+    def __init__(self, files=None, models=None, caches=None):
+        self.files = files or FakeFiles()
+        self.models = models or FakeModels()
+        self.caches = caches or FakeCaches()
+        self.models.caches = self.caches
+
+def fake_client_from_config(settings, responder=None):
+    """
+    設定（dict）から FakeClient を組み立てる。キーは FakeFiles / FakeModels の引数名と同じ
+    """
+    return FakeClient(
+        files=FakeFiles(
+            upload_mb_per_second=settings.get("upload_mb_per_second"),
+            processing_seconds=settings.get("processing_seconds", 0.0),
+        ),
+        models=FakeModels(
+            latency_seconds=settings.get("latency_seconds", 0.0),
+            latency_jitter=settings.get("latency_jitter", 0.0),
+            latency_sigma=settings.get("latency_sigma", 0.0),
+            error_rate=settings.get("error_rate", 0.0),
+            error_code=settings.get("error_code", 503),
+            requests_per_minute=settings.get("requests_per_minute"),
+            file_tokens_per_mb=settings.get("file_tokens_per_mb", 3000),
+            cached_latency_factor=settings.get("cached_latency_factor", 0.5),
+            seed=settings.get("seed"),
+            responder=responder,
+        ),
+        caches=FakeCaches(available=settings.get("context_cache_available", True)),
+    )
@@ -3,10 +3,31 @@ import time
 import sys
 import yaml
 import json
+import bisect
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 from google import genai
 from google.genai import types
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.media_index import get_media_info, video_summary
+from common.timemap import load_timemap, source_clock, parse_timestamp
+from common.tracing import span, traced, tracing_from_config, finish_tracing
+from model_router import model_router
+from context_cache import context_caching_client
+from rate_limit import rate_limited_client
+from response_cache import CachingClient, response_cache_from_config
+from upload_registry import registry_from_config, upload_video, upload_videos
+from section_clips import extract_section_clips
+from section_batch import generate_bodies_batched
+from screenshot_images import (DuplicateFinder, ScreenshotStats, encode_screenshot, frame_signature,
+                               report_image, screenshot_settings)
+from usage_tracker import UsageTracker
+from activity_timeline import activity_hints, hints_prompt, structure_from_hints, timeline_settings
+from work_log import annotate_clock, recording_start_time, write_log
+from worklog_store import default_worker, store_from_config
+
 def load_config():
     config_path = os.path.join(os.path.dirname(__file__), "config.yml")
     if not os.path.exists(config_path):
@@ -15,38 +36,145 @@ def load_config():
     with open(config_path, "r") as f:
         return yaml.safe_load(f)
 
-def extract_frame(video_path, timestamp_str, output_path):
+# キーフレーム情報がない場合、この秒数以上先のフレームはシークで取得する
+SEEK_THRESHOLD_SECONDS = 10
+IMAGE_WRITE_WORKERS = 4
+
+def get_video_timing(video_path, cap):
     """
-    指定されたタイムスタンプ(MM:SS形式)のフレームを抽出して保存する
+    メディアインデックスからFPSとキーフレーム位置(秒)を取得する（失敗時はOpenCVのFPSのみ）
     """
     try:
-        parts = list(map(int, timestamp_str.split(':')))
-        seconds = parts[0] * 60 + parts[1]
-        if len(parts) > 2: seconds += parts[2] # HH:MM:SS対応
-        
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            return False
-            
-        # FPSを取得してフレーム位置を計算
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        frame_no = int(fps * seconds)
-        
-        cap.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
-        ret, frame = cap.read()
-        
-        if ret:
-            cv2.imwrite(output_path, frame)
-        
-        cap.release()
-        return ret
+        info = video_summary(get_media_info(video_path, keyframes=True))
+        if info and info['fps']:
+            return info['fps'], info['keyframes'] or []
+    except Exception as e:
+        print(f"メディアインデックス参照エラー: {e}")
+    return cap.get(cv2.CAP_PROP_FPS), []
+
+def save_frame(frame, output_path):
+    return output_path if cv2.imwrite(output_path, frame) else None
+
+@traced("extract_frames")
+def extract_frames(video_path, requests, max_workers=IMAGE_WRITE_WORKERS, image_settings=None):
+    """
+    複数のタイムスタンプ(MM:SS / HH:MM:SS形式)のフレームを、動画を1回開くだけでまとめて抽出して保存する
+    requests: [(timestamp_str, output_path), ...]
+    image_settings: screenshot_settings の戻り値。有効なら縮小・エンコードし、ほぼ同じ画面は1枚を共有する
+                    （拡張子は設定の形式になる）。None か無効なら原寸の JPEG をそのまま保存する
+    戻り値: 保存に成功した {timestamp_str: 保存先パス}
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return {}
+
+    stage = image_settings if image_settings and image_settings.get("enabled") else None
+    if stage:
+        max_workers = stage["workers"]
+    stats = ScreenshotStats() if stage else None
+    duplicates = None
+    if stage and stage["dedup"]:
+        duplicates = DuplicateFinder(stage["dedup_max_distance"], stage["dedup_max_pixel_diff"])
+    results = {}
+    try:
+        fps, keyframes = get_video_timing(video_path, cap)
+        keyframe_frames = [int(round(t * fps)) for t in keyframes]
+
+        # フレーム番号ごとにまとめ、先頭から順に処理する
+        targets = {}
+        for timestamp_str, output_path in requests:
+            try:
+                frame_no = int(fps * parse_timestamp(timestamp_str))
+            except ValueError:
+                print(f"画像抽出エラー: 不正なタイムスタンプ {timestamp_str}")
+                continue
+            targets.setdefault(frame_no, []).append((timestamp_str, output_path))
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            writes = []  # [(timestamp_str, 保存の future, 先に保存した1枚を共有する重複か)]
+            position = 0  # 次にデコードされるフレーム番号
+            for frame_no in sorted(targets):
+                if should_seek(position, frame_no, keyframe_frames, fps):
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, frame_no)
+                else:
+                    # 近いフレームは順方向に読み進める（grabは色変換しないので軽い）
+                    for _ in range(frame_no - position):
+                        if not cap.grab():
+                            break
+                ret, frame = cap.read()
+                position = frame_no + 1
+                if not ret:
+                    continue
+                signature = frame_signature(frame) if duplicates else None
+                for timestamp_str, output_path in targets[frame_no]:
+                    if stage is None:
+                        writes.append((timestamp_str, executor.submit(save_frame, frame, output_path), False))
+                        continue
+                    kept = duplicates.find(signature) if duplicates else None
+                    if kept is not None:
+                        # ほぼ同じ画面は先に保存した1枚を共有する
+                        writes.append((timestamp_str, kept, True))
+                        continue
+                    # 削減量の推定用に、最初の1枚だけ従来の保存方法でも符号化する
+                    future = executor.submit(encode_screenshot, frame, output_path, stage, not writes)
+                    if duplicates:
+                        duplicates.keep(signature, future)
+                    writes.append((timestamp_str, future, False))
+
+            for timestamp_str, future, duplicate in writes:
+                try:
+                    result = future.result()
+                    if stage is None:
+                        if result:
+                            results[timestamp_str] = result
+                        continue
+                    path, written, legacy = result
+                    results[timestamp_str] = path
+                    if duplicate:
+                        stats.add_duplicate()
+                    else:
+                        stats.add(written, legacy)
+                except Exception as e:
+                    print(f"画像保存エラー: {e}")
+            if stats and stats.saved:
+                print(stats.summary())
     except Exception as e:
         print(f"画像抽出エラー: {e}")
-        return False
+    finally:
+        cap.release()
+    return results
+
+def should_seek(position, frame_no, keyframe_frames, fps):
+    """
+    現在位置から順に読むより、シークした方がデコード量が少ないかを判定する
+    """
+    if frame_no <= position:
+        return frame_no < position
+    if keyframe_frames:
+        # シーク先の直前キーフレームが現在位置より先ならシークの方が速い
+        index = bisect.bisect_right(keyframe_frames, frame_no) - 1
+        return index >= 0 and keyframe_frames[index] > position
+    return frame_no - position > fps * SEEK_THRESHOLD_SECONDS
+
+def extract_frame(video_path, timestamp_str, output_path):
+    """
+    指定されたタイムスタンプ(MM:SS形式)のフレームを抽出して保存する
+    """
+    return timestamp_str in extract_frames(video_path, [(timestamp_str, output_path)])
+
+def screenshot_path(output_img_dir, section):
+    """
+    セクションのスクショ保存先パス
+    """
+    # ファイル名に使えない文字を置換
+    safe_timestamp = section["screenshot_timestamp"].replace(':', '-')
+    return os.path.join(output_img_dir, f"sec_{section['id']}_{safe_timestamp}.jpg")
 
-def analyze_structure(client, video_file, model_name):
+@traced("analyze_structure")
+def analyze_structure(client, video_file, model_name, extra_instructions=""):
     """
     フェーズ1: 動画の構造解析とスクショポイントの抽出（JSON出力）
+    extra_instructions: プロンプト末尾に追加する指示（直前の動画の情報など）
     """
     prompt = """
     あなたは業務改善コンサルタントです。この作業動画から詳細な手順書を作成するための「構成案」を作成してください。
@@ -62,7 +190,10 @@ def analyze_structure(client, video_file, model_name):
           "start_time": "00:00",
           "end_time": "02:30",
           "screenshot_timestamp": "00:45", 
-          "screenshot_reason": "操作メニューが表示されている重要な瞬間"
+          "screenshot_reason": "操作メニューが表示されている重要な瞬間",
+          "app": "主に使用しているアプリ名（例: Rhino）",
+          "tags": ["Design", "3D"],
+          "steps": ["フロアプランのインポート", "壁・柱の立ち上げ"]
         },
         ...
       ]
@@ -71,7 +202,10 @@ def analyze_structure(client, video_file, model_name):
     
     * `sections` は作業の区切りごとに細かく分割してください（1セクション3〜5分程度を目安）。
     * `screenshot_timestamp` はそのセクション内で最も視覚的な情報（UI、設定値、結果など）が重要な瞬間の時間を "MM:SS" で指定してください。
+    * `tags` は作業の種類を表す英単語のタグ、`steps` は作業手順を短い文で列挙してください。
     """
+    if extra_instructions:
+        prompt += extra_instructions
 
     print(f"動画の構造を解析中 ({model_name})...")
     response = client.models.generate_content(
@@ -83,14 +217,50 @@ def analyze_structure(client, video_file, model_name):
     )
     return json.loads(response.text)
 
-def write_section_report(client, video_file, model_name, section, image_rel_path):
+def plan_structure(client, video_file, video_path, model_name, config, extra_instructions=""):
+    """
+    構造解析。activity_timeline が有効なら先にローカルで画面変化を解析し、
+    区切り候補をプロンプトに渡す（mode: skip なら構造解析を呼ばず候補をそのまま使う）
+    """
+    timeline_cfg = timeline_settings(config)
+    if not timeline_cfg["enabled"]:
+        return analyze_structure(client, video_file, model_name, extra_instructions)
+
+    start = time.monotonic()
+    try:
+        with span("activity_timeline") as timeline_span:
+            hints = activity_hints(video_path, timeline_cfg)
+            timeline_span.set(sections=len(hints))
+    except Exception as e:
+        # ローカルの前処理なので、失敗しても区切り候補なしで構造解析する
+        print(f"画面変化の解析エラー（候補なしで続行）: {e}")
+        return analyze_structure(client, video_file, model_name, extra_instructions)
+    print(f"画面変化の解析: 区切り候補 {len(hints)} セクション ({time.monotonic() - start:.1f}秒)")
+    if timeline_cfg["mode"] == "skip" and hints:
+        return structure_from_hints(hints, video_path)
+    return analyze_structure(client, video_file, model_name, extra_instructions + (hints_prompt(hints) if hints else ""))
+
+def write_section_report(client, video_file, model_name, section, image_rel_path, is_clip=False):
     """
     フェーズ3: セクションごとの詳細レポート執筆
+    is_clip=True なら video_file はセクションの範囲だけを切り出したクリップ
     """
-    img_markdown = f"\n![{section['screenshot_reason']}]({image_rel_path})\n" if image_rel_path else ""
-    
+    with span("write_section", title=section.get("title"), is_clip=is_clip):
+        body = generate_section_body(client, video_file, model_name, section, is_clip)
+    return format_section(section, [(image_rel_path, body)])
+
+def generate_section_body(client, video_file, model_name, section, is_clip=False):
+    """
+    セクションの作業ログ本文（Markdown）をモデルに書かせる
+    """
+    if is_clip:
+        target = f"""この動画は作業動画の {section['start_time']} から {section['end_time']} までを切り出したクリップです。
+    クリップ全体について、"""
+    else:
+        target = f"動画の {section['start_time']} から {section['end_time']} までの範囲について、"
+
     prompt = f"""
-    動画の {section['start_time']} から {section['end_time']} までの範囲について、
+    {target}
     「{section['title']}」という見出しで詳細な作業ログを書いてください。
 
     ## 要件
@@ -107,14 +277,264 @@ def write_section_report(client, video_file, model_name, section, image_rel_path
         model=model_name,
         contents=[video_file, prompt]
     )
-    
+    return response.text
+
+def image_markdown(alt, image_rel_path):
+    """
+    スクショのMarkdown。image_rel_path が (サムネイル, 元画像) ならサムネイルを載せ、クリックで元画像を開く
+    """
+    if isinstance(image_rel_path, (list, tuple)):  # 状態ファイル(JSON)から戻すとリストになる
+        thumb_rel_path, full_rel_path = image_rel_path
+        return f"[![{alt}]({thumb_rel_path})]({full_rel_path})"
+    return f"![{alt}]({image_rel_path})"
+
+def format_section(section, parts):
+    """
+    セクションの見出しと、(画像の相対パス, 本文) のリストをMarkdownにまとめる
+    動画の境界で結合したセクションは parts が複数になる
+    """
+    # 変換前の元動画の時刻が分かる場合は見出しに併記
+    source_range = ""
+    if section.get('source_start') and section.get('source_end'):
+        source_range = f" [元動画 {section['source_start']} - {section['source_end']}]"
+
     # 画像マークダウンを挿入
-    return f"\n## {section['title']} ({section['start_time']} - {section['end_time']})\n{img_markdown}\n{response.text}\n"
+    content = ""
+    for image_rel_path, body in parts:
+        img_markdown = f"\n{image_markdown(section['screenshot_reason'], image_rel_path)}\n" if image_rel_path else ""
+        content += f"{img_markdown}\n{body}\n"
+    return f"\n## {section['title']} ({section['start_time']} - {section['end_time']}){source_range}\n{content}"
+
+@traced("section_clips")
+def prepare_section_clips(client, video_path, sections, clip_dir, upload_registry, config, response_cache=None):
+    """
+    セクションの範囲をクリップとして並列に切り出し、並列にアップロードする
+    戻り値: {セクションID: アップロード済みクリップ}（失敗したセクションは動画全体で執筆する）
+    """
+    clip_paths = extract_section_clips(video_path, sections, clip_dir,
+                                       max_workers=config.get("report", {}).get("clip_workers", 4))
+    uploads = upload_videos(client, list(clip_paths.values()), upload_registry, config.get("upload", {}))
+
+    section_files = {}
+    for section_id, path in clip_paths.items():
+        result = uploads.get(path)
+        if isinstance(result, tuple):
+            clip_file, clip_hash = result
+            section_files[section_id] = clip_file
+            if response_cache:
+                client.register_file(clip_file, clip_hash)
+    print(f"セクションクリップ: {len(section_files)}/{len(sections)}")
+    return section_files
+
+def image_rel_path_for(section, screenshots, screenshot_dir_name):
+    """
+    レポートからのスクショの相対パス（screenshots が None ならスクショなしのレポート）
+    """
+    if screenshots is None or "screenshot_timestamp" not in section:
+        return None
+    img_full_path = screenshots.get(section["screenshot_timestamp"])
+    if not img_full_path:
+        print(f"  - スクショ失敗: {section['screenshot_timestamp']}")
+        return None
+    return report_image(screenshot_dir_name, img_full_path)
+
+def write_sections(client, video_file, model_name, sections, screenshots, screenshot_dir_name,
+                   output_md_path, concurrency, section_files=None):
+    """
+    セクションごとの執筆を並列に実行し、前のセクションがすべて終わった順にレポートへ追記する
+    screenshots: extract_frames の戻り値 {timestamp: path}（スクショなしなら None）
+    section_files: {セクションID: アップロード済みクリップ}（ないセクションは動画全体を使う）
+    """
+    section_files = section_files or {}
+
+    def write(section):
+        print(f"処理中: {section.get('title', 'Untitled')}...")
+        clip_file = section_files.get(section.get("id"))
+        return write_section_report(client, clip_file or video_file, model_name, section,
+                                    image_rel_path_for(section, screenshots, screenshot_dir_name),
+                                    is_clip=clip_file is not None)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = [executor.submit(write, section) for section in sections]
+
+        # 先頭から順に結果を待つので、追記順はセクション順のまま
+        for section, future in zip(sections, futures):
+            try:
+                section_content = future.result()
+
+                # ファイルに追記 (Step-by-step writing)
+                with open(output_md_path, "a", encoding="utf-8") as f:
+                    f.write(section_content)
+                    f.write("\n---\n") # セパレータ
+
+                print(f"  - 執筆完了: {section.get('title', 'Untitled')}")
+
+            except Exception as e:
+                print(f"  - セクション生成エラー ({section.get('title', 'Untitled')}): {e}")
+
+@traced("write_sections_batched")
+def write_sections_batched(client, video_file, model_name, sections, screenshots, screenshot_dir_name,
+                           output_md_path, sections_per_call, concurrency):
+    """
+    複数セクションをまとめて1回（sections_per_call 件ずつ）の呼び出しで執筆し、セクション順にレポートへ追記する
+    応答に欠けたセクションは1件ずつ書き直す
+    """
+    bodies = generate_bodies_batched(
+        client, video_file, model_name, sections, sections_per_call, concurrency,
+        write_one=lambda section: generate_section_body(client, video_file, model_name, section))
 
-def main():
+    with open(output_md_path, "a", encoding="utf-8") as f:
+        for section in sections:
+            body = bodies.get(section["id"])
+            if body is None:
+                print(f"  - セクション生成エラー ({section.get('title', 'Untitled')}): 本文なし")
+                continue
+            image_rel_path = image_rel_path_for(section, screenshots, screenshot_dir_name)
+            f.write(format_section(section, [(image_rel_path, body)]))
+            f.write("\n---\n") # セパレータ
+            print(f"  - 執筆完了: {section.get('title', 'Untitled')}")
+
+def uses_local_vlm(config):
+    return config.get("backend", "gemini") == "local_vlm"
+
+def active_model_name(config):
+    """
+    呼び出しに使うモデル名（ローカルVLMなら応答キャッシュがGeminiと混ざらないよう "local:" を付ける）
+    """
+    if uses_local_vlm(config):
+        vlm_cfg = config.get("local_vlm", {})
+        name = "stub" if vlm_cfg.get("backend") == "stub" else vlm_cfg.get("model_name", "qwen")
+        return f"local:{name}"
+    return config.get("model_name", "gemini-2.0-flash-exp")
+
+def create_client(config, api_key, no_cache=False, base_client=None):
+    """
+    genai.Client にモデルルーター、レート制限・リトライ、コンテキストキャッシュと応答キャッシュを付与する
+    backend: local_vlm なら modal_test/vlm_worker.py の常駐ワーカーを起動してそれを使う
+    base_client: genai.Client の代わりに使うクライアント（fake_genai.FakeClient など）
+    戻り値: (クライアント, ResponseCache または None)
+    """
+    response_cache = response_cache_from_config(config, os.path.dirname(os.path.abspath(__file__)))
+    if base_client is None and uses_local_vlm(config):
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "modal_test"))
+        from vlm_worker import local_client_from_config
+        client = local_client_from_config(config.get("local_vlm", {}))
+    else:
+        client = context_caching_client(
+            rate_limited_client(base_client or genai.Client(api_key=api_key), config,
+                                route=lambda limited: model_router(limited, config)), config)
+    if response_cache:
+        response_cache.evict()
+        client = CachingClient(client, response_cache, bypass=no_cache)
+    return client, response_cache
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="作業動画からレポートを生成する")
+    parser.add_argument("video_path", nargs="?", help="動画パス（省略時は input/sample.mp4）")
+    parser.add_argument("--output-dir", help="出力先（省略時は output）")
+    parser.add_argument("--no-cache", action="store_true", help="モデル応答キャッシュを読まずに再問い合わせする")
+    return parser.parse_args(argv)
+
+class StructureError(RuntimeError):
+    """
+    構造解析に失敗した（レポートを作れない）
+    """
+
+def generate_report(client, video_file, video_hash, video_path, config, output_dir, upload_registry,
+                    response_cache=None):
+    """
+    アップロード済みの動画1本から output_dir に Report.md・スクショ・worklog.tsv を作り、作業ログをストアに登録する
+    戻り値: レポートのパス
+    """
+    primary_model = active_model_name(config)
+    include_screenshots = config.get("report", {}).get("include_screenshots", False)
+    screenshot_dir_name = config.get("report", {}).get("screenshot_dir", "images")
+
+    output_md_path = os.path.join(output_dir, "Report.md")
+    output_img_dir = os.path.join(output_dir, screenshot_dir_name)
+    os.makedirs(output_dir, exist_ok=True)
+    if include_screenshots and not os.path.exists(output_img_dir):
+        os.makedirs(output_img_dir)
+
+    # 動画と共通の指示をコンテキストキャッシュにする（有効なら委譲で届く）
+    attach_context = getattr(client, "attach_context", None)
+    context_cache = attach_context(video_file, primary_model) if attach_context else None
+
+    # --- Phase 1: 構造解析 ---
+    try:
+        structure = plan_structure(client, video_file, video_path, primary_model, config)
+        print("構造解析完了。セクション数:", len(structure.get("sections", [])))
+    except Exception as e:
+        raise StructureError(f"構造解析失敗: {e}") from e
+
+    # レポートファイルの初期化
+    with open(output_md_path, "w", encoding="utf-8") as f:
+        f.write(f"# {structure.get('title', '動画分析レポート')}\n\n")
+        f.write("## 概要\nAIによる自動生成レポートです。詳細な手順と分析を含みます。\n\n")
+
+    # タイムラプス変換時のタイムマップがあれば、元動画の時刻に換算する
+    timemap = load_timemap(video_path)
+    if timemap:
+        for section in structure.get("sections", []):
+            try:
+                section['source_start'] = source_clock(timemap, section['start_time'])
+                section['source_end'] = source_clock(timemap, section['end_time'])
+            except (KeyError, ValueError):
+                pass
+
+    # --- Phase 2: スクショを一括抽出 ---
+    screenshots = None
+    if include_screenshots:
+        # 同じタイムスタンプは1枚だけ保存して共有する
+        screenshot_requests = {}
+        for section in structure.get("sections", []):
+            if "screenshot_timestamp" in section:
+                screenshot_requests.setdefault(section["screenshot_timestamp"], screenshot_path(output_img_dir, section))
+        screenshots = extract_frames(video_path, list(screenshot_requests.items()),
+                                     image_settings=screenshot_settings(config))
+        print(f"スクショ保存: {len(screenshots)}/{len(screenshot_requests)}")
+
+    # --- Phase 2.5: セクションごとのクリップを切り出してアップロード（動画全体をN回送らない） ---
+    section_mode = config.get("report", {}).get("section_mode", "per_section")
+    section_files = {}
+    # コンテキストキャッシュがあれば動画全体の参照が安いので、クリップは切り出さない
+    if (config.get("report", {}).get("section_clips", False) and section_mode == "per_section"
+            and not context_cache):
+        clip_dir = os.path.join(output_dir, "clips", video_hash[:12])
+        section_files = prepare_section_clips(client, video_path, structure.get("sections", []),
+                                              clip_dir, upload_registry, config, response_cache)
+
+    # --- Phase 3: セクション執筆（並列実行、セクション順に追記） ---
+    section_concurrency = config.get("api", {}).get("section_concurrency", 4)
+    if section_mode == "batched":
+        # 複数セクションを1回の呼び出しでまとめて執筆（動画の取り込みと往復をセクション数だけ払わない）
+        write_sections_batched(client, video_file, primary_model, structure.get("sections", []),
+                               screenshots, screenshot_dir_name, output_md_path,
+                               config.get("report", {}).get("sections_per_call", 0), section_concurrency)
+    else:
+        write_sections(client, video_file, primary_model, structure.get("sections", []),
+                       screenshots, screenshot_dir_name, output_md_path, section_concurrency, section_files)
+
+    # --- Phase 4: 作業ログ(TSV)を書き出し、集計用のストアに登録 ---
+    sections = [dict(section) for section in structure.get("sections", [])]
+    recording_start = recording_start_time(video_path, timemap)
+    annotate_clock(sections, recording_start, timemap)
+    output_log_path = os.path.join(output_dir, "worklog.tsv")
+    write_log(output_log_path, sections)
+    with span("worklog"), store_from_config(config, os.path.dirname(os.path.abspath(__file__))) as store:
+        count = store.ingest_tsv(output_log_path, default_worker(config), recording_start.date().isoformat(),
+                                 source=os.path.basename(video_path))
+    print(f"作業ログ: {output_log_path}（{count} 行をストアに登録）")
+    return output_md_path
+
+def main(argv=None, base_client=None, config=None):
+    """
+    base_client・config を渡すと genai.Client と config.yml の代わりに使う（ベンチマーク用。APIキー不要）
+    """
     # コマンドライン引数の処理
-    if len(sys.argv) > 1:
-        video_path = sys.argv[1]
+    args = parse_args(argv)
+    if args.video_path:
+        video_path = args.video_path
         # 相対パスであれば絶対パスに変換
         if not os.path.isabs(video_path):
             video_path = os.path.abspath(video_path)
@@ -123,19 +543,20 @@ def main():
         video_path = os.path.join(os.path.dirname(__file__), "input", "sample.mp4")
 
     # 設定の読み込み
-    config = load_config()
-    primary_model = config.get("model_name", "gemini-2.0-flash-exp")
-    fallback_models = config.get("fallback_models", [])
+    if config is None:
+        config = load_config()
+    tracing_from_config(config, os.path.dirname(os.path.abspath(__file__)), "report")
 
-    # APIキーの取得
+    # APIキーの取得（ローカルVLMでは不要）
     api_key = os.environ.get("GOOGLE_API_KEY")
-    if not api_key:
+    if not api_key and not uses_local_vlm(config) and base_client is None:
         print("エラー: 環境変数 GOOGLE_API_KEY が設定されていません。")
         sys.exit(1)
 
-    # クライアントの初期化
+    # クライアントの初期化（レート制限とリトライ、応答キャッシュを付与し、呼び出し回数とトークン数を集計）
     try:
-        client = genai.Client(api_key=api_key)
+        client, response_cache = create_client(config, api_key, no_cache=args.no_cache, base_client=base_client)
+        client = UsageTracker(client)
     except Exception as e:
         print(f"クライアントの初期化に失敗しました: {e}")
         sys.exit(1)
@@ -144,87 +565,44 @@ def main():
         print(f"エラー: 動画ファイルが見つかりません: {video_path}")
         sys.exit(1)
 
-    # configから設定取得
-    include_screenshots = config.get("report", {}).get("include_screenshots", False)
-    screenshot_dir_name = config.get("report", {}).get("screenshot_dir", "images")
-    
-    output_md_path = os.path.join(os.path.dirname(__file__), "output", "Report.md")
-    output_img_dir = os.path.join(os.path.dirname(__file__), "output", screenshot_dir_name)
-    
-    if include_screenshots and not os.path.exists(output_img_dir):
-        os.makedirs(output_img_dir)
+    upload_registry = registry_from_config(config, os.path.dirname(os.path.abspath(__file__)))
+    output_dir = os.path.abspath(args.output_dir) if args.output_dir else os.path.join(os.path.dirname(__file__), "output")
 
-    print(f"動画ファイルをアップロードしています: {video_path}")
-    
+    pipeline_start = time.monotonic()
     try:
-        # 動画ファイルのアップロード
-        video_file = client.files.upload(file=video_path)
-        print(f"アップロード完了: {video_file.name}")
-        
-        # 処理完了待ち
-        print("動画の処理を待機中...")
-        while video_file.state.name == "PROCESSING":
-            print(".", end="", flush=True)
-            time.sleep(2)
-            video_file = client.files.get(name=video_file.name)
-        
-        if video_file.state.name == "FAILED":
-            print("\n動画の処理に失敗しました。")
+        # 動画ファイルのアップロード（同じ内容の有効なリモートファイルがあれば再利用）と処理完了待ち
+        try:
+            video_file, video_hash = upload_video(client, video_path, upload_registry, config.get("upload", {}))
+        except (RuntimeError, TimeoutError) as e:
+            print(f"\n{e}")
             sys.exit(1)
-            
-        print(f"\n動画の処理が完了しました。状態: {video_file.state.name}")
+        if response_cache:
+            client.register_file(video_file, video_hash)
 
-        # --- Phase 1: 構造解析 ---
         try:
-            structure = analyze_structure(client, video_file, primary_model)
-            print("構造解析完了。セクション数:", len(structure.get("sections", [])))
-        except Exception as e:
-            print(f"構造解析失敗: {e}")
+            output_md_path = generate_report(client, video_file, video_hash, video_path, config, output_dir,
+                                             upload_registry, response_cache)
+        except StructureError as e:
+            print(e)
             sys.exit(1)
 
-        # レポートファイルの初期化
-        with open(output_md_path, "w", encoding="utf-8") as f:
-            f.write(f"# {structure.get('title', '動画分析レポート')}\n\n")
-            f.write("## 概要\nAIによる自動生成レポートです。詳細な手順と分析を含みます。\n\n")
-
-        # --- Phase 2 & 3: ループ処理 ---
-        for section in structure.get("sections", []):
-            print(f"処理中: {section.get('title', 'Untitled')}...")
-            
-            # 画像抽出
-            image_rel_path = None
-            if include_screenshots and "screenshot_timestamp" in section:
-                timestamp = section["screenshot_timestamp"]
-                # ファイル名に使えない文字を置換
-                safe_timestamp = timestamp.replace(':', '-')
-                img_filename = f"sec_{section['id']}_{safe_timestamp}.jpg"
-                img_full_path = os.path.join(output_img_dir, img_filename)
-                
-                if extract_frame(video_path, timestamp, img_full_path):
-                    image_rel_path = f"./{screenshot_dir_name}/{img_filename}"
-                    print(f"  - スクショ保存: {timestamp}")
-                else:
-                    print(f"  - スクショ失敗: {timestamp}")
-
-            # 詳細執筆
-            try:
-                section_content = write_section_report(client, video_file, primary_model, section, image_rel_path)
-                
-                # ファイルに追記 (Step-by-step writing)
-                with open(output_md_path, "a", encoding="utf-8") as f:
-                    f.write(section_content)
-                    f.write("\n---\n") # セパレータ
-                    
-                print(f"  - 執筆完了")
-                time.sleep(2) # レート制限回避のため少し待機
-                
-            except Exception as e:
-                print(f"  - セクション生成エラー: {e}")
-
         print(f"\n全処理完了。レポート: {output_md_path}")
+        section_mode = config.get("report", {}).get("section_mode", "per_section")
+        print(f"所要時間 {time.monotonic() - pipeline_start:.1f}秒 ({section_mode}), {client.summary()}")
+        print_stats = getattr(client, "print_stats", None)  # ルーターが有効なら委譲で届く
+        if print_stats:
+            print_stats()
+        if response_cache:
+            print(f"応答キャッシュ: ヒット {response_cache.hits} / ミス {response_cache.misses} "
+                  f"(ヒット率 {response_cache.hit_rate():.0%})")
 
     except Exception as e:
         print(f"予期せぬエラーが発生しました: {e}")
+    finally:
+        release_context_caches = getattr(client, "release_context_caches", None)
+        if release_context_caches:
+            release_context_caches()
+        finish_tracing()
 
 if __name__ == "__main__":
     main()
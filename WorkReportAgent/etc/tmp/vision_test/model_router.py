@@ -0,0 +1,285 @@
+import time
+import threading
+from collections import deque
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+from client_wrapper import ClientWrapper
+from rate_limit import error_status, is_retryable
+
+class ModelStats:
+    """
+    1モデル分の直近の応答時間・成否とサーキットブレーカーの状態
+    """
+
+    def __init__(self, window=50):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def percentile(self, q):
+        """
+        直近の応答時間の q 分位点（記録がなければ None）
+        """
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def error_rate(self):
+        if not self.outcomes:
+            return 0.0
+        return 1.0 - sum(self.outcomes) / len(self.outcomes)
+
+    def is_open(self, now):
+        return now < self.open_until
+
+def is_json_request(config):
+    """
+    JSONモードの呼び出しか（構造解析など、別モデルの応答を混ぜたくない呼び出しはヘッジしない）
+    """
+    if isinstance(config, dict):
+        return config.get("response_mime_type") == "application/json"
+    return getattr(config, "response_mime_type", None) == "application/json"
+
+def cached_content_of(config):
+    """
+    コンテキストキャッシュ参照の呼び出しならキャッシュ名（キャッシュは作成したモデルでしか使えない）
+    """
+    if isinstance(config, dict):
+        return config.get("cached_content")
+    return getattr(config, "cached_content", None)
+
+def should_fail_over(error):
+    """
+    別のモデルで再試行する価値があるエラーか
+    429/5xx・モデルが見つからない(404)・ステータス不明（タイムアウトや通信エラー）は切り替える。
+    それ以外の 4xx はプロンプト側の問題なので、どのモデルでも同じく失敗する
+    """
+    code = error_status(error)
+    return code is None or code == 404 or is_retryable(error)
+
+class ModelRouter(ClientWrapper):
+    """
+    fallback_models を使うモデルルーター
+    * モデルごとに応答時間と成否を記録し、連続 failure_threshold 回失敗したモデルは
+      cooldown_seconds の間サーキットを開いて呼ばない（経過後は1回試して、成功すれば戻す）
+    * 失敗したら設定順に次のモデルへ切り替える
+    * hedge=True なら、JSONモード以外の呼び出しが p95 の応答時間を超えても返らないとき、
+      残りのモデルで一番速いものにも同じリクエストを送り、先に返った方を使う
+
+    トークンバケットの外側・リトライの内側に置く（rate_limited_client の route）ので、切り替えやヘッジの
+    呼び出しもレート制限を守り、全モデルが失敗したときだけバックオフ付きで全体をやり直す
+    served_model() で、この呼び出しスレッドの直前の呼び出しに実際に応答したモデルが分かる
+    """
+
+    def __init__(self, client, model_names, failure_threshold=3, cooldown_seconds=120.0, window=50,
+                 hedge=False, hedge_min_samples=5, hedge_min_seconds=10.0, log=print):
+        super().__init__(client)
+        self.model_names = list(dict.fromkeys(model_names))
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.hedge = hedge
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_min_seconds = hedge_min_seconds
+        self.log = log
+        self.hedge_count = 0
+        self.hedge_wins = 0
+        self.stats = {name: ModelStats(window) for name in self.model_names}
+        self._window = window
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def served_model(self):
+        """
+        このスレッドの直前の generate_content に応答したモデル（応答キャッシュが別モデルの応答を保存しないため）
+        """
+        return getattr(self._local, "served", None)
+
+    def _stats(self, model):
+        with self._lock:
+            if model not in self.stats:
+                self.stats[model] = ModelStats(self._window)
+            return self.stats[model]
+
+    def _record(self, model, latency, error=None):
+        stats = self._stats(model)
+        with self._lock:
+            stats.calls += 1
+            stats.outcomes.append(error is None)
+            if error is None:
+                stats.latencies.append(latency)
+                stats.consecutive_failures = 0
+                stats.open_until = 0.0
+                return
+            stats.errors += 1
+            stats.consecutive_failures += 1
+            if stats.consecutive_failures >= self.failure_threshold:
+                stats.open_until = time.monotonic() + self.cooldown_seconds
+                opened = True
+            else:
+                opened = False
+        if opened:
+            self.log(f"  - ルーター: {model} のサーキットを開きます（連続失敗 {stats.consecutive_failures} 回、"
+                     f"{self.cooldown_seconds:.0f}秒間使いません）")
+
+    def candidates(self, requested):
+        """
+        試す順のモデル一覧。指定モデル → 設定順の残り。サーキットが開いているモデルは
+        再開が近い順に最後に回す（全モデルが開いていても何かは試す）
+        """
+        order = [requested] + [name for name in self.model_names if name != requested]
+        now = time.monotonic()
+        closed = [name for name in order if not self._stats(name).is_open(now)]
+        opened = sorted((name for name in order if name not in closed), key=lambda name: self._stats(name).open_until)
+        return closed + opened
+
+    def _call(self, model, kwargs):
+        start = time.monotonic()
+        try:
+            response = self._client.models.generate_content(**dict(kwargs, model=model))
+        except Exception as e:
+            latency = time.monotonic() - start
+            self.log(f"  - ルーター: {model} 失敗 ({latency:.1f}秒): {e}")
+            self._record(model, latency, e)
+            raise
+        latency = time.monotonic() - start
+        self._record(model, latency)
+        self.log(f"  - ルーター: {model} 応答 {latency:.1f}秒")
+        return response
+
+    def _submit(self, model, kwargs):
+        """
+        別スレッドで呼び出す（負けた側のリクエストは取り消せないので、終わるまで走らせて記録だけ残す）
+        """
+        future = Future()
+
+        def run():
+            try:
+                future.set_result(self._call(model, kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, daemon=True).start()
+        return future
+
+    def hedge_delay(self, model):
+        """
+        ヘッジを送るまでの待ち時間（そのモデルの p95、記録が少なければ None でヘッジしない）
+        """
+        stats = self._stats(model)
+        with self._lock:
+            if len(stats.latencies) < self.hedge_min_samples:
+                return None
+            p95 = stats.percentile(0.95)
+        return max(self.hedge_min_seconds, p95)
+
+    def fastest(self, models):
+        """
+        応答時間の中央値が一番短いモデル（記録がないモデルは設定順で後回し）
+        """
+        def key(item):
+            index, name = item
+            median = self._stats(name).percentile(0.5)
+            return (median is None, median or 0.0, index)
+        return min(enumerate(models), key=key)[1]
+
+    def _hedged(self, model, remaining, kwargs):
+        """
+        戻り値: (応答したモデル, 応答)
+        """
+        delay = self.hedge_delay(model)
+        if delay is None or not remaining:
+            return model, self._call(model, kwargs)
+
+        primary = self._submit(model, kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return model, primary.result()
+
+        backup_model = self.fastest(remaining)
+        remaining.remove(backup_model)
+        self.log(f"  - ルーター: {model} が {delay:.1f}秒(p95)を超えたため {backup_model} にもヘッジ送信")
+        with self._lock:
+            self.hedge_count += 1
+        backup = self._submit(backup_model, kwargs)
+
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is backup:
+                        with self._lock:
+                            self.hedge_wins += 1
+                        return backup_model, future.result()
+                    return model, future.result()
+                error = future.exception()
+        raise error
+
+    def generate_content(self, **kwargs):
+        requested = kwargs.get("model") or self.model_names[0]
+        self._local.served = None
+        if cached_content_of(kwargs.get("config")):
+            # 別モデルにはキャッシュを渡せない（400 になる）ので、切り替え・ヘッジせず外側のリトライに任せる
+            response = self._call(requested, kwargs)
+            self._local.served = requested
+            return response
+        remaining = self.candidates(requested)
+        hedgeable = self.hedge and not is_json_request(kwargs.get("config"))
+        last_error = None
+        while remaining:
+            model = remaining.pop(0)
+            if model != requested:
+                self.log(f"  - ルーター: {requested} の代わりに {model} を使います")
+            try:
+                if hedgeable:
+                    served, response = self._hedged(model, remaining, kwargs)
+                else:
+                    served, response = model, self._call(model, kwargs)
+                self._local.served = served
+                return response
+            except Exception as e:
+                if not should_fail_over(e):
+                    raise
+                last_error = e
+        raise last_error
+
+    def print_stats(self):
+        """
+        モデルごとの呼び出し数・エラー率・応答時間を表示する
+        """
+        now = time.monotonic()
+        print("モデル別の統計:")
+        for name, stats in self.stats.items():
+            if not stats.calls:
+                continue
+            p50, p95 = stats.percentile(0.5), stats.percentile(0.95)
+            latency = f"p50 {p50:.1f}秒 / p95 {p95:.1f}秒" if p50 is not None else "応答なし"
+            state = " [サーキット開]" if stats.is_open(now) else ""
+            print(f"  - {name}: {stats.calls} 回, エラー {stats.errors} 回 (直近 {stats.error_rate():.0%}), "
+                  f"{latency}{state}")
+        if self.hedge_count:
+            print(f"  - ヘッジ送信 {self.hedge_count} 回（うちヘッジ側が先着 {self.hedge_wins} 回）")
+
+def model_router(client, config):
+    """
+    config.yml の model_name / fallback_models / router セクションから ModelRouter を組み立てる
+    （router.enabled が false なら元のクライアントをそのまま返す）
+    """
+    router_cfg = config.get("router", {})
+    if not router_cfg.get("enabled", False):
+        return client
+    models = [config.get("model_name", "gemini-2.0-flash-exp")] + list(config.get("fallback_models") or [])
+    return ModelRouter(
+        client,
+        models,
+        failure_threshold=router_cfg.get("failure_threshold", 3),
+        cooldown_seconds=router_cfg.get("cooldown_seconds", 120.0),
+        window=router_cfg.get("latency_window", 50),
+        hedge=router_cfg.get("hedge", False),
+        hedge_min_samples=router_cfg.get("hedge_min_samples", 5),
+        hedge_min_seconds=router_cfg.get("hedge_min_seconds", 10.0),
+    )
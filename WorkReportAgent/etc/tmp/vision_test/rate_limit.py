@@ -0,0 +1,113 @@
+import time
+import random
+import threading
+from client_wrapper import ClientWrapper
+from common.tracing import span
+
+class TokenBucket:
+    """
+    トークンバケット方式のレートリミッタ（スレッドセーフ）
+    rate_per_minute でトークンが補充され、最大 burst 個まで貯まる
+    """
+
+    def __init__(self, rate_per_minute, burst=1):
+        if not rate_per_minute or rate_per_minute <= 0:
+            raise ValueError(f"rate_per_minute must be positive: {rate_per_minute}")
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        トークンを1つ取得する。足りなければ補充されるまで待つ。戻り値は待機秒数
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+def error_status(error):
+    """
+    APIエラーのHTTPステータスコード（不明なら None）
+    """
+    for attr in ("code", "status_code"):
+        code = getattr(error, attr, None)
+        if isinstance(code, int):
+            return code
+    return None
+
+def is_retryable(error):
+    """
+    429(レート制限)と5xx(サーバーエラー)はリトライ対象
+    """
+    code = error_status(error)
+    return code is not None and (code == 429 or 500 <= code < 600)
+
+def backoff_delay(attempt, base, maximum):
+    """
+    フルジッター付き指数バックオフの待ち時間
+    """
+    return random.uniform(0, min(maximum, base * (2 ** attempt)))
+
+class RateLimitedClient(ClientWrapper):
+    """
+    generate_content をトークンバケットで間引き、429/5xx はジッター付きバックオフでリトライする
+    limiter が None ならリトライだけ、max_retries=0 なら間引くだけ
+    """
+
+    def __init__(self, client, limiter, max_retries=5, backoff_base=2.0, backoff_max=60.0):
+        super().__init__(client)
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def generate_content(self, **kwargs):
+        attempt = 0
+        while True:
+            if self.limiter is not None:
+                with span("rate_limit.wait") as wait_span:
+                    wait_span.set(waited_s=round(self.limiter.acquire(), 3))
+            try:
+                return self._client.models.generate_content(**kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+                print(f"  - API {error_status(e)}: {delay:.1f}秒後にリトライ ({attempt + 1}/{self.max_retries})")
+                with span("rate_limit.backoff", status=error_status(e), attempt=attempt + 1):
+                    time.sleep(delay)
+                attempt += 1
+
+def rate_limited_client(client, config, route=None):
+    """
+    config.yml の api セクションから RateLimitedClient を組み立てる
+    route: バケットとリトライの間に挟むクライアントを作る関数（モデルルーター）。
+           ルーターの切り替え先やヘッジも1回ずつバケットを通り、バックオフ付きのリトライはルーターの外側で行う
+    """
+    api_cfg = config.get("api", {})
+    # requests_per_minute が 0 や null なら間引かない（リトライだけ）
+    requests_per_minute = api_cfg.get("requests_per_minute", 30)
+    limiter = None
+    if requests_per_minute and requests_per_minute > 0:
+        limiter = TokenBucket(requests_per_minute, api_cfg.get("burst", 4))
+    if route is not None:
+        client = route(RateLimitedClient(client, limiter, max_retries=0))
+        limiter = None
+    return RateLimitedClient(
+        client,
+        limiter,
+        max_retries=api_cfg.get("max_retries", 5),
+        backoff_base=api_cfg.get("backoff_base_seconds", 2.0),
+        backoff_max=api_cfg.get("backoff_max_seconds", 60.0),
+    )
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from client_wrapper import ClientWrapper
+
+class CachedResponse:
+    """
+    キャッシュから復元したレスポンス（generate_content の戻り値と同じく .text を持つ）
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.usage_metadata = None
+
+class ResponseCache:
+    """
+    モデル応答のディスクキャッシュ（1応答1ファイル）
+    古いもの(max_age_days)と、合計サイズ(max_bytes)を超えた分を最終利用が古い順に削除する
+    """
+
+    def __init__(self, cache_dir, max_bytes=200 * 1024 * 1024, max_age_days=30):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            if time.time() - entry["created_at"] > self.max_age_seconds:
+                raise KeyError(key)
+            os.utime(path)  # 最終利用時刻として使う
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def put(self, key, text, meta=None):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"created_at": time.time(), "text": text, "meta": meta or {}}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        """
+        期限切れとサイズ超過分を削除する。戻り値は削除件数
+        """
+        now = time.time()
+        files = []
+        removed = 0
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                if now - stat.st_mtime > self.max_age_seconds:
+                    os.remove(path)
+                    removed += 1
+                else:
+                    files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+def serialize_config(config):
+    """
+    GenerateContentConfig をキー用に安定した形へ変換する
+    """
+    if config is None:
+        return None
+    if hasattr(config, "model_dump"):
+        return config.model_dump(exclude_none=True, mode="json")
+    return {k: v for k, v in vars(config).items() if v is not None}
+
+class CachingClient(ClientWrapper):
+    """
+    generate_content の応答をキャッシュする
+    キーは 動画の内容ハッシュ・モデル名・プロンプト全文・生成設定
+    bypass=True ならキャッシュを読まずに毎回問い合わせる（結果は保存して更新する）
+    """
+
+    def __init__(self, client, cache, bypass=False):
+        super().__init__(client)
+        self.cache = cache
+        self.bypass = bypass
+        self._file_hashes = {}
+
+    def register_file(self, file_obj, file_hash):
+        """
+        アップロード済みファイルと元動画の内容ハッシュを対応付ける（リモート名が変わってもキーが変わらない）
+        """
+        self._file_hashes[file_obj.name] = file_hash
+
+    def _content_key(self, part):
+        if isinstance(part, str):
+            return ["text", part]
+        name = getattr(part, "name", None)
+        if name is not None:
+            return ["file", self._file_hashes.get(name, name)]
+        return ["other", repr(part)]
+
+    def cache_key(self, model, contents, config=None):
+        if not isinstance(contents, (list, tuple)):
+            contents = [contents]
+        payload = json.dumps({
+            "model": model,
+            "contents": [self._content_key(part) for part in contents],
+            "config": serialize_config(config),
+        }, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def generate_content(self, **kwargs):
+        key = self.cache_key(kwargs.get("model"), kwargs.get("contents"), kwargs.get("config"))
+        if not self.bypass:
+            entry = self.cache.get(key)
+            if entry is not None:
+                return CachedResponse(entry["text"])
+
+        response = self._client.models.generate_content(**kwargs)
+        # ルーターが別モデルに切り替えて応答した場合は保存しない（次回も指定モデルに問い合わせる）
+        served_model = getattr(self._client, "served_model", None)
+        served = served_model() if served_model else None
+        if served is not None and kwargs.get("model") and served != kwargs.get("model"):
+            return response
+        if response.text is not None:
+            self.cache.put(key, response.text, {"model": kwargs.get("model")})
+        return response
+
+def response_cache_from_config(config, base_dir):
+    """
+    config.yml の cache セクションから ResponseCache を作る（無効なら None）
+    """
+    cache_cfg = config.get("cache", {})
+    if not cache_cfg.get("enabled", True):
+        return None
+    cache_dir = cache_cfg.get("dir", os.path.join("output", ".cache", "responses"))
+    if not os.path.isabs(cache_dir):
+        cache_dir = os.path.join(base_dir, cache_dir)
+    return ResponseCache(
+        cache_dir,
+        max_bytes=int(cache_cfg.get("max_size_mb", 200) * 1024 * 1024),
+        max_age_days=cache_cfg.get("max_age_days", 30),
+    )
@@ -0,0 +1,194 @@
+"""
+スクショの画像処理（縮小・WebP/AVIF/JPEG でのエンコード・サムネイル・重複の共有）
+extract_frames がデコードしたフレームを受け取り、保存するファイルを軽くする
+* 縮小: 幅を max_width 以下に（縦横比は維持、面積平均で縮小するので文字が潰れにくい）
+* 重複: pHash（32x32 の DCT の低周波 8x8 の符号）のハミング距離が近く、縮小画像の画素差も小さいスクショは
+  先に保存した1枚を共有する（pHash だけだと、同じレイアウトで値だけ違う表などもまとめてしまうため）
+* 削減量: 従来の保存方法（原寸・既定品質の JPEG）と比べたバイト数を、最初の1枚だけ JPEG でも符号化して推定する
+"""
+import os
+import threading
+import cv2
+import numpy as np
+
+DEFAULT_SCREENSHOTS = {
+    "enabled": False,
+    "format": "webp",          # webp / avif / jpeg（avif に未対応の OpenCV では webp にする）
+    "quality": 80,             # 0-100
+    "max_width": 1600,         # これより幅の広いスクショは縮小する（0 なら縮小しない）
+    "thumbnail_width": 480,    # レポートにはこの幅のサムネイルを載せ、クリックで元画像を開く（0 ならサムネイルなし）
+    "dedup": True,
+    "dedup_max_distance": 3,   # pHash のハミング距離（63ビット中）がこれ以下で、
+    "dedup_max_pixel_diff": 0.3,  # 幅128に縮小したグレースケールの平均画素差（0-255）もこれ以下なら同じ画面とみなす
+    "workers": 4,              # エンコードの同時実行数
+}
+
+EXTENSIONS = {"webp": ".webp", "avif": ".avif", "jpeg": ".jpg"}
+# サムネイルはスクショと同じディレクトリの thumbs/ に同じファイル名で保存する
+THUMBNAIL_DIR = "thumbs"
+
+_avif_warning = threading.Event()
+
+def screenshot_settings(config):
+    settings = dict(DEFAULT_SCREENSHOTS)
+    settings.update(config.get("screenshots") or {})
+    return settings
+
+def can_write_avif():
+    """
+    この OpenCV が AVIF を書き出せるか（IMWRITE_AVIF_QUALITY は libavif なしのビルドにもあるので、書き出し側に聞く）
+    """
+    have_image_writer = getattr(cv2, "haveImageWriter", None)
+    return bool(have_image_writer and have_image_writer(".avif"))
+
+def output_format(settings):
+    """
+    実際に使う形式（avif に未対応の OpenCV では webp）
+    """
+    image_format = settings["format"]
+    if image_format == "avif" and not can_write_avif():
+        if not _avif_warning.is_set():
+            _avif_warning.set()
+            print("この OpenCV は AVIF に未対応のため WebP で保存します")
+        return "webp"
+    return image_format
+
+def encode_params(image_format, quality):
+    if image_format == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    if image_format == "avif":
+        return [cv2.IMWRITE_AVIF_QUALITY, int(quality)]
+    return [cv2.IMWRITE_JPEG_QUALITY, int(quality), cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+
+def resize_to_width(frame, max_width):
+    height, width = frame.shape[:2]
+    if not max_width or width <= max_width:
+        return frame
+    return cv2.resize(frame, (int(max_width), max(1, round(height * max_width / width))), interpolation=cv2.INTER_AREA)
+
+# 画素差を比べる縮小画像の幅
+COMPARE_WIDTH = 128
+
+def phash(gray):
+    """
+    63ビットの pHash（int。DCT の低周波 8x8 から直流成分を除いた63係数の符号）
+    """
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    # 直流成分（画面全体の明るさ）は比較に使わない
+    bits = low[1:] > np.median(low[1:])
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+def frame_signature(frame):
+    """
+    重複判定用の (pHash, 幅 COMPARE_WIDTH のグレースケール画像)
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    height, width = gray.shape
+    small = cv2.resize(gray, (COMPARE_WIDTH, max(1, round(height * COMPARE_WIDTH / width))),
+                       interpolation=cv2.INTER_AREA)
+    return phash(gray), small.astype(np.int16)
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+def screenshot_file_path(output_path, settings):
+    """
+    設定の形式に合わせて拡張子を付け替えたスクショのパス
+    """
+    return os.path.splitext(output_path)[0] + EXTENSIONS[output_format(settings)]
+
+def thumbnail_path(image_path):
+    directory, name = os.path.split(image_path)
+    return os.path.join(directory, THUMBNAIL_DIR, name)
+
+def report_image(rel_dir, image_path):
+    """
+    レポートに載せる画像の相対パス。サムネイルがあれば (サムネイルのパス, 元画像のパス)
+    """
+    name = os.path.basename(image_path)
+    if os.path.exists(thumbnail_path(image_path)):
+        return (f"./{rel_dir}/{THUMBNAIL_DIR}/{name}", f"./{rel_dir}/{name}")
+    return f"./{rel_dir}/{name}"
+
+def legacy_jpeg_bytes(frame):
+    """
+    従来の保存方法（原寸・既定品質の JPEG）でのバイト数
+    """
+    ok, data = cv2.imencode(".jpg", frame)
+    return len(data) if ok else 0
+
+def write_encoded(path, image, image_format, quality):
+    ok, data = cv2.imencode(EXTENSIONS[image_format], image, encode_params(image_format, quality))
+    if not ok:
+        raise RuntimeError(f"エンコード失敗: {path}")
+    with open(path, "wb") as f:
+        f.write(data.tobytes())
+    return len(data)
+
+def encode_screenshot(frame, output_path, settings, measure_legacy=False):
+    """
+    1枚を縮小・エンコードして保存する（サムネイルも作る）。ワーカースレッドで呼ぶ
+    戻り値: (保存したパス, 保存したバイト数, 従来の保存方法でのバイト数。measure_legacy でなければ None)
+    """
+    image_format = output_format(settings)
+    path = screenshot_file_path(output_path, settings)
+    written = write_encoded(path, resize_to_width(frame, settings["max_width"]), image_format, settings["quality"])
+    if settings["thumbnail_width"]:
+        thumb = thumbnail_path(path)
+        os.makedirs(os.path.dirname(thumb), exist_ok=True)
+        written += write_encoded(thumb, resize_to_width(frame, settings["thumbnail_width"]),
+                                 image_format, settings["quality"])
+    return path, written, legacy_jpeg_bytes(frame) if measure_legacy else None
+
+class ScreenshotStats:
+    """
+    1回の抽出で保存したスクショの枚数と、従来の保存方法と比べたバイト数
+    従来の保存方法でのバイト数は、1枚の実測（同じ動画のフレームは同じ解像度）× 枚数で推定する
+    """
+
+    def __init__(self):
+        self.saved = 0
+        self.duplicates = 0
+        self.bytes_written = 0
+        self.legacy_sample = None
+
+    def add(self, written, legacy=None):
+        self.saved += 1
+        self.bytes_written += written
+        if legacy is not None and self.legacy_sample is None:
+            self.legacy_sample = legacy
+
+    def add_duplicate(self):
+        self.duplicates += 1
+
+    def summary(self):
+        text = f"スクショ画像: {self.saved} 枚を保存（重複 {self.duplicates} 枚は共有）, {self.bytes_written / 1024 / 1024:.1f}MB"
+        if not self.legacy_sample:
+            return text
+        legacy_bytes = self.legacy_sample * (self.saved + self.duplicates)
+        saved_bytes = legacy_bytes - self.bytes_written
+        return (f"{text}（従来の JPEG なら約 {legacy_bytes / 1024 / 1024:.1f}MB, "
+                f"約 {saved_bytes / 1024 / 1024:.1f}MB 削減, {saved_bytes / legacy_bytes:.0%}）")
+
+class DuplicateFinder:
+    """
+    保存するスクショとほぼ同じ画面を探す（1回の抽出の中だけで比較する）
+    保存はワーカーで進むので、パスではなく保存処理の future を覚えておく
+    """
+
+    def __init__(self, max_distance, max_pixel_diff):
+        self.max_distance = max_distance
+        self.max_pixel_diff = max_pixel_diff
+        self.kept = []  # [(frame_signature の戻り値, encode_screenshot の future)]
+
+    def find(self, signature):
+        frame_hash, small = signature
+        for (kept_hash, kept_small), future in self.kept:
+            if (hamming(frame_hash, kept_hash) <= self.max_distance and kept_small.shape == small.shape
+                    and np.abs(small - kept_small).mean() <= self.max_pixel_diff):
+                return future
+        return None
+
+    def keep(self, signature, future):
+        self.kept.append((signature, future))
@@ -0,0 +1,124 @@
+"""
+複数セクションの作業ログをまとめて1回（または数回）の呼び出しで書かせるモード
+応答は JSON スキーマで受け取り、欠けていたり壊れていたりするセクションだけを個別に書き直す
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+from google.genai import types
+
+MIN_BODY_CHARS = 20
+
+SECTION_BATCH_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "sections": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "id": {"type": "INTEGER"},
+                    "body": {"type": "STRING"},
+                },
+                "required": ["id", "body"],
+            },
+        },
+    },
+    "required": ["sections"],
+}
+
+def batch_prompt(sections):
+    """
+    複数セクション分の執筆指示（要件は generate_section_body と同じ）
+    """
+    listing = "\n".join(
+        f"    - id {section['id']}: {section['start_time']} - {section['end_time']}「{section['title']}」"
+        f"（画像の説明: {section.get('screenshot_reason', '')}）"
+        for section in sections
+    )
+    return f"""
+    動画の以下の各範囲について、それぞれの見出しで詳細な作業ログを書いてください。
+
+{listing}
+
+    ## 要件（セクションごと）
+    1. そのセクションで行われた具体的な操作、使用ツール、入力値を箇条書きで列挙すること。
+    2. 作業のボトルネックや、逆に効率的な点があれば指摘すること。
+    3. 画像の説明にある画像をレポート内の適切な位置（操作説明の直後など）に挿入済みとして扱ってください。
+
+    ## 出力形式
+    {{"sections": [{{"id": セクションのid, "body": "Markdown形式の作業ログ（見出しは ### から）"}}, ...]}}
+    上記のすべての id について1件ずつ出力してください。
+    """
+
+def parse_batch_response(text, expected_ids):
+    """
+    応答から {セクションID: 本文} を取り出す。想定外のID・空や短すぎる本文は捨てる
+    """
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return {}
+    items = data.get("sections") if isinstance(data, dict) else data
+    # 構造解析のIDが文字列でも数値でも照合できるようにする
+    expected = {str(section_id): section_id for section_id in expected_ids}
+    bodies = {}
+    for item in items if isinstance(items, list) else []:
+        if not isinstance(item, dict):
+            continue
+        section_id, body = expected.get(str(item.get("id"))), item.get("body")
+        if section_id is not None and isinstance(body, str) and len(body.strip()) >= MIN_BODY_CHARS:
+            bodies.setdefault(section_id, body.strip())
+    return bodies
+
+def generate_batch_bodies(client, video_file, model_name, sections):
+    """
+    1回の呼び出しで sections 全部の本文を書かせる。戻り値: {セクションID: 本文}（検証に通ったものだけ）
+    """
+    response = client.models.generate_content(
+        model=model_name,
+        contents=[video_file, batch_prompt(sections)],
+        config=types.GenerateContentConfig(
+            response_mime_type="application/json",
+            response_schema=SECTION_BATCH_SCHEMA,
+        ),
+    )
+    return parse_batch_response(response.text, {section["id"] for section in sections})
+
+def generate_bodies_batched(client, video_file, model_name, sections, sections_per_call, concurrency,
+                            write_one):
+    """
+    sections_per_call 件ずつ（0 なら全部を1回で）まとめて書かせ、欠けたセクションは write_one(section) で個別に書き直す
+    戻り値: {セクションID: 本文}（個別の書き直しにも失敗したセクションは含まない）
+    """
+    size = sections_per_call if sections_per_call and sections_per_call > 0 else max(1, len(sections))
+    batches = [sections[i:i + size] for i in range(0, len(sections), size)]
+    print(f"セクションをまとめて執筆中: {len(sections)} セクション / {len(batches)} 回の呼び出し")
+
+    def run_batch(batch):
+        try:
+            return generate_batch_bodies(client, video_file, model_name, batch)
+        except Exception as e:
+            print(f"  - まとめて執筆に失敗 ({len(batch)} セクション): {e}")
+            return {}
+
+    bodies = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(batches)))) as executor:
+        for result in executor.map(run_batch, batches):
+            bodies.update(result)
+
+    missing = [section for section in sections if section["id"] not in bodies]
+    if missing:
+        print(f"  - 応答に欠けていたセクションを個別に執筆: {len(missing)} 件")
+
+        def retry(section):
+            try:
+                return section["id"], write_one(section)
+            except Exception as e:
+                print(f"  - セクション生成エラー ({section.get('title', 'Untitled')}): {e}")
+                return section["id"], None
+
+        with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            for section_id, body in executor.map(retry, missing):
+                if body:
+                    bodies[section_id] = body
+    return bodies
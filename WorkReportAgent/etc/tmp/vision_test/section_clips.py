@@ -0,0 +1,83 @@
+import os
+import bisect
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from common.media_index import get_media_info, video_summary
+from common.timemap import parse_timestamp
+
+# 直前のキーフレームがこの秒数以内ならストリームコピーで切り出す（少し前から始まるだけなので許容）
+KEYFRAME_TOLERANCE_SECONDS = 2.0
+
+def cut_clip(video_path, start, end, output_path, keyframes):
+    """
+    動画の start〜end 秒をクリップとして切り出す
+    キーフレームが開始位置の近くにあればストリームコピー、なければ高速な再エンコード
+    """
+    index = bisect.bisect_right(keyframes, start) - 1
+    keyframe = keyframes[index] if index >= 0 else None
+
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-nostats"]
+    if keyframe is not None and start - keyframe <= KEYFRAME_TOLERANCE_SECONDS:
+        cmd += ["-ss", f"{keyframe:.3f}", "-i", video_path, "-t", f"{end - keyframe:.3f}",
+                "-c", "copy", "-avoid_negative_ts", "make_zero"]
+        mode = "copy"
+    else:
+        cmd += ["-ss", f"{start:.3f}", "-i", video_path, "-t", f"{end - start:.3f}",
+                "-c:v", "libx264", "-preset", "veryfast", "-crf", "28"]
+        mode = "re-encode"
+
+    # 一時ファイルに書いてから置き換える（途中で止まったクリップを使わないため）
+    part_path = f"{output_path}.part.mp4"
+    try:
+        subprocess.run(cmd + ["-an", part_path], check=True)
+        os.replace(part_path, output_path)
+    finally:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+    return mode
+
+def clip_path(clip_dir, section):
+    safe_range = f"{section['start_time']}-{section['end_time']}".replace(':', '')
+    return os.path.join(clip_dir, f"sec_{section['id']}_{safe_range}.mp4")
+
+def extract_section_clips(video_path, sections, clip_dir, max_workers=4):
+    """
+    各セクションの範囲をクリップとして並列に切り出す。既に切り出し済みのクリップは再利用する
+    戻り値: {セクションID: クリップのパス}（失敗したセクションは含まない）
+    """
+    os.makedirs(clip_dir, exist_ok=True)
+    try:
+        info = video_summary(get_media_info(video_path, keyframes=True)) or {}
+    except Exception as e:
+        # クリップは最適化なので、動画を調べられなければ全セクションを動画全体で執筆する
+        print(f"  - クリップ作成を省略（動画情報を取得できません）: {e}")
+        return {}
+    keyframes = info.get("keyframes") or []
+    duration = info.get("duration") or 0
+
+    def cut(section):
+        try:
+            start = parse_timestamp(section["start_time"])
+            end = parse_timestamp(section["end_time"])
+        except (KeyError, ValueError):
+            return None
+        if duration:
+            end = min(end, duration)
+        if end <= start:
+            return None
+
+        output_path = clip_path(clip_dir, section)
+        if os.path.exists(output_path):
+            return output_path
+        try:
+            mode = cut_clip(video_path, start, end, output_path, keyframes)
+            print(f"  - クリップ作成 ({mode}): {section['start_time']} - {section['end_time']}")
+            return output_path
+        except (subprocess.CalledProcessError, OSError) as e:
+            print(f"  - クリップ作成失敗: {section.get('title', 'Untitled')} ({e})")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        paths = list(executor.map(cut, sections))
+    return {section["id"]: path for section, path in zip(sections, paths) if path}
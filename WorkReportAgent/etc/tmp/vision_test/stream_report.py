@@ -0,0 +1,271 @@
+"""
+ScreenRecorder が書き出す分割動画を監視し、届いたものから順に
+変換 → アップロード → 解析 → レポート・作業ログ(TSV)への追記 を行うストリーミングモード
+
+    python3 stream_report.py <ScreenRecorderの出力ディレクトリ> [--once]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, ".."))
+sys.path.insert(0, os.path.join(BASE_DIR, "..", "video_converter"))
+
+import gemini_video_summary as summary
+import convert_timelapse
+from common.fileutil import atomic_write_json
+from common.timemap import load_timemap
+from screenshot_images import report_image, screenshot_settings
+from upload_registry import registry_from_config, upload_video
+from work_log import annotate_clock, append_rows, recording_start_time, section_to_row, sort_by_duration
+from worklog_store import default_worker, guess_day, store_from_config
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".mkv", ".webm")
+STATE_NAME = "stream_state.json"
+
+def find_ready_chunks(watch_dir, done, sizes, settle_seconds, force=False):
+    """
+    書き込みが終わった未処理の分割動画を古い順に返す
+    サイズが前回の確認から変わっておらず、最終更新から settle_seconds 経ったものを完成とみなす
+    """
+    ready = []
+    now = time.time()
+    for name in os.listdir(watch_dir):
+        path = os.path.join(watch_dir, name)
+        if name in done or not name.lower().endswith(VIDEO_EXTENSIONS) or not os.path.isfile(path):
+            continue
+        stat = os.stat(path)
+        stable = sizes.get(name) == stat.st_size and now - stat.st_mtime >= settle_seconds
+        sizes[name] = stat.st_size
+        if force or stable:
+            ready.append((stat.st_mtime, path))
+    return [path for _, path in sorted(ready)]
+
+def is_continuation(pending, section):
+    """
+    新しい分割動画の最初のセクションが、前の動画の最後のセクションの続きか
+    """
+    if section.get("continues_previous"):
+        return True
+    return section.get("title") == pending.get("title") and section.get("app") == pending.get("app")
+
+class StreamSession:
+    """
+    1日分のストリーミング処理の状態
+    各分割動画の最後のセクションは次の動画の先頭と結合する可能性があるため、次の動画が来るまで保留する
+    """
+
+    def __init__(self, client, response_cache, config, output_dir):
+        self.client = client
+        self.response_cache = response_cache
+        self.config = config
+        self.model_name = summary.active_model_name(config)
+        self.output_dir = output_dir
+        self.converted_dir = os.path.join(output_dir, "converted")
+        self.screenshot_dir_name = config.get("report", {}).get("screenshot_dir", "images")
+        self.include_screenshots = config.get("report", {}).get("include_screenshots", False)
+        self.report_path = os.path.join(output_dir, "Report.md")
+        self.log_path = os.path.join(output_dir, "worklog.tsv")
+        self.state_path = os.path.join(output_dir, STATE_NAME)
+        self.upload_registry = registry_from_config(config, BASE_DIR)
+        self.converter_config = convert_timelapse.load_config()
+        os.makedirs(self.converted_dir, exist_ok=True)
+
+        self.state = {"done": [], "failed": [], "pending": None}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                self.state.update(json.load(f))
+
+        if not os.path.exists(self.report_path):
+            with open(self.report_path, "w", encoding="utf-8") as f:
+                f.write(f"# 作業レポート {os.path.basename(output_dir)}\n\n")
+                f.write("## 概要\nAIによる自動生成レポートです。録画の分割ファイルごとに追記されます。\n\n")
+
+    @property
+    def done(self):
+        return set(self.state["done"]) | set(self.state["failed"])
+
+    def save_state(self):
+        atomic_write_json(self.state_path, self.state)
+
+    def convert(self, chunk_path):
+        """
+        分割動画をタイムラプス変換する（変換に失敗したら元の動画をそのまま使う）
+        """
+        if not self.config.get("stream", {}).get("convert", True):
+            return chunk_path
+        converted_path = os.path.join(self.converted_dir, os.path.basename(chunk_path))
+        if os.path.exists(converted_path):
+            return converted_path
+        if convert_timelapse.convert_video(chunk_path, converted_path, self.converter_config, quiet=True):
+            return converted_path
+        print(f"変換失敗、元の動画で解析します: {chunk_path}")
+        return chunk_path
+
+    def extract_screenshots(self, video_path, sections, chunk_name):
+        """
+        スクショを一括抽出する。戻り値: {timestamp: レポートからの相対パス}
+        """
+        if not self.include_screenshots:
+            return {}
+        img_dir = os.path.join(self.output_dir, self.screenshot_dir_name, chunk_name)
+        os.makedirs(img_dir, exist_ok=True)
+        requests = {}
+        for section in sections:
+            if section.get("screenshot_timestamp"):
+                requests.setdefault(section["screenshot_timestamp"], summary.screenshot_path(img_dir, section))
+        saved = summary.extract_frames(video_path, list(requests.items()),
+                                       image_settings=screenshot_settings(self.config))
+        return {
+            timestamp: report_image(f"{self.screenshot_dir_name}/{chunk_name}", path)
+            for timestamp, path in saved.items()
+        }
+
+    def write_section(self, section):
+        """
+        完成したセクションをレポートと作業ログに追記する
+        """
+        with open(self.report_path, "a", encoding="utf-8") as f:
+            f.write(summary.format_section(section, section["parts"]))
+            f.write("\n---\n")
+        append_rows(self.log_path, [section_to_row(section)])
+        print(f"  - 追記: {section['title']} ({section.get('clock_start')} - {section.get('clock_end')})")
+
+    def process_chunk(self, chunk_path):
+        chunk_name = os.path.splitext(os.path.basename(chunk_path))[0]
+        print(f"\n=== 分割動画を処理: {os.path.basename(chunk_path)} ===")
+        video_file = None
+        try:
+            video_path = self.convert(chunk_path)
+            video_file, video_hash = upload_video(self.client, video_path, self.upload_registry,
+                                                  self.config.get("upload", {}))
+            if self.response_cache:
+                self.client.register_file(video_file, video_hash)
+            attach_context = getattr(self.client, "attach_context", None)
+            if attach_context:
+                attach_context(video_file, self.model_name)
+
+            pending = self.state["pending"]
+            extra = ""
+            if pending:
+                extra = f"""
+    * 直前の録画の最後の作業は「{pending['title']}」（アプリ: {pending.get('app', '不明')}）でした。
+      この動画の最初のセクションがその作業の続きであれば、そのセクションに "continues_previous": true を付けてください。
+    """
+            structure = summary.plan_structure(self.client, video_file, video_path, self.model_name, self.config, extra)
+            sections = structure.get("sections", [])
+            timemap = load_timemap(video_path) if video_path != chunk_path else None
+            annotate_clock(sections, recording_start_time(chunk_path), timemap)
+            screenshots = self.extract_screenshots(video_path, sections, chunk_name)
+
+            concurrency = self.config.get("api", {}).get("section_concurrency", 4)
+            with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+                bodies = list(executor.map(
+                    lambda section: summary.generate_section_body(self.client, video_file, self.model_name, section),
+                    sections))
+        except Exception as e:
+            print(f"分割動画の処理に失敗しました: {chunk_path} ({e})")
+            self.state["failed"].append(os.path.basename(chunk_path))
+            self.save_state()
+            return
+        finally:
+            # 分割動画ごとに作り直すので、処理が終わったらすぐ消す（残りのTTL分の保存料金を払わない）
+            release_context_caches = getattr(self.client, "release_context_caches", None)
+            if release_context_caches and video_file is not None:
+                release_context_caches(video_file)
+
+        for index, (section, body) in enumerate(zip(sections, bodies)):
+            # 見出しは録画の実時刻で表示する
+            section["start_time"] = section.get("source_start", section["start_time"])
+            section["end_time"] = section.get("source_end", section["end_time"])
+            section.pop("source_start", None)
+            section.pop("source_end", None)
+            section["parts"] = [(screenshots.get(section.get("screenshot_timestamp")), body)]
+            section.setdefault("screenshot_reason", "")
+
+            pending = self.state["pending"]
+            if index == 0 and pending and is_continuation(pending, section):
+                # 分割の境界をまたいだ作業は1つのセクションにまとめる
+                pending["end_time"] = section["end_time"]
+                pending["clock_end"] = section.get("clock_end", pending.get("clock_end"))
+                pending["steps"] = (pending.get("steps") or []) + (section.get("steps") or [])
+                pending["parts"] = pending["parts"] + section["parts"]
+                print(f"  - 前の録画のセクションと結合: {pending['title']}")
+                continue
+            if pending:
+                self.write_section(pending)
+            self.state["pending"] = section
+
+        self.state["done"].append(os.path.basename(chunk_path))
+        self.save_state()
+
+    def finalize(self):
+        """
+        保留中のセクションを書き出し、作業ログを時間のかかる作業順に並べ替える
+        """
+        if self.state["pending"]:
+            self.write_section(self.state["pending"])
+            self.state["pending"] = None
+        if os.path.exists(self.log_path):
+            sort_by_duration(self.log_path)
+            with store_from_config(self.config, BASE_DIR) as store:
+                count = store.ingest_tsv(self.log_path, default_worker(self.config), guess_day(self.output_dir))
+            print(f"作業ログをストアに登録: {count} 行")
+        self.save_state()
+        # 残っているキャッシュを消し、キャッシュあり/なしの計測結果を1回だけ表示する
+        release_context_caches = getattr(self.client, "release_context_caches", None)
+        if release_context_caches:
+            release_context_caches()
+        print(f"\n日次レポート完成: {self.report_path}\n作業ログ: {self.log_path}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="分割録画を監視して逐次レポートを作成する")
+    parser.add_argument("watch_dir", help="ScreenRecorder の出力ディレクトリ")
+    parser.add_argument("--output-dir", help="出力先（省略時は output/stream/<日付>）")
+    parser.add_argument("--once", action="store_true", help="既存の分割動画をすべて処理して終了する")
+    parser.add_argument("--no-cache", action="store_true", help="モデル応答キャッシュを読まずに再問い合わせする")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    config = summary.load_config()
+    stream_cfg = config.get("stream", {})
+
+    api_key = os.environ.get("GOOGLE_API_KEY")
+    if not api_key and not summary.uses_local_vlm(config):
+        print("エラー: 環境変数 GOOGLE_API_KEY が設定されていません。")
+        sys.exit(1)
+    client, response_cache = summary.create_client(config, api_key, no_cache=args.no_cache)
+
+    output_dir = args.output_dir or os.path.join(BASE_DIR, "output", "stream", datetime.now().strftime("%Y-%m-%d"))
+    os.makedirs(output_dir, exist_ok=True)
+    session = StreamSession(client, response_cache, config, output_dir)
+
+    poll_seconds = stream_cfg.get("poll_seconds", 30)
+    settle_seconds = stream_cfg.get("settle_seconds", 15)
+    idle_finalize = stream_cfg.get("finalize_after_idle_minutes", 60) * 60
+    sizes = {}
+    last_activity = time.monotonic()
+    print(f"監視開始: {args.watch_dir} → {output_dir}")
+
+    try:
+        while True:
+            ready = find_ready_chunks(args.watch_dir, session.done, sizes, settle_seconds, force=args.once)
+            for chunk_path in ready:
+                session.process_chunk(chunk_path)
+            if ready:
+                last_activity = time.monotonic()
+            if args.once or time.monotonic() - last_activity >= idle_finalize:
+                break
+            time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        print("\n中断されました。保留中のセクションを書き出します。")
+    session.finalize()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+オフラインのエンドツーエンド・ベンチマーク（APIキー・実録画不要）
+合成した画面録画を convert_video で変換し、gemini_video_summary.main をフェイクの genai.Client
+（アップロード速度・処理待ち・応答時間の分布・429 を設定できる）に対して実行する。
+シナリオごとに別プロセスで実行してピークメモリを分け、所要時間・スループットを baseline と比較する
+
+    python3 benchmark_pipeline.py                      # 全シナリオを実行して baseline と比較
+    python3 benchmark_pipeline.py --scenario rate_limited
+    python3 benchmark_pipeline.py --update-baseline    # 結果を baseline として保存
+"""
+import os
+import re
+import sys
+import json
+import time
+import copy
+import argparse
+import resource
+import subprocess
+from datetime import datetime
+
+TEST_DIR = os.path.dirname(os.path.abspath(__file__))
+VISION_DIR = os.path.join(TEST_DIR, "..")
+CONVERTER_DIR = os.path.join(VISION_DIR, "..", "video_converter")
+sys.path.insert(0, VISION_DIR)
+sys.path.insert(0, os.path.join(VISION_DIR, ".."))
+sys.path.insert(0, CONVERTER_DIR)
+sys.path.insert(0, os.path.join(CONVERTER_DIR, "test"))
+
+import yaml
+from common.media_index import get_media_info, video_summary
+from common.timemap import format_timestamp
+from experiment_compression import SYNTHETIC_SOURCES
+
+OUTPUT_DIR = os.path.join(TEST_DIR, "output_benchmark")
+BASELINE_PATH = os.path.join(TEST_DIR, "benchmark_baseline.json")
+
+# 比較する指標と、良い方向（lower: 小さいほど良い）
+COMPARED_METRICS = {
+    "wall_seconds": "lower",
+    "input_seconds_per_wall_second": "higher",
+    "peak_rss_mb": "lower",
+}
+
+def load_benchmark_config():
+    with open(os.path.join(TEST_DIR, "benchmark_config.yml"), "r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+def deep_merge(base, override):
+    """
+    override の値で base を上書きしたコピー（dict は再帰的にマージ）
+    """
+    merged = copy.deepcopy(base)
+    for key, value in (override or {}).items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = deep_merge(merged[key], value)
+        else:
+            merged[key] = copy.deepcopy(value)
+    return merged
+
+def generate_recording(spec, synthetic_cfg, video_dir):
+    """
+    合成した画面録画（録画ツールの出力に近い通常の H.264）。同じ名前・長さがあれば再利用する
+    """
+    path = os.path.join(video_dir, f"{spec['name']}_{spec['duration']}s.mp4")
+    if os.path.exists(path):
+        return path
+    fps = synthetic_cfg.get("fps", 2)
+    graph = SYNTHETIC_SOURCES[spec["kind"]].format(size=synthetic_cfg.get("size", "1280x720"), fps=fps)
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", graph,
+        "-t", str(spec["duration"]),
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p",
+        "-metadata", "creation_time=2025-01-06T09:00:00Z",
+        path,
+    ]
+    subprocess.run(cmd, check=True)
+    return path
+
+def make_responder(response_cfg):
+    """
+    プロンプトに合わせた応答（構成案は動画の長さを等分したセクション、まとめ執筆は依頼された id の本文）
+    """
+    section_count = response_cfg.get("sections_per_video", 6)
+    body = ("- 操作の記録です。入力値と使用ツールを確認しました。\n" * 40)[:response_cfg.get("body_chars", 600)]
+
+    def video_duration(contents):
+        for part in contents:
+            path = getattr(part, "source_path", None)
+            if path:
+                info = video_summary(get_media_info(path)) or {}
+                return info.get("duration") or 60.0
+        return 60.0
+
+    def respond(model, contents, config):
+        prompt = next((part for part in reversed(contents) if isinstance(part, str)), "")
+        if "構成案" in prompt:
+            duration = video_duration(contents)
+            edges = [duration * i / section_count for i in range(section_count + 1)]
+            return json.dumps({
+                "title": "ベンチマーク用レポート",
+                "sections": [{
+                    "id": index,
+                    "title": f"作業 {index}",
+                    "start_time": format_timestamp(start),
+                    "end_time": format_timestamp(end),
+                    "screenshot_timestamp": format_timestamp((start + end) / 2),
+                    "screenshot_reason": "画面の中央",
+                    "app": ["Excel", "Rhino", "Chrome"][index % 3],
+                    "tags": ["Benchmark"],
+                    "steps": ["操作A", "操作B"],
+                } for index, (start, end) in enumerate(zip(edges[:-1], edges[1:]), start=1)],
+            }, ensure_ascii=False)
+        ids = re.findall(r"- id (\d+):", prompt)
+        if ids:
+            return json.dumps({"sections": [{"id": int(section_id), "body": body} for section_id in ids]},
+                              ensure_ascii=False)
+        return body
+
+    return respond
+
+def peak_rss_mb(who):
+    # Linux は KB、macOS はバイト
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+def run_scenario(bench_cfg, scenario, videos, work_dir):
+    """
+    1シナリオを実行する（子プロセスで呼ぶ）。戻り値: 指標の dict
+    """
+    import convert_timelapse
+    import gemini_video_summary as summary
+    from fake_genai import fake_client_from_config
+
+    converter_config = deep_merge(convert_timelapse.load_config(), bench_cfg.get("converter_config"))
+    converter_config = deep_merge(converter_config, scenario.get("converter_config"))
+    report_config = deep_merge(summary.load_config(), bench_cfg.get("report_config"))
+    report_config = deep_merge(report_config, scenario.get("config"))
+    # キャッシュ・作業ログはシナリオの作業ディレクトリに閉じる
+    report_config = deep_merge(report_config, {
+        "cache": {"dir": os.path.join(work_dir, "cache", "responses")},
+        "upload": {"registry": os.path.join(work_dir, "cache", "uploads.json")},
+        "worklog": {"db": os.path.join(work_dir, "worklog.db")},
+    })
+    fake_cfg = deep_merge(bench_cfg.get("fake_api"), scenario.get("fake_api"))
+    client = fake_client_from_config(fake_cfg, responder=make_responder(bench_cfg.get("responses", {})))
+
+    input_seconds = sum((video_summary(get_media_info(path)) or {}).get("duration") or 0.0 for path in videos)
+    converted_dir = os.path.join(work_dir, "converted")
+    os.makedirs(converted_dir, exist_ok=True)
+
+    start = time.monotonic()
+    tasks = [(path, os.path.join(converted_dir, os.path.basename(path))) for path in videos]
+    convert_timelapse.run_batch(tasks, converter_config)
+    convert_seconds = time.monotonic() - start
+    converted = [output for _, output in tasks if os.path.exists(output)]
+
+    def report_all(run_dir):
+        for path in converted:
+            output_dir = os.path.join(run_dir, os.path.splitext(os.path.basename(path))[0])
+            try:
+                summary.main([path, "--output-dir", output_dir], base_client=client, config=report_config)
+            except SystemExit:
+                pass
+        # Report.md は途中で失敗しても残るので、最後に書かれる worklog.tsv で完了を数える
+        return sum(os.path.exists(os.path.join(run_dir, os.path.splitext(os.path.basename(path))[0], "worklog.tsv"))
+                   for path in converted)
+
+    if scenario.get("warmup"):
+        report_all(os.path.join(work_dir, "warmup"))
+    calls_before = client.models.call_count
+    report_start = time.monotonic()
+    reports = report_all(os.path.join(work_dir, "reports"))
+    report_seconds = time.monotonic() - report_start
+    wall_seconds = convert_seconds + report_seconds
+
+    return {
+        "videos": len(videos),
+        "reports": reports,
+        "input_seconds": round(input_seconds, 1),
+        "convert_seconds": round(convert_seconds, 2),
+        "report_seconds": round(report_seconds, 2),
+        "wall_seconds": round(wall_seconds, 2),
+        "input_seconds_per_wall_second": round(input_seconds / wall_seconds, 2) if wall_seconds else 0.0,
+        "videos_per_hour": round(len(videos) / wall_seconds * 3600, 1) if wall_seconds else 0.0,
+        "model_calls": client.models.call_count - calls_before,
+        "rate_limited": client.models.rate_limited_count,
+        "uploads": client.files.upload_count,
+        "peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_SELF), 1),
+        "peak_child_rss_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+    }
+
+def spawn_scenario(name, videos, work_dir):
+    """
+    シナリオを別プロセスで実行する（ピークメモリがシナリオごとになるように）。出力は work_dir/log.txt に残す
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    result_path = os.path.join(work_dir, "result.json")
+    cmd = [sys.executable, os.path.abspath(__file__), "--run-scenario", name,
+           "--work-dir", work_dir, "--result", result_path, "--videos"] + videos
+    with open(os.path.join(work_dir, "log.txt"), "w", encoding="utf-8") as log:
+        process = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT)
+    if process.returncode != 0 or not os.path.exists(result_path):
+        print(f"  {name}: 失敗（{os.path.join(work_dir, 'log.txt')} を確認してください）")
+        return None
+    with open(result_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def compare(results, baseline, tolerance):
+    """
+    baseline との比較を表示する。戻り値: 回帰した (シナリオ, 指標) のリスト
+    """
+    regressions = []
+    print(f"\n{'scenario':<18} {'metric':<31} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            print(f"{name:<18} (baseline なし)")
+            continue
+        for metric, better in COMPARED_METRICS.items():
+            if not base.get(metric) or metric not in result:
+                continue
+            change = (result[metric] - base[metric]) / base[metric]
+            worse = change > tolerance if better == "lower" else change < -tolerance
+            mark = "  回帰" if worse else ""
+            print(f"{name:<18} {metric:<31} {base[metric]:>10} {result[metric]:>10} {change:>+7.0%}{mark}")
+            if worse:
+                regressions.append((name, metric))
+    return regressions
+
+def print_results(results):
+    print(f"\n{'scenario':<18} {'reports':>8} {'wall s':>8} {'convert s':>10} {'report s':>9} "
+          f"{'in-s/s':>7} {'videos/h':>9} {'calls':>6} {'429':>5} {'RSS MB':>7} {'ffmpeg MB':>10}")
+    for name, r in results.items():
+        print(f"{name:<18} {r['reports']:>4}/{r['videos']:<3} {r['wall_seconds']:>8.1f} {r['convert_seconds']:>10.1f} "
+              f"{r['report_seconds']:>9.1f} {r['input_seconds_per_wall_second']:>7.1f} {r['videos_per_hour']:>9.1f} "
+              f"{r['model_calls']:>6} {r['rate_limited']:>5} {r['peak_rss_mb']:>7.0f} {r['peak_child_rss_mb']:>10.0f}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="フェイクAPIでのエンドツーエンド・ベンチマーク")
+    parser.add_argument("--scenario", action="append", help="実行するシナリオ（複数指定可。省略時は全部）")
+    parser.add_argument("--update-baseline", action="store_true", help="結果を benchmark_baseline.json に保存する")
+    # 以下は子プロセス用
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--work-dir", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    parser.add_argument("--videos", nargs="*", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    bench_cfg = load_benchmark_config()
+    scenarios = {scenario["name"]: scenario for scenario in bench_cfg.get("scenarios", [])}
+
+    if args.run_scenario:
+        result = run_scenario(bench_cfg, scenarios[args.run_scenario], args.videos, args.work_dir)
+        with open(args.result, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        return
+
+    selected = args.scenario or list(scenarios)
+    unknown = [name for name in selected if name not in scenarios]
+    if unknown:
+        print(f"不明なシナリオ: {', '.join(unknown)}")
+        sys.exit(2)
+
+    synthetic_cfg = bench_cfg.get("synthetic", {})
+    video_dir = os.path.join(OUTPUT_DIR, "videos")
+    os.makedirs(video_dir, exist_ok=True)
+    specs = {spec["name"]: spec for spec in synthetic_cfg.get("videos", [])}
+    needed = {name for scenario in selected for name in scenarios[scenario].get("videos", [])}
+    print(f"合成動画を準備中: {len(needed)} 本")
+    recordings = {name: generate_recording(specs[name], synthetic_cfg, video_dir) for name in sorted(needed)}
+
+    run_dir = os.path.join(OUTPUT_DIR, datetime.now().strftime("%Y%m%d-%H%M%S"))
+    results = {}
+    for name in selected:
+        print(f"シナリオ実行中: {name}")
+        videos = [recordings[video] for video in scenarios[name].get("videos", [])]
+        result = spawn_scenario(name, videos, os.path.join(run_dir, name))
+        if result is not None:
+            results[name] = result
+
+    print_results(results)
+    with open(os.path.join(run_dir, "results.json"), "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    if args.update_baseline:
+        baseline.update(results)
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"\nbaseline を更新しました: {BASELINE_PATH}")
+        return
+    if not baseline:
+        print("\nbaseline がありません（--update-baseline で保存できます）")
+        return
+    regressions = compare(results, baseline, bench_cfg.get("regression_tolerance", 0.15))
+    failed = [name for name in selected if name not in results]
+    if regressions or failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
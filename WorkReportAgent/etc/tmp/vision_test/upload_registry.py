@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from common.fileutil import atomic_write_json, content_hash, file_fingerprint
+from common.tracing import span
+
+# Gemini Files API のファイルはアップロードから48時間で削除される
+DEFAULT_FILE_TTL_HOURS = 48
+REGISTRY_VERSION = 2
+
+class UploadRegistry:
+    """
+    動画の内容ハッシュ → アップロード済みリモートファイル（名前・有効期限）の対応表
+    同じ録画を再解析するときに再アップロードせず使い回すために使う
+    * 対応表はバックエンド（gemini / local_vlm）ごとに分ける（他方のファイル名は引けないので消さない）
+    * 動画パスごとに file_fingerprint と内容ハッシュを覚え、変わっていなければ全体を読み直さない
+    """
+
+    def __init__(self, path, backend="gemini"):
+        self.path = path
+        self.backend = backend
+        self._lock = threading.Lock()
+        data = self._load()
+        self.entries = data["entries"].get(backend, {})
+        self.hashes = data["hashes"]
+
+    def _load(self):
+        data = {"entries": {}, "hashes": {}}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    loaded = json.load(f)
+                if loaded.get("version") == REGISTRY_VERSION:
+                    data = loaded
+            except Exception as e:
+                print(f"アップロード履歴の読み込みに失敗しました（作り直します）: {e}")
+        return data
+
+    def file_hash(self, video_path):
+        """
+        動画の内容ハッシュ（前回から file_fingerprint が変わっていなければ記録した値）
+        """
+        key = os.path.abspath(video_path)
+        fingerprint = file_fingerprint(video_path)
+        with self._lock:
+            known = self.hashes.get(key)
+        if known and known["fingerprint"] == fingerprint:
+            return known["hash"]
+        file_hash = content_hash(video_path)
+        with self._lock:
+            self.hashes[key] = {"fingerprint": fingerprint, "hash": file_hash}
+            self._save_locked()
+        return file_hash
+
+    def lookup(self, file_hash):
+        with self._lock:
+            return self.entries.get(file_hash)
+
+    def record(self, file_hash, remote_file, source_path):
+        expiration = getattr(remote_file, "expiration_time", None)
+        if expiration is None:
+            expiration = datetime.now(timezone.utc) + timedelta(hours=DEFAULT_FILE_TTL_HOURS)
+        with self._lock:
+            self.entries[file_hash] = {
+                "name": remote_file.name,
+                "uri": getattr(remote_file, "uri", None),
+                "expiration_time": to_utc(expiration).isoformat(),
+                "source": os.path.basename(source_path),
+            }
+            self._save_locked()
+
+    def forget(self, file_hash):
+        with self._lock:
+            if self.entries.pop(file_hash, None) is not None:
+                self._save_locked()
+
+    def _save_locked(self):
+        # 他のバックエンドの対応表はファイルにある最新のものを残す
+        data = self._load()
+        data["entries"][self.backend] = self.entries
+        # 消えた動画のハッシュは捨てる
+        data["hashes"] = {path: known for path, known in {**data["hashes"], **self.hashes}.items()
+                          if os.path.exists(path)}
+        self.hashes = data["hashes"]
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        atomic_write_json(self.path, {"version": REGISTRY_VERSION, **data})
+
+def to_utc(value):
+    """
+    datetime / ISO文字列 をタイムゾーン付きUTCの datetime にする
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+def find_reusable(client, registry, file_hash, min_remaining):
+    """
+    有効期限まで min_remaining 以上残っていて ACTIVE なリモートファイルがあれば返す
+    """
+    entry = registry.lookup(file_hash)
+    if not entry:
+        return None
+    if to_utc(entry["expiration_time"]) - datetime.now(timezone.utc) < min_remaining:
+        registry.forget(file_hash)
+        return None
+    try:
+        remote_file = client.files.get(name=entry["name"])
+    except Exception as e:
+        # 期限前に削除された等
+        print(f"登録済みファイルを取得できません（再アップロードします）: {entry['name']} ({e})")
+        registry.forget(file_hash)
+        return None
+    if remote_file.state.name == "FAILED":
+        registry.forget(file_hash)
+        return None
+    return remote_file
+
+def wait_until_processed(client, remote_file, initial_interval=1.0, max_interval=15.0, timeout=900.0):
+    """
+    PROCESSING が終わるまで指数バックオフで待つ。timeout 秒を超えたら TimeoutError
+    """
+    deadline = time.monotonic() + timeout
+    interval = initial_interval
+    while remote_file.state.name == "PROCESSING":
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"動画の処理が {timeout:.0f} 秒以内に完了しませんでした: {remote_file.name}")
+        print(".", end="", flush=True)
+        time.sleep(min(interval, remaining))
+        interval = min(max_interval, interval * 2)
+        remote_file = client.files.get(name=remote_file.name)
+
+    if remote_file.state.name == "FAILED":
+        raise RuntimeError(f"動画の処理に失敗しました: {remote_file.name}")
+    return remote_file
+
+def upload_video(client, video_path, registry, upload_cfg=None):
+    """
+    動画をアップロードして処理完了まで待つ。同じ内容の有効なリモートファイルがあれば再利用する
+    戻り値: (リモートファイル, 動画の内容ハッシュ)
+    """
+    upload_cfg = upload_cfg or {}
+    with span("upload.hash", file=os.path.basename(video_path), bytes=os.path.getsize(video_path)):
+        file_hash = registry.file_hash(video_path)
+    min_remaining = timedelta(hours=upload_cfg.get("min_remaining_hours", 2))
+
+    remote_file = find_reusable(client, registry, file_hash, min_remaining)
+    if remote_file is not None:
+        print(f"アップロード済みファイルを再利用: {remote_file.name} ({os.path.basename(video_path)})")
+    else:
+        print(f"動画ファイルをアップロードしています: {video_path}")
+        with span("upload", file=os.path.basename(video_path), bytes=os.path.getsize(video_path)):
+            remote_file = client.files.upload(file=video_path)
+        print(f"アップロード完了: {remote_file.name}")
+
+    print("動画の処理を待機中...")
+    with span("upload.processing_wait", file=os.path.basename(video_path)):
+        remote_file = wait_until_processed(
+            client,
+            remote_file,
+            initial_interval=upload_cfg.get("poll_initial_seconds", 1.0),
+            max_interval=upload_cfg.get("poll_max_seconds", 15.0),
+            timeout=upload_cfg.get("processing_timeout_seconds", 900),
+        )
+    registry.record(file_hash, remote_file, video_path)
+    print(f"\n動画の処理が完了しました。状態: {remote_file.state.name}")
+    return remote_file, file_hash
+
+def upload_videos(client, video_paths, registry, upload_cfg=None):
+    """
+    複数の動画を並列にアップロードする。戻り値: {動画パス: (リモートファイル, 内容ハッシュ) または例外}
+    """
+    upload_cfg = upload_cfg or {}
+    max_workers = max(1, upload_cfg.get("max_concurrent_uploads", 3))
+
+    def upload(video_path):
+        try:
+            return upload_video(client, video_path, registry, upload_cfg)
+        except Exception as e:
+            print(f"アップロード失敗: {video_path} ({e})")
+            return e
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(video_paths, executor.map(upload, video_paths)))
+
+def registry_from_config(config, base_dir):
+    """
+    config.yml の upload セクションから UploadRegistry を作る（対応表は backend ごと）
+    """
+    path = config.get("upload", {}).get("registry", os.path.join("output", ".cache", "uploads.json"))
+    if not os.path.isabs(path):
+        path = os.path.join(base_dir, path)
+    return UploadRegistry(path, config.get("backend", "gemini"))
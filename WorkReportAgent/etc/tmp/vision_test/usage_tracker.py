@@ -0,0 +1,46 @@
+import time
+import threading
+from client_wrapper import ClientWrapper
+from common.tracing import span, record_usage
+
+class UsageTracker(ClientWrapper):
+    """
+    generate_content の呼び出し回数・所要時間・トークン数を集計する
+    応答キャッシュの外側に置くので、キャッシュから返った呼び出しはトークン0として数える
+    例外で終わった呼び出しも回数と時間に含め、failures にも数える
+    """
+
+    def __init__(self, client):
+        super().__init__(client)
+        self.calls = 0
+        self.failures = 0
+        self.seconds = 0.0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.total_tokens = 0
+        self._lock = threading.Lock()
+
+    def generate_content(self, **kwargs):
+        start = time.monotonic()
+        response = None
+        try:
+            with span("model.generate_content", model=kwargs.get("model")) as call_span:
+                response = self._client.models.generate_content(**kwargs)
+                record_usage(call_span, response)
+        finally:
+            with self._lock:
+                self.calls += 1
+                self.seconds += time.monotonic() - start
+                if response is None:
+                    self.failures += 1
+        usage = getattr(response, "usage_metadata", None)
+        with self._lock:
+            if usage is not None:
+                self.prompt_tokens += getattr(usage, "prompt_token_count", None) or 0
+                self.output_tokens += getattr(usage, "candidates_token_count", None) or 0
+                self.total_tokens += getattr(usage, "total_token_count", None) or 0
+        return response
+
+    def summary(self):
+        return (f"呼び出し {self.calls} 回 (失敗 {self.failures} 回, 合計 {self.seconds:.1f}秒), トークン 入力 {self.prompt_tokens} / "
+                f"出力 {self.output_tokens} / 合計 {self.total_tokens}")
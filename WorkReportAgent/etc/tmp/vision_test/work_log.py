@@ -0,0 +1,122 @@
+import os
+from datetime import datetime, timedelta
+
+from common.media_index import get_media_info, video_summary
+from common.timemap import output_to_source, parse_timestamp
+
+# docs/io_spec.md の作業ログ(TSV)の列
+WORK_LOG_COLUMNS = ["アプリ名", "開始時刻", "終了時刻", "作業タイトル", "作業タグ", "作業手順", "スクショ時刻"]
+
+def recording_start_time(video_path, timemap=None):
+    """
+    録画開始時刻（ローカル時刻）
+    タイムマップの recording_start → 動画の creation_time → 最終更新時刻 - 長さ の順に使う
+    """
+    info = video_summary(get_media_info(video_path)) or {}
+    for value in ((timemap or {}).get("recording_start"), info.get("creation_time")):
+        if value:
+            try:
+                start = datetime.fromisoformat(value.replace("Z", "+00:00"))
+                return start.astimezone().replace(tzinfo=None) if start.tzinfo else start
+            except ValueError:
+                pass
+    return datetime.fromtimestamp(os.path.getmtime(video_path)) - timedelta(seconds=info.get("duration") or 0)
+
+def annotate_clock(sections, start, timemap=None):
+    """
+    セクションの動画内の時刻を録画の実時刻に換算し、clock_*（HH:MM）と source_*（HH:MM:SS）を付ける
+    タイムマップがあれば変換後の動画の時刻を元動画の時刻に戻してから換算する
+    """
+    def clock(timestamp_str):
+        seconds = parse_timestamp(timestamp_str)
+        if timemap:
+            seconds = output_to_source(timemap, seconds)
+        return start + timedelta(seconds=seconds)
+
+    for section in sections:
+        try:
+            section["clock_start"] = clock(section["start_time"]).strftime("%H:%M")
+            section["clock_end"] = clock(section["end_time"]).strftime("%H:%M")
+            section["source_start"] = clock(section["start_time"]).strftime("%H:%M:%S")
+            section["source_end"] = clock(section["end_time"]).strftime("%H:%M:%S")
+            if section.get("screenshot_timestamp"):
+                section["clock_screenshot"] = clock(section["screenshot_timestamp"]).strftime("%H:%M")
+        except (KeyError, ValueError):
+            pass
+
+def write_log(path, sections):
+    """
+    セクションから作業ログを書き出す（時間のかかる作業順）
+    """
+    if os.path.exists(path):
+        os.remove(path)
+    append_rows(path, [section_to_row(section) for section in sections])
+    sort_by_duration(path)
+
+def escape_field(value):
+    """
+    TSVの1フィールドに収まるよう、タブを空白に、改行を \\n に置き換える
+    """
+    return str(value or "").replace("\t", " ").replace("\r", "").replace("\n", "\\n")
+
+def section_to_row(section):
+    """
+    セクション（構造解析の結果に clock_* の時刻を付けたもの）を作業ログの1行にする
+    """
+    steps = section.get("steps") or []
+    steps_markdown = "\n".join(f"- {step}" for step in steps)
+    return [
+        escape_field(section.get("app")),
+        escape_field(section.get("clock_start", section.get("start_time"))),
+        escape_field(section.get("clock_end", section.get("end_time"))),
+        escape_field(section.get("title")),
+        escape_field(",".join(section.get("tags") or [])),
+        escape_field(steps_markdown),
+        escape_field(section.get("clock_screenshot", section.get("screenshot_timestamp"))),
+    ]
+
+def append_rows(path, rows):
+    """
+    作業ログに行を追記する（新規ファイルならヘッダーも書く）
+    """
+    write_header = not os.path.exists(path)
+    with open(path, "a", encoding="utf-8") as f:
+        if write_header:
+            f.write("\t".join(WORK_LOG_COLUMNS) + "\n")
+        for row in rows:
+            f.write("\t".join(row) + "\n")
+
+def read_rows(path):
+    """
+    作業ログの行（ヘッダーを除く）を読み込む
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        lines = [line.rstrip("\n") for line in f if line.strip()]
+    if lines and lines[0].split("\t") == WORK_LOG_COLUMNS:
+        lines = lines[1:]
+    return [line.split("\t") for line in lines]
+
+def clock_minutes(clock):
+    """
+    "HH:MM" / "HH:MM:SS" → 0時からの分数
+    """
+    parts = list(map(int, clock.split(":")))
+    return parts[0] * 60 + parts[1] + (parts[2] / 60 if len(parts) > 2 else 0)
+
+def row_duration_minutes(row):
+    try:
+        return (clock_minutes(row[2]) - clock_minutes(row[1])) % (24 * 60)
+    except (IndexError, ValueError):
+        return 0
+
+def sort_by_duration(path):
+    """
+    作業ログを時間のかかる作業順に並べ替える（io_spec の出力仕様）
+    """
+    rows = sorted(read_rows(path), key=row_duration_minutes, reverse=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("\t".join(WORK_LOG_COLUMNS) + "\n")
+        for row in rows:
+            f.write("\t".join(row) + "\n")
+    os.replace(tmp_path, path)
@@ -0,0 +1,272 @@
+"""
+作業ログ(TSV)を SQLite に集約し、複数作業者・複数日のボトルネックを集計する
+
+    python3 worklog_store.py ingest output/stream/2026-10-01/worklog.tsv --worker tanaka
+    python3 worklog_store.py apps --since 2026-07-01
+    python3 worklog_store.py tags --worker tanaka
+    python3 worklog_store.py slowest --limit 20 --min-count 3
+"""
+import os
+import re
+import sys
+import getpass
+import sqlite3
+import argparse
+from datetime import date
+import yaml
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BASE_DIR, ".."))
+
+from work_log import clock_minutes, read_rows, row_duration_minutes
+
+DATE_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    worker TEXT NOT NULL,
+    day TEXT NOT NULL,
+    source TEXT NOT NULL,
+    app TEXT NOT NULL,
+    start_minute REAL,
+    end_minute REAL,
+    minutes REAL NOT NULL,
+    title TEXT NOT NULL,
+    tags TEXT,
+    steps TEXT,
+    screenshot TEXT
+);
+CREATE TABLE IF NOT EXISTS entry_tags (
+    entry_id INTEGER NOT NULL REFERENCES entries(id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    worker TEXT NOT NULL,
+    day TEXT NOT NULL,
+    minutes REAL NOT NULL
+);
+-- 集計クエリが表を読まずに済むよう、絞り込み列→集計キー→作業者→作業時間 の順の複合インデックスにする
+CREATE INDEX IF NOT EXISTS idx_entries_app ON entries(app, worker, minutes);
+CREATE INDEX IF NOT EXISTS idx_entries_day_app ON entries(day, app, worker, minutes);
+CREATE INDEX IF NOT EXISTS idx_entries_worker_day ON entries(worker, day, app, minutes);
+CREATE INDEX IF NOT EXISTS idx_entries_app_title ON entries(app, title, minutes, worker);
+CREATE INDEX IF NOT EXISTS idx_entries_source ON entries(worker, day, source);
+CREATE INDEX IF NOT EXISTS idx_tags_tag ON entry_tags(tag, worker, minutes);
+CREATE INDEX IF NOT EXISTS idx_tags_day_tag ON entry_tags(day, tag, worker, minutes);
+CREATE INDEX IF NOT EXISTS idx_tags_worker_day ON entry_tags(worker, day, tag, minutes);
+CREATE INDEX IF NOT EXISTS idx_tags_entry ON entry_tags(entry_id);
+"""
+
+def default_worker(config=None):
+    """
+    作業者ID（config の worklog.worker_id → 環境変数 WORKER_ID → OSのユーザー名）
+    """
+    worker = ((config or {}).get("worklog") or {}).get("worker_id")
+    return worker or os.environ.get("WORKER_ID") or getpass.getuser()
+
+def guess_day(path):
+    """
+    作業ログのパスに含まれる日付（output/stream/<日付>/worklog.tsv）。なければ最終更新日
+    """
+    matches = DATE_PATTERN.findall(os.path.abspath(path))
+    if matches:
+        return matches[-1]
+    return date.fromtimestamp(os.path.getmtime(path)).isoformat()
+
+def load_config():
+    config_path = os.path.join(BASE_DIR, "config.yml")
+    if not os.path.exists(config_path):
+        return {}
+    with open(config_path, "r") as f:
+        return yaml.safe_load(f) or {}
+
+def row_to_record(row, worker, day, source):
+    """
+    TSVの1行 → entries の1行
+    """
+    row = (row + [""] * 7)[:7]
+    app, start, end, title, tags, steps, screenshot = row
+    try:
+        start_minute, end_minute = clock_minutes(start), clock_minutes(end)
+    except (IndexError, ValueError):
+        start_minute = end_minute = None
+    return (worker, day, source, app or "不明", start_minute, end_minute, row_duration_minutes(row),
+            title, tags, steps, screenshot)
+
+class WorkLogStore:
+    """
+    作業ログの SQLite ストア
+    作業者・日付・アプリ・タグの複合インデックスで、数か月×数百人分でも集計を即座に返す
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def insert_rows(self, rows, worker, day, source):
+        """
+        TSVの行をまとめて登録する（1トランザクション）
+        同じ作業者・日付・取り込み元（作業ログや動画のファイル名）の既存の行は置き換えるので、
+        同じログを何度取り込んでも重複しない
+        戻り値: 登録した行数
+        """
+        records = [row_to_record(row, worker, day, source) for row in rows if any(row)]
+        with self.conn:
+            # entry_tags は外部キーの ON DELETE CASCADE で一緒に消える
+            self.conn.execute("DELETE FROM entries WHERE worker = ? AND day = ? AND source = ?",
+                              (worker, day, source))
+            self.conn.executemany(
+                "INSERT INTO entries (worker, day, source, app, start_minute, end_minute, minutes,"
+                " title, tags, steps, screenshot) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                records)
+            # タグは1行に複数あるので別表に展開する（集計用に作業者・日付・作業時間も持たせる）
+            self.conn.execute(
+                """
+                INSERT INTO entry_tags (entry_id, tag, worker, day, minutes)
+                WITH RECURSIVE split(entry_id, worker, day, minutes, tag, rest) AS (
+                    SELECT id, worker, day, minutes, '', tags || ',' FROM entries
+                    WHERE worker = ? AND day = ? AND source = ?
+                    UNION ALL
+                    SELECT entry_id, worker, day, minutes,
+                           trim(substr(rest, 1, instr(rest, ',') - 1)),
+                           substr(rest, instr(rest, ',') + 1)
+                    FROM split WHERE rest != ''
+                )
+                SELECT entry_id, tag, worker, day, minutes FROM split WHERE tag != ''
+                """,
+                (worker, day, source))
+        return len(records)
+
+    def ingest_tsv(self, path, worker, day=None, source=None):
+        """
+        作業ログ(TSV)を取り込む。source を省略したら作業ログのパスを取り込み元とする
+        """
+        return self.insert_rows(read_rows(path), worker, day or guess_day(path), source or os.path.abspath(path))
+
+    def _filters(self, worker=None, since=None, until=None):
+        clauses, params = [], []
+        if worker:
+            clauses.append("worker = ?")
+            params.append(worker)
+        if since:
+            clauses.append("day >= ?")
+            params.append(since)
+        if until:
+            clauses.append("day <= ?")
+            params.append(until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _totals(self, table, key, worker=None, since=None, until=None):
+        """
+        key ごとの合計時間・件数・作業者数
+        COUNT(DISTINCT worker) は一時B木を作って遅いので、先に (key, 作業者) で集計してから数える
+        """
+        where, params = self._filters(worker, since, until)
+        return self.conn.execute(
+            f"SELECT {key}, SUM(total) AS total, SUM(n), COUNT(*) FROM"
+            f" (SELECT {key}, worker, SUM(minutes) AS total, COUNT(*) AS n FROM {table}{where}"
+            f" GROUP BY {key}, worker)"
+            f" GROUP BY {key} ORDER BY total DESC", params).fetchall()
+
+    def time_per_app(self, worker=None, since=None, until=None):
+        """
+        アプリごとの合計時間。戻り値: [(アプリ, 合計分, 件数, 作業者数)]（合計時間の長い順）
+        """
+        return self._totals("entries", "app", worker, since, until)
+
+    def time_per_tag(self, worker=None, since=None, until=None):
+        """
+        タグごとの合計時間。戻り値: [(タグ, 合計分, 件数, 作業者数)]（合計時間の長い順）
+        """
+        return self._totals("entry_tags", "tag", worker, since, until)
+
+    def slowest_tasks(self, worker=None, since=None, until=None, limit=20, min_count=1):
+        """
+        同じアプリ・タイトルの作業を平均所要時間の長い順に並べる（共通のボトルネック候補）
+        作業者数は上位 limit 件についてだけインデックスで数える
+        戻り値: [(アプリ, タイトル, 平均分, 最大分, 件数, 作業者数)]
+        """
+        where, params = self._filters(worker, since, until)
+        ranked = self.conn.execute(
+            f"SELECT app, title, AVG(minutes) AS average, MAX(minutes), COUNT(*) AS n FROM entries{where}"
+            " GROUP BY app, title HAVING n >= ? ORDER BY average DESC LIMIT ?",
+            params + [min_count, limit]).fetchall()
+        extra = where.replace(" WHERE ", " AND ")
+        results = []
+        for app, title, average, longest, count in ranked:
+            workers = self.conn.execute(
+                f"SELECT COUNT(DISTINCT worker) FROM entries WHERE app = ? AND title = ?{extra}",
+                [app, title] + params).fetchone()[0]
+            results.append((app, title, average, longest, count, workers))
+        return results
+
+def store_from_config(config, base_dir):
+    """
+    config の worklog.db のストア（相対パスは base_dir から）
+    """
+    path = (config.get("worklog") or {}).get("db", "output/worklog.db")
+    if not os.path.isabs(path):
+        path = os.path.join(base_dir, path)
+    return WorkLogStore(path)
+
+def print_table(headers, rows):
+    print("\t".join(headers))
+    for row in rows:
+        print("\t".join(f"{value:.1f}" if isinstance(value, float) else str(value) for value in row))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="作業ログの集約と集計")
+    parser.add_argument("--db", help="SQLite ファイル（省略時は config.yml の worklog.db）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    ingest = sub.add_parser("ingest", help="作業ログ(TSV)を取り込む")
+    ingest.add_argument("paths", nargs="+", help="worklog.tsv のパス")
+    ingest.add_argument("--worker", help="作業者ID（省略時は config / WORKER_ID / ユーザー名）")
+    ingest.add_argument("--day", help="日付 YYYY-MM-DD（省略時はパスの日付か最終更新日）")
+
+    for name, help_text in (("apps", "アプリごとの合計時間"), ("tags", "タグごとの合計時間"),
+                            ("slowest", "平均所要時間の長い作業")):
+        query = sub.add_parser(name, help=help_text)
+        query.add_argument("--worker", help="作業者で絞り込む")
+        query.add_argument("--since", help="この日付以降 (YYYY-MM-DD)")
+        query.add_argument("--until", help="この日付まで (YYYY-MM-DD)")
+        if name == "slowest":
+            query.add_argument("--limit", type=int, default=20)
+            query.add_argument("--min-count", type=int, default=1, help="この件数以上記録された作業だけ")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    config = load_config()
+    store = WorkLogStore(args.db) if args.db else store_from_config(config, BASE_DIR)
+
+    with store:
+        if args.command == "ingest":
+            worker = args.worker or default_worker(config)
+            total = sum(store.ingest_tsv(path, worker, args.day) for path in args.paths)
+            print(f"{total} 行を取り込みました ({worker}): {store.path}")
+        elif args.command == "apps":
+            print_table(["アプリ名", "合計(分)", "件数", "作業者数"],
+                        store.time_per_app(args.worker, args.since, args.until))
+        elif args.command == "tags":
+            print_table(["作業タグ", "合計(分)", "件数", "作業者数"],
+                        store.time_per_tag(args.worker, args.since, args.until))
+        elif args.command == "slowest":
+            print_table(["アプリ名", "作業タイトル", "平均(分)", "最大(分)", "件数", "作業者数"],
+                        store.slowest_tasks(args.worker, args.since, args.until, args.limit, args.min_count))
+
+if __name__ == "__main__":
+    main()